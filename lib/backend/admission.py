@@ -0,0 +1,286 @@
+"""Admission control in front of the model: per-client rate limits and a fair queue.
+
+* ``TokenBucket`` limits each client (API key, user id or IP) to a sustained
+  rate with a burst allowance. Buckets live in the shared state, so the limit
+  holds across worker processes. An empty bucket is a 429 with Retry-After.
+  The limit is off by default: the mobile app sends neither a key nor a user
+  id, and without a trusted proxy every client would share the proxy's
+  address and so one bucket.
+* ``client_address`` is the peer address, or - when the peer is one of the
+  trusted proxies in FORWARDED_ALLOW_IPS - the nearest untrusted address in
+  X-Forwarded-For. Anyone else's X-Forwarded-For is ignored, so it cannot be
+  used to pick a fresh bucket per request.
+* ``FairQueue`` hands out the global model-call slots. Waiters are grouped
+  into lanes - ``priority`` for requests with a Premium API key, ``standard``
+  for everyone else - served in proportion to the lane weights, and inside a
+  lane clients take turns, so one chatty client cannot starve the others. The
+  lane follows only from a verified key, never from anything else a client
+  can choose (path, scenario). A full queue sheds new requests immediately
+  (503).
+
+Handlers declare who is calling via ``set_client``; the LLM call path reads
+it from a context variable, which also reaches background tasks such as the
+split-mode feedback analysis.
+
+Configuration (environment variables):
+    RATE_LIMIT_PER_MINUTE          model-backed requests per client per minute (default 0 = off)
+    RATE_LIMIT_BURST               bucket size (default 10)
+    RATE_LIMIT_PREMIUM_PER_MINUTE  limit for PREMIUM_API_KEYS (default 120)
+    PREMIUM_API_KEYS               comma-separated API keys treated as Premium (priority lane)
+    FORWARDED_ALLOW_IPS            comma-separated proxy addresses or networks whose
+                                   X-Forwarded-For is trusted, "*" for any (default none)
+    LLM_QUEUE_MAX_DEPTH            waiters before new requests are shed (default 64)
+    LLM_PRIORITY_WEIGHT            priority-lane share relative to standard (default 3)
+"""
+import asyncio
+import contextvars
+import hashlib
+import ipaddress
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, NamedTuple, Optional, Union
+
+from shared_state import HOT_BUSY_TIMEOUT, LocalState, SharedState, StateBusyError, shared_state
+
+PRIORITY = "priority"
+STANDARD = "standard"
+
+
+class Client(NamedTuple):
+    key: str
+    lane: str = STANDARD
+    premium: bool = False
+
+
+_current_client: contextvars.ContextVar[Client] = contextvars.ContextVar(
+    "current_client", default=Client("anonymous")
+)
+
+
+def current_client() -> Client:
+    return _current_client.get()
+
+
+def set_client(client: Client) -> None:
+    _current_client.set(client)
+
+
+class RateLimitedError(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(f"Rate limit exceeded, retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float, burst: float, premium_per_minute: float,
+                 state: Optional[SharedState] = None):
+        self.rate = per_minute / 60.0
+        self.premium_rate = premium_per_minute / 60.0
+        self.burst = max(1.0, burst)
+        self._state = state or LocalState()
+        self.limited = 0
+        self.unchecked = 0
+
+    async def take(self, client: Client) -> None:
+        """Spend one token for ``client`` or raise RateLimitedError."""
+        rate = self.premium_rate if client.premium else self.rate
+        if rate <= 0:
+            return
+        burst = self.burst
+        outcome: Dict[str, float] = {}
+
+        def spend(bucket: Optional[dict]) -> dict:
+            now = time.time()
+            tokens = burst if bucket is None else min(burst, bucket["tokens"] + (now - bucket["at"]) * rate)
+            if tokens >= 1.0:
+                tokens -= 1.0
+                outcome["retry_after"] = 0.0
+            else:
+                outcome["retry_after"] = (1.0 - tokens) / rate
+            return {"tokens": tokens, "at": now}
+
+        # A bucket idle for burst/rate seconds is full again, so it can expire then
+        try:
+            await self._state.run(
+                self._state.update, "rate_limit", client.key, spend, burst / rate + 1, busy_timeout=HOT_BUSY_TIMEOUT
+            )
+        except StateBusyError:
+            self.unchecked += 1  # the store is locked by a slow writer: let the request through unmetered
+            return
+        if outcome["retry_after"] > 0:
+            self.limited += 1
+            raise RateLimitedError(outcome["retry_after"])
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class FairQueue:
+    """Weighted fair queue for ``capacity`` concurrent slots.
+
+    Lanes are picked by stride scheduling (each grant advances the lane's
+    pass by 1/weight; the non-empty lane with the lowest pass goes next) and
+    clients inside a lane are served round-robin.
+    """
+
+    def __init__(self, capacity: int, weights: Dict[str, float], max_depth: int = 64):
+        self.capacity = max(1, capacity)
+        self.weights = weights
+        self.max_depth = max_depth
+        self.in_use = 0
+        self.depth = 0
+        self._lanes: Dict[str, "OrderedDict[str, Deque[asyncio.Future]]"] = {lane: OrderedDict() for lane in weights}
+        self._pass: Dict[str, float] = {lane: 0.0 for lane in weights}
+        self._vtime = 0.0
+        self.shed: Dict[str, int] = {lane: 0 for lane in weights}
+        self.granted: Dict[str, int] = {lane: 0 for lane in weights}
+
+    def lane_depth(self, lane: str) -> int:
+        return sum(len(q) for q in self._lanes[lane].values())
+
+    def try_acquire(self, client: Client) -> bool:
+        """Take a slot only if one is free and nobody is waiting for it."""
+        if self.in_use < self.capacity and self.depth == 0:
+            self.in_use += 1
+            self.granted[client.lane if client.lane in self._lanes else STANDARD] += 1
+            return True
+        return False
+
+    async def acquire(self, client: Client, timeout: float) -> None:
+        lane = client.lane if client.lane in self._lanes else STANDARD
+        if self.try_acquire(client):
+            return
+        if self.depth >= self.max_depth:
+            self.shed[lane] += 1
+            raise QueueFullError()
+
+        waiters = self._lanes[lane]
+        if not waiters:
+            # An idle lane re-enters at the current virtual time instead of cashing in saved credit
+            self._pass[lane] = max(self._pass[lane], self._vtime)
+        future = asyncio.get_running_loop().create_future()
+        waiters.setdefault(client.key, deque()).append(future)
+        self.depth += 1
+        try:
+            async with asyncio.timeout(timeout):  # unlike wait_for, never swallows a cancellation
+                await future
+        except BaseException:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as we gave up: pass it on
+                self.release()
+            else:
+                self._discard(lane, client.key, future)
+            raise
+        self.granted[lane] += 1
+
+    def _discard(self, lane: str, key: str, future: asyncio.Future) -> None:
+        queue = self._lanes[lane].get(key)
+        if queue is not None and future in queue:
+            queue.remove(future)
+            self.depth -= 1
+            if not queue:
+                del self._lanes[lane][key]
+
+    def _next_waiter(self) -> Optional[asyncio.Future]:
+        lanes = [lane for lane, waiters in self._lanes.items() if waiters]
+        if not lanes:
+            return None
+        lane = min(lanes, key=lambda name: self._pass[name])
+        self._vtime = self._pass[lane]
+        self._pass[lane] += 1.0 / self.weights[lane]
+        waiters = self._lanes[lane]
+        key, queue = waiters.popitem(last=False)
+        future = queue.popleft()
+        if queue:
+            waiters[key] = queue  # back of the line for this client's next request
+        self.depth -= 1
+        return future
+
+    def release(self) -> None:
+        while True:
+            future = self._next_waiter()
+            if future is None:
+                self.in_use -= 1
+                return
+            if not future.done():
+                future.set_result(None)  # the slot moves straight to the waiter
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "capacity": self.capacity,
+            "in_use": self.in_use,
+            "depth": {lane: self.lane_depth(lane) for lane in self._lanes},
+            "shed": dict(self.shed),
+            "granted": dict(self.granted),
+        }
+
+
+def client_key(api_key: Optional[str], user_id: Optional[str], host: Optional[str]) -> str:
+    if api_key:
+        return "key:" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+    if user_id:
+        return "user:" + user_id[:128]
+    return "ip:" + (host or "unknown")
+
+
+_Network = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+
+def _trusted_proxies(value: str) -> Optional[List[_Network]]:
+    """Parsed FORWARDED_ALLOW_IPS; None means every peer is trusted ("*")."""
+    networks: List[_Network] = []
+    for item in (part.strip() for part in value.split(",")):
+        if item == "*":
+            return None
+        if item:
+            networks.append(ipaddress.ip_network(item, strict=False))
+    return networks
+
+
+TRUSTED_PROXIES = _trusted_proxies(os.environ.get("FORWARDED_ALLOW_IPS", ""))
+
+
+def _is_trusted(host: str) -> bool:
+    if TRUSTED_PROXIES is None:
+        return True
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in TRUSTED_PROXIES)
+
+
+def client_address(peer: Optional[str], forwarded_for: Optional[str]) -> Optional[str]:
+    """The caller's address: X-Forwarded-For is only read when ``peer`` is a trusted proxy."""
+    if not peer or not forwarded_for or not _is_trusted(peer):
+        return peer
+    # Proxies append, so walk back from the nearest hop to the first one we do not run
+    hops = [hop.strip() for hop in forwarded_for.split(",") if hop.strip()]
+    for hop in reversed(hops):
+        if not _is_trusted(hop):
+            return hop
+    return hops[0] if hops else peer
+
+
+PREMIUM_API_KEYS = {k.strip() for k in os.environ.get("PREMIUM_API_KEYS", "").split(",") if k.strip()}
+
+
+def client_for(api_key: Optional[str], user_id: Optional[str], host: Optional[str]) -> Client:
+    premium = bool(api_key) and api_key in PREMIUM_API_KEYS
+    return Client(client_key(api_key, user_id, host), PRIORITY if premium else STANDARD, premium)
+
+
+def bucket_from_env() -> TokenBucket:
+    return TokenBucket(
+        per_minute=float(os.environ.get("RATE_LIMIT_PER_MINUTE", 0)),
+        burst=float(os.environ.get("RATE_LIMIT_BURST", 10)),
+        premium_per_minute=float(os.environ.get("RATE_LIMIT_PREMIUM_PER_MINUTE", 120)),
+        state=shared_state(),
+    )
+
+
+def queue_weights_from_env() -> Dict[str, float]:
+    return {PRIORITY: max(0.1, float(os.environ.get("LLM_PRIORITY_WEIGHT", 3))), STANDARD: 1.0}
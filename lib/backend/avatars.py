@@ -0,0 +1,234 @@
+"""Avatar uploads: streamed, size-capped, content-addressed, with small variants.
+
+* The multipart body is parsed straight from the request stream (no
+  spooling by the framework first, see multipart_stream.py) and the file
+  part is written to disk once, in chunks, off the event loop. The upload
+  is aborted as soon as the file passes ``AVATAR_MAX_BYTES`` or the body
+  its envelope allowance; a Content-Length that is already too large is
+  refused before anything is read.
+* The type comes from the file's magic bytes (JPEG, PNG, GIF, WebP), not
+  from the client's file name.
+* Files are stored as ``avatars/<sha256>.<ext>``. Uploading the same image
+  again finds the existing file and variants and skips the write, the
+  decoding and the resizing.
+* Square WebP variants (``<sha256>_<size>.webp``) are rendered in a small
+  thread pool (Pillow releases the GIL while decoding and resizing), so the
+  leaderboard can load a 64px image instead of a full-size photo. Without
+  Pillow installed only the original is stored.
+
+Configuration (environment variables):
+    AVATAR_MAX_BYTES   largest accepted upload in bytes (default 5242880)
+    AVATAR_SIZES       comma-separated variant edge lengths in px (default "64,128,256")
+    AVATAR_WORKERS     threads rendering variants (default 2)
+"""
+import asyncio
+import hashlib
+import importlib.util
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, List, NamedTuple, Optional, Tuple
+
+from metrics import REGISTRY
+from multipart_stream import ENVELOPE_BYTES, FileField, MultipartError, check_length
+
+# Variants are optional; without Pillow originals are still stored. Pillow itself is
+# imported by the first upload that needs it, not at startup.
+HAS_PILLOW = importlib.util.find_spec("PIL") is not None
+
+FILE_FIELD = b"file"
+
+_SIGNATURES: Tuple[Tuple[bytes, str], ...] = (
+    (b"\xff\xd8\xff", "jpg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+)
+
+# Bytes needed to tell every signature above and WebP's "RIFF....WEBP" apart
+_SNIFF_BYTES = 12
+
+UPLOADS = REGISTRY.counter("avatar_uploads_total", "Avatar uploads by outcome", ("outcome",))
+
+
+class AvatarError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class StoredAvatar(NamedTuple):
+    original: str  # path relative to the uploads directory
+    variants: Dict[int, str]
+    deduplicated: bool
+
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    """File extension for the image type in ``head`` (the first bytes), or None."""
+    for signature, ext in _SIGNATURES:
+        if head.startswith(signature):
+            return ext
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def _render_variants(source: str, directory: str, digest: str, sizes: List[int]) -> Dict[int, str]:
+    from PIL import Image, ImageOps
+
+    variants: Dict[int, str] = {}
+    try:
+        with Image.open(source) as image:
+            image = ImageOps.exif_transpose(image)
+            image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+            for size in sizes:
+                name = f"{digest}_{size}.webp"
+                path = os.path.join(directory, name)
+                if not os.path.exists(path):
+                    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+                    ImageOps.fit(image, (size, size), Image.LANCZOS).save(tmp, "WEBP", quality=80, method=4)
+                    os.replace(tmp, path)  # concurrent uploads of the same image race harmlessly
+                variants[size] = name
+    except Image.DecompressionBombError as e:
+        raise ValueError(str(e)) from e
+    return variants
+
+
+class AvatarStore:
+    def __init__(self, directory: str, max_bytes: int = 5 * 1024 * 1024,
+                 sizes: Tuple[int, ...] = (64, 128, 256), workers: int = 2):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.sizes = sorted(set(sizes))
+        self.workers = max(1, workers)
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._pid = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def pool(self) -> ThreadPoolExecutor:
+        # Threads do not survive fork(), so each worker process starts its own pool
+        if self._pool is None or self._pid != os.getpid():
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="avatars")
+            self._pid = os.getpid()
+        return self._pool
+
+    def check_length(self, content_length: Optional[str]) -> None:
+        """Refuse a request whose declared body is already over the cap."""
+        try:
+            check_length(content_length, self.max_bytes + ENVELOPE_BYTES)
+        except MultipartError:
+            raise self._too_large() from None
+
+    @staticmethod
+    def _sniff(head: bytes) -> str:
+        ext = sniff_image_type(head)
+        if ext is None:
+            UPLOADS.inc(outcome="rejected")
+            raise AvatarError(400, "Only JPEG, PNG, GIF or WebP images are allowed")
+        return ext
+
+    def _too_large(self) -> AvatarError:
+        UPLOADS.inc(outcome="too_large")
+        return AvatarError(413, f"Avatar must be at most {self.max_bytes // 1024} KB")
+
+    async def _spool(self, body: AsyncIterator[bytes], content_type: Optional[str]) -> Tuple[str, str, str]:
+        """Stream the multipart body's ``file`` field to a temp file, hashing as it goes.
+
+        Returns (tmp path, sha256, ext).
+        """
+        try:
+            field = FileField(content_type, FILE_FIELD, self.max_bytes + ENVELOPE_BYTES)
+        except MultipartError as e:
+            UPLOADS.inc(outcome="rejected")
+            raise AvatarError(400, e.detail) from None
+
+        loop = asyncio.get_running_loop()
+        tmp = os.path.join(self.directory, f".upload-{uuid.uuid4().hex}.tmp")
+        digest = hashlib.sha256()
+        size = 0
+        ext = None
+        head = b""  # the file's first bytes, held until there are enough to sniff
+        out = await loop.run_in_executor(None, open, tmp, "wb")
+        try:
+            async for data in field.chunks(body):
+                size += len(data)
+                if size > self.max_bytes:
+                    raise self._too_large()
+                if ext is None:
+                    head += data
+                    if len(head) < _SNIFF_BYTES:
+                        continue  # a network chunk can end a few bytes into the file
+                    ext = self._sniff(head)
+                    data, head = head, b""
+                digest.update(data)
+                await loop.run_in_executor(None, out.write, data)
+            if ext is None:
+                if not head:
+                    UPLOADS.inc(outcome="rejected")
+                    raise AvatarError(400, "Empty file" if field.found else "No file uploaded")
+                ext = self._sniff(head)  # a file shorter than the longest signature
+                digest.update(head)
+                await loop.run_in_executor(None, out.write, head)
+        except MultipartError as e:
+            out.close()
+            os.remove(tmp)
+            if e.too_large:
+                raise self._too_large() from None
+            UPLOADS.inc(outcome="rejected")
+            raise AvatarError(400, e.detail) from None
+        except BaseException:
+            out.close()
+            os.remove(tmp)
+            raise
+        await loop.run_in_executor(None, out.close)
+        return tmp, digest.hexdigest(), ext
+
+    def _existing_variants(self, digest: str) -> Optional[Dict[int, str]]:
+        """Variant names when every one is already on disk, else None."""
+        variants = {size: f"{digest}_{size}.webp" for size in self.sizes}
+        if all(os.path.exists(os.path.join(self.directory, name)) for name in variants.values()):
+            return variants
+        return None
+
+    async def save(self, body: AsyncIterator[bytes], content_type: Optional[str]) -> StoredAvatar:
+        """Store the ``file`` field of a multipart request body (``request.stream()``)."""
+        tmp, digest, ext = await self._spool(body, content_type)
+        name = f"{digest}.{ext}"
+        path = os.path.join(self.directory, name)
+        deduplicated = os.path.exists(path)
+        if deduplicated:
+            os.remove(tmp)
+        else:
+            os.replace(tmp, path)
+
+        variants: Dict[int, str] = {}
+        existing = self._existing_variants(digest) if deduplicated else None
+        if existing is not None:
+            variants = existing  # already decoded and rendered when it was first uploaded
+        elif HAS_PILLOW:
+            loop = asyncio.get_running_loop()
+            try:
+                variants = await loop.run_in_executor(
+                    self.pool, _render_variants, path, self.directory, digest, self.sizes
+                )
+            except (OSError, ValueError):
+                # Right magic bytes but not a decodable image
+                if not deduplicated:
+                    os.remove(path)
+                UPLOADS.inc(outcome="rejected")
+                raise AvatarError(400, "Image could not be decoded")
+
+        UPLOADS.inc(outcome="deduplicated" if deduplicated else "stored")
+        return StoredAvatar(name, variants, deduplicated)
+
+
+def avatars_from_env(uploads_dir: str) -> AvatarStore:
+    sizes = tuple(int(s) for s in os.environ.get("AVATAR_SIZES", "64,128,256").split(",") if s.strip())
+    return AvatarStore(
+        os.path.join(uploads_dir, "avatars"),
+        max_bytes=int(os.environ.get("AVATAR_MAX_BYTES", 5 * 1024 * 1024)),
+        sizes=sizes,
+        workers=int(os.environ.get("AVATAR_WORKERS", 2)),
+    )
@@ -0,0 +1,245 @@
+"""End-to-end latency and throughput of the main API endpoints.
+
+Drives the app in-process (httpx ASGI transport, no network, no API key)
+with the local stand-in model, one endpoint at a time, at increasing
+client concurrency:
+
+    scenarios          GET  /scenarios
+    conversation       POST /conversation
+    ielts_conversation POST /ielts/conversation
+    ielts_evaluate     POST /ielts/evaluate      (graded by the background jobs)
+    upload_avatar      POST /upload/avatar       (distinct PNG per request, written to a temp dir)
+
+Every request carries a unique message or image, and the reply cache is
+off (``--cache`` turns it on), so each request reaches the model or the
+disk. Reported per endpoint and concurrency: throughput, p50/p95/p99
+latency, non-2xx responses and event-loop lag (how late a 10 ms timer on
+the same loop fires; client and server share the loop, so this is an
+upper bound for the server's own stalls).
+
+Results are written as JSON together with the git commit, so two runs can
+be compared:
+
+    cd lib/backend
+    python benchmarks/api_suite.py --out /tmp/before.json
+    git checkout my-branch
+    python benchmarks/api_suite.py --out /tmp/after.json --compare /tmp/before.json
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+os.environ.setdefault("RATE_LIMIT_PER_MINUTE", "0")  # every simulated client shares one address
+os.environ.setdefault("HEALTH_PROBE_INTERVAL", "0")
+os.environ.setdefault("PROGRESS_DB_PATH", ":memory:")
+os.environ.setdefault("LLM_PROVIDER", "local")
+
+import httpx  # noqa: E402
+from PIL import Image  # noqa: E402
+
+import llm  # noqa: E402
+import main  # noqa: E402
+from providers import LocalProvider  # noqa: E402
+
+ENDPOINTS = ["scenarios", "conversation", "ielts_conversation", "ielts_evaluate", "upload_avatar"]
+LAG_INTERVAL = 0.01
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def _png(seed: int) -> bytes:
+    image = Image.new("RGB", (320, 240), ((seed * 37) % 256, (seed * 91) % 256, (seed * 53) % 256))
+    image.putpixel((0, 0), (seed % 256, (seed >> 8) % 256, (seed >> 16) % 256))  # distinct content hash
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+class Requests:
+    """Builds the i-th request for an endpoint; every one differs so nothing is served from a cache."""
+
+    def __init__(self, run_id: str):
+        self.run_id = run_id
+        self._images = {}
+
+    def prepare(self, endpoint: str, count: int, offset: int) -> None:
+        if endpoint == "upload_avatar":
+            self._images = {i: _png(i) for i in range(offset, offset + count)}
+
+    def send(self, client: httpx.AsyncClient, endpoint: str, i: int):
+        message = f"I would like to practise ordering food, attempt {self.run_id}-{i}."
+        if endpoint == "scenarios":
+            return client.get("/scenarios")
+        if endpoint == "conversation":
+            return client.post("/conversation", json={
+                "scenario": "restaurant",
+                "user_message": message,
+                "conversation_history": [
+                    {"role": "assistant", "content": "Welcome! Do you have a reservation?"},
+                    {"role": "user", "content": "No, we don't. Is there a table for two?"},
+                ],
+            })
+        if endpoint == "ielts_conversation":
+            return client.post("/ielts/conversation", json={
+                "part": 1,
+                "user_message": f"I live in a small town near the coast and I really enjoy it ({self.run_id}-{i}).",
+                "conversation_history": [{"role": "assistant", "content": "Where do you live?"}],
+            })
+        if endpoint == "ielts_evaluate":
+            return client.post("/ielts/evaluate", json={"conversation_history": [
+                {"role": "assistant", "content": "Let's talk about your hometown. Where do you live?"},
+                {"role": "user", "content": f"I live in Izmir, which is a big city by the sea ({self.run_id}-{i})."},
+                {"role": "assistant", "content": "What do you like about it?"},
+                {"role": "user", "content": "The weather is warm, and however busy it gets, people are friendly."},
+            ]})
+        if endpoint == "upload_avatar":
+            return client.post("/upload/avatar", files={"file": ("avatar.png", self._images.pop(i), "image/png")})
+        raise ValueError(endpoint)
+
+
+async def _watch_loop(samples: list, stop: asyncio.Event) -> None:
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(LAG_INTERVAL)
+        samples.append(max(0.0, loop.time() - started - LAG_INTERVAL))
+
+
+async def run_level(client: httpx.AsyncClient, requests: Requests, endpoint: str,
+                    concurrency: int, total: int, offset: int) -> dict:
+    requests.prepare(endpoint, total, offset)
+    latencies, statuses = [], {}
+    next_index = iter(range(offset, offset + total))
+
+    async def worker():
+        for i in next_index:
+            started = time.perf_counter()
+            try:
+                status = (await requests.send(client, endpoint, i)).status_code
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    lag, stop = [], asyncio.Event()
+    watcher = asyncio.create_task(_watch_loop(lag, stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await watcher
+    errors = sum(n for status, n in statuses.items() if not status.startswith("2"))
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "statuses": statuses,
+        "seconds": round(elapsed, 3),
+        "rps": round(total / elapsed, 1),
+        "p50_ms": round(1000 * _percentile(latencies, 50), 2),
+        "p95_ms": round(1000 * _percentile(latencies, 95), 2),
+        "p99_ms": round(1000 * _percentile(latencies, 99), 2),
+        "loop_lag_p99_ms": round(1000 * _percentile(lag, 99), 2) if lag else 0.0,
+        "loop_lag_max_ms": round(1000 * max(lag), 2) if lag else 0.0,
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_row(row: dict, baseline: dict = None) -> None:
+    line = (f"{row['endpoint']:<20}{row['concurrency']:>5}{row['rps']:>9.1f}{row['p50_ms']:>9.1f}"
+            f"{row['p95_ms']:>9.1f}{row['p99_ms']:>9.1f}{row['loop_lag_p99_ms']:>9.1f}{row['errors']:>7}")
+    if baseline is not None:
+        rps = 100 * (row["rps"] / baseline["rps"] - 1) if baseline["rps"] else 0.0
+        p95 = 100 * (row["p95_ms"] / baseline["p95_ms"] - 1) if baseline["p95_ms"] else 0.0
+        line += f"   rps {rps:+6.1f}%  p95 {p95:+6.1f}%"
+    print(line)
+
+
+async def main_async(args) -> None:
+    main.response_cache.enabled = args.cache
+    main.avatar_store.directory = tempfile.mkdtemp(prefix="elo-bench-avatars-")
+    llm.configure(
+        new_limiter=llm.ConcurrencyLimiter(args.limit, queue_timeout=args.queue_timeout),
+        provider=LocalProvider(latency=args.latency, token_rate=args.token_rate),
+    )
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {(r["endpoint"], r["concurrency"]): r for r in json.load(f)["results"]}
+
+    run_id = f"{os.getpid()}-{int(time.time())}"
+    requests = Requests(run_id)
+    results = []
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            print(f"stub latency={args.latency}s token_rate={args.token_rate}/s  requests/level={args.requests}  "
+                  f"limit={args.limit}  commit={_git_commit()}")
+            print(f"{'endpoint':<20}{'conc':>5}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+                  f"{'lag p99':>9}{'errors':>7}")
+            offset = 0
+            for endpoint in args.endpoints:
+                await run_level(client, requests, endpoint, 1, 2, offset)  # warm-up, not reported
+                offset += 2
+                for concurrency in args.levels:
+                    row = await run_level(client, requests, endpoint, concurrency, args.requests, offset)
+                    offset += args.requests
+                    results.append(row)
+                    print_row(row, baseline.get((endpoint, concurrency)) if args.compare else None)
+
+    report = {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {
+            "latency": args.latency,
+            "token_rate": args.token_rate,
+            "requests": args.requests,
+            "levels": args.levels,
+            "limit": args.limit,
+            "cache": args.cache,
+        },
+        "results": results,
+    }
+    out = args.out or os.path.join(BACKEND, "benchmarks", "results", f"api-{report['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {out}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.05, help="stub model time to first token in seconds")
+    parser.add_argument("--token-rate", type=float, default=0, help="stub tokens per second, 0 = instant")
+    parser.add_argument("--requests", type=int, default=100, help="requests per endpoint and concurrency level")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--endpoints", nargs="+", default=ENDPOINTS, choices=ENDPOINTS)
+    parser.add_argument("--limit", type=int, default=16, help="global LLM concurrency limit")
+    parser.add_argument("--queue-timeout", type=float, default=30.0)
+    parser.add_argument("--cache", action="store_true", help="leave the reply cache on")
+    parser.add_argument("--out", help="JSON results file (default benchmarks/results/api-<commit>.json)")
+    parser.add_argument("--compare", help="earlier results file to print relative changes against")
+    asyncio.run(main_async(parser.parse_args()))
@@ -0,0 +1,88 @@
+"""Cold start: time from launching the server to the first /scenarios response.
+
+Starts the API under uvicorn in a fresh process several times and polls
+``GET /scenarios`` until it answers 200. Reported per run: time to the
+first response, and the server's own startup phases from ``/health``
+(interpreter, imports, init, lifespan, plus the background provider
+warm-up). The provider defaults to Gemini with a dummy key and the health
+prober off, so the real SDK import is part of the measurement but nothing
+goes over the network.
+
+    cd lib/backend
+    python benchmarks/cold_start.py --runs 5
+    python benchmarks/cold_start.py --provider local
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def cold_start(provider: str) -> dict:
+    port = _free_port()
+    env = dict(
+        os.environ,
+        LLM_PROVIDER=provider,
+        GEMINI_API_KEY=os.environ.get("GEMINI_API_KEY", "cold-start-benchmark"),
+        HEALTH_PROBE_INTERVAL="0",
+        PROGRESS_DB_PATH=":memory:",
+        PYTHONWARNINGS="ignore::FutureWarning",  # the Gemini SDK's deprecation notice
+    )
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND, env=env, stdout=subprocess.DEVNULL,
+    )
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=10) as client:
+            while True:
+                if proc.poll() is not None:
+                    raise SystemExit("server exited during startup")
+                try:
+                    if client.get("/scenarios").status_code == 200:
+                        break
+                except httpx.TransportError:
+                    time.sleep(0.005)
+            first_response = time.perf_counter() - started
+            # Give the background warm-up time to finish so its phase is reported too
+            phases = {}
+            for _ in range(100):
+                phases = client.get("/health").json().get("startup_seconds", {})
+                if "provider_warmup" in phases:
+                    break
+                time.sleep(0.05)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+    return {"first_response": first_response, **phases}
+
+
+def main(args) -> None:
+    runs = [cold_start(args.provider) for _ in range(args.runs)]
+    columns = ["first_response", "interpreter", "imports", "init", "lifespan", "provider_warmup"]
+    print(f"provider={args.provider} runs={args.runs}  (seconds)")
+    print("".join(f"{name:>17}" for name in ["run"] + columns))
+    for i, run in enumerate(runs, 1):
+        print(f"{i:>17}" + "".join(f"{run[c]:>17.3f}" if c in run else f"{'-':>17}" for c in columns))
+    medians = [statistics.median(r[c] for r in runs) if all(c in r for r in runs) else None for c in columns]
+    print(f"{'median':>17}" + "".join(f"{m:>17.3f}" if m is not None else f"{'-':>17}" for m in medians))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--provider", default="gemini", choices=["gemini", "local"])
+    main(parser.parse_args())
@@ -0,0 +1,90 @@
+"""Load test for the async LLM path using the local stand-in model.
+
+Drives POST /conversation in-process (no network, no API key) while the
+stand-in provider sleeps for a fixed latency, and prints throughput at increasing client
+concurrency. With the non-blocking path throughput should grow roughly
+linearly until it reaches LLM_MAX_CONCURRENCY; the "blocking" row shows the
+old behaviour, where a synchronous model serialises the whole event loop.
+
+    cd lib/backend
+    pip install -r requirements-dev.txt
+    python benchmarks/load_test.py --latency 0.2 --requests 64
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("RATE_LIMIT_PER_MINUTE", "0")  # every simulated client shares one address
+
+import httpx  # noqa: E402
+
+import llm  # noqa: E402
+from main import app, response_cache  # noqa: E402
+from providers import LocalProvider  # noqa: E402
+
+class BlockingLocalProvider(LocalProvider):
+    """The local stand-in, but sleeping on the event loop thread like the old sync SDK call."""
+
+    async def generate(self, prompt, model=None, json_schema=None):
+        text = self.render(prompt)
+        time.sleep(self.latency)
+        return text
+
+
+PAYLOAD = {
+    "scenario": "restaurant",
+    "user_message": "I want a table for two, please.",
+    "conversation_history": [],
+    "user_level": "beginner",
+}
+
+
+async def run_level(client: httpx.AsyncClient, concurrency: int, total: int) -> dict:
+    queue: asyncio.Queue = asyncio.Queue()
+    for _ in range(total):
+        queue.put_nowait(None)
+    statuses: dict = {}
+
+    async def worker():
+        while not queue.empty():
+            queue.get_nowait()
+            response = await client.post("/conversation", json=PAYLOAD)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {"concurrency": concurrency, "seconds": elapsed, "rps": total / elapsed, "statuses": statuses}
+
+
+async def main(args) -> None:
+    response_cache.enabled = False  # every request must reach the model
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        print(f"stub latency={args.latency}s  requests/level={args.requests}  limit={args.limit}")
+        print(f"{'mode':<10}{'conc':>6}{'seconds':>10}{'req/s':>10}  statuses")
+        for mode, provider in (
+            ("async", LocalProvider(latency=args.latency, token_rate=0)),
+            ("blocking", BlockingLocalProvider(latency=args.latency, token_rate=0)),
+        ):
+            for concurrency in args.levels:
+                llm.configure(
+                    new_limiter=llm.ConcurrencyLimiter(args.limit, queue_timeout=args.queue_timeout),
+                    provider=provider,
+                )
+                total = args.requests if mode == "async" else min(args.requests, 8 * concurrency)
+                row = await run_level(client, concurrency, total)
+                print(f"{mode:<10}{row['concurrency']:>6}{row['seconds']:>10.2f}{row['rps']:>10.1f}  {row['statuses']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.2, help="stub model latency in seconds")
+    parser.add_argument("--requests", type=int, default=64, help="requests per concurrency level")
+    parser.add_argument("--limit", type=int, default=16, help="global LLM concurrency limit")
+    parser.add_argument("--queue-timeout", type=float, default=30.0)
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    asyncio.run(main(parser.parse_args()))
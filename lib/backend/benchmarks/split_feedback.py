@@ -0,0 +1,80 @@
+"""Latency comparison: single-prompt replies vs split reply/feedback fan-out.
+
+The local stand-in model charges a fixed time-to-first-token plus a
+per-token cost, so longer completions take longer, as they do with Gemini. Inline mode produces
+the reply and the <feedback> JSON in one completion; split mode produces a
+short reply and a separate feedback completion concurrently.
+
+Reported per mode: time until the reply reaches the client, and time until
+the feedback is available (in the response or via GET /feedback/{turn_id}).
+
+    cd lib/backend
+    python benchmarks/split_feedback.py --requests 40 --concurrency 8
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("RATE_LIMIT_PER_MINUTE", "0")  # every simulated client shares one address
+
+import httpx  # noqa: E402
+
+import llm  # noqa: E402
+from main import app  # noqa: E402
+from providers import LocalProvider  # noqa: E402
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+async def run_mode(client: httpx.AsyncClient, mode: str, requests: int, concurrency: int):
+    reply_latencies, feedback_latencies = [], []
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with sem:
+            payload = {
+                "scenario": "restaurant",
+                "user_message": f"I want table for two people please ({mode} #{i})",
+                "user_level": "beginner",
+                "feedback_mode": mode,
+            }
+            started = time.perf_counter()
+            body = (await client.post("/conversation", json=payload)).json()
+            reply_latencies.append(time.perf_counter() - started)
+            if body.get("feedback_pending"):
+                await client.get(f"/feedback/{body['turn_id']}", params={"wait": 30})
+            feedback_latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return reply_latencies, feedback_latencies
+
+
+async def main(args) -> None:
+    llm.configure(
+        new_limiter=llm.ConcurrencyLimiter(args.concurrency * 2, queue_timeout=60),
+        provider=LocalProvider(latency=args.ttft, token_rate=args.tokens_per_second),
+    )
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        print(f"ttft={args.ttft}s  rate={args.tokens_per_second} tok/s  "
+              f"requests={args.requests}  concurrency={args.concurrency}")
+        print(f"{'mode':<8}{'reply p50':>12}{'reply p95':>12}{'feedback p50':>15}{'feedback p95':>15}")
+        for mode in ("inline", "split"):
+            replies, feedbacks = await run_mode(client, mode, args.requests, args.concurrency)
+            print(f"{mode:<8}{statistics.median(replies) * 1000:>10.0f}ms{_percentile(replies, 95) * 1000:>10.0f}ms"
+                  f"{statistics.median(feedbacks) * 1000:>13.0f}ms{_percentile(feedbacks, 95) * 1000:>13.0f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ttft", type=float, default=0.3, help="stand-in time to first token (s)")
+    parser.add_argument("--tokens-per-second", type=float, default=150.0)
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=8)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,209 @@
+"""Per-turn latency and server CPU: WebSocket session channel vs POST per turn.
+
+Starts the API under uvicorn in a subprocess with the local stand-in model
+and runs the same multi-turn conversations four ways:
+
+    post        new connection per turn, full history re-sent (what the app does today)
+    post-keep   POST /conversation over a kept-alive connection, full history re-sent
+    sse-keep    POST /conversation/stream (SSE) over a kept-alive connection, full history re-sent
+    ws          one /sessions/{id}/ws socket per conversation, only the new message sent
+
+Reported per mode: p50/p95 time to the complete reply, p50 time to the
+first token (streaming modes only) and server CPU
+milliseconds per turn, read from /proc (Linux only). Plain TCP on
+localhost: on mobile each new connection also pays a TLS handshake, so the
+gap to "post" is larger in production.
+
+    cd lib/backend
+    python benchmarks/ws_channel.py --conversations 8 --turns 12
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+import websockets
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MESSAGES = [
+    "Hi, I'd like a table for two, please.",
+    "Could we sit by the window?",
+    "What do you recommend today?",
+    "I am allergic to nuts, is that a problem?",
+    "Then I will have the soup and the grilled fish.",
+    "Could I also get some sparkling water?",
+]
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _cpu_seconds(pid: int):
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def _message(conversation: int, turn: int) -> str:
+    # Distinct per conversation so the reply cache does not answer for the model
+    return f"{MESSAGES[turn % len(MESSAGES)]} (guest {conversation})"
+
+
+async def post_conversation(base: str, conversation: int, turns: int, keep_alive: bool, latencies, _first):
+    history = []
+    client = httpx.AsyncClient(base_url=base, timeout=60) if keep_alive else None
+    try:
+        for turn in range(turns):
+            message = _message(conversation, turn)
+            payload = {"scenario": "restaurant", "user_message": message, "conversation_history": history}
+            started = time.perf_counter()
+            if keep_alive:
+                response = await client.post("/conversation", json=payload)
+            else:
+                async with httpx.AsyncClient(base_url=base, timeout=60) as fresh:
+                    response = await fresh.post("/conversation", json=payload)
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - started)
+            history += [{"role": "user", "content": message}, {"role": "assistant", "content": response.json()["ai_message"]}]
+    finally:
+        if client is not None:
+            await client.aclose()
+
+
+async def sse_conversation(base: str, conversation: int, turns: int, _keep_alive, latencies, first_tokens):
+    history = []
+    async with httpx.AsyncClient(base_url=base, timeout=60) as client:
+        for turn in range(turns):
+            message = _message(conversation, turn)
+            payload = {"scenario": "restaurant", "user_message": message, "conversation_history": history}
+            started = time.perf_counter()
+            first, done = None, None
+            async with client.stream("POST", "/conversation/stream", json=payload) as response:
+                event = None
+                async for line in response.aiter_lines():
+                    if line.startswith("event: "):
+                        event = line[7:]
+                        if event == "token" and first is None:
+                            first = time.perf_counter() - started
+                    elif line.startswith("data: ") and event == "done":
+                        done = json.loads(line[6:])
+            latencies.append(time.perf_counter() - started)
+            first_tokens.append(first if first is not None else latencies[-1])
+            history += [{"role": "user", "content": message}, {"role": "assistant", "content": done["ai_message"]}]
+
+
+async def ws_conversation(base: str, conversation: int, turns: int, _keep_alive, latencies, first_tokens):
+    async with httpx.AsyncClient(base_url=base, timeout=60) as client:
+        session = (await client.post("/sessions", json={"scenario": "restaurant"})).json()
+    url = base.replace("http://", "ws://") + f"/sessions/{session['session_id']}/ws"
+    async with websockets.connect(url, max_size=None) as ws:
+        for turn in range(turns):
+            started = time.perf_counter()
+            await ws.send(json.dumps({"type": "message", "user_message": _message(conversation, turn)}))
+            first = None
+            while True:
+                event = json.loads(await ws.recv())
+                if event["type"] == "token" and first is None:
+                    first = time.perf_counter() - started
+                elif event["type"] == "done":
+                    break
+                elif event["type"] in ("busy", "error"):
+                    raise RuntimeError(event)
+            latencies.append(time.perf_counter() - started)
+            first_tokens.append(first if first is not None else latencies[-1])
+
+
+async def run_mode(base: str, pid: int, mode: str, conversations: int, turns: int) -> dict:
+    runner = {"ws": ws_conversation, "sse-keep": sse_conversation}.get(mode, post_conversation)
+    latencies, first_tokens = [], []
+    cpu_before = _cpu_seconds(pid)
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        runner(base, c, turns, mode == "post-keep", latencies, first_tokens) for c in range(conversations)
+    ))
+    elapsed = time.perf_counter() - started
+    cpu_after = _cpu_seconds(pid)
+    total = conversations * turns
+    return {
+        "mode": mode,
+        "turns": total,
+        "seconds": round(elapsed, 2),
+        "p50_ms": round(1000 * statistics.median(latencies), 1),
+        "p95_ms": round(1000 * _percentile(latencies, 95), 1),
+        "first_token_p50_ms": round(1000 * statistics.median(first_tokens), 1) if first_tokens else None,
+        "server_cpu_ms_per_turn": None if cpu_before is None else round(1000 * (cpu_after - cpu_before) / total, 2),
+    }
+
+
+async def wait_ready(base: str, proc: subprocess.Popen) -> None:
+    async with httpx.AsyncClient(base_url=base) as client:
+        for _ in range(200):
+            if proc.poll() is not None:
+                raise SystemExit("server exited during startup")
+            try:
+                if (await client.get("/scenarios")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.05)
+    raise SystemExit("server did not start")
+
+
+async def main(args) -> None:
+    port = _free_port()
+    env = dict(
+        os.environ,
+        LLM_PROVIDER="local",
+        LOCAL_LLM_LATENCY=str(args.latency),
+        LOCAL_LLM_TOKEN_RATE=str(args.token_rate),
+        RATE_LIMIT_PER_MINUTE="0",
+        HEALTH_PROBE_INTERVAL="0",
+        PROGRESS_DB_PATH=":memory:",
+    )
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND, env=env, stdout=subprocess.DEVNULL,
+    )
+    base = f"http://127.0.0.1:{port}"
+    try:
+        await wait_ready(base, proc)
+        print(f"stub latency={args.latency}s token_rate={args.token_rate}/s  "
+              f"conversations={args.conversations} turns={args.turns}")
+        print(f"{'mode':<11}{'turns':>6}{'seconds':>9}{'p50 ms':>9}{'p95 ms':>9}{'1st tok':>9}{'cpu ms/turn':>13}")
+        for mode in args.modes:
+            row = await run_mode(base, proc.pid, mode, args.conversations, args.turns)
+            first = "-" if row["first_token_p50_ms"] is None else f"{row['first_token_p50_ms']:.1f}"
+            cpu = "n/a" if row["server_cpu_ms_per_turn"] is None else f"{row['server_cpu_ms_per_turn']:.2f}"
+            print(f"{mode:<11}{row['turns']:>6}{row['seconds']:>9.2f}{row['p50_ms']:>9.1f}{row['p95_ms']:>9.1f}"
+                  f"{first:>9}{cpu:>13}")
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--conversations", type=int, default=8)
+    parser.add_argument("--turns", type=int, default=12)
+    parser.add_argument("--latency", type=float, default=0.05, help="stand-in time to first token (s)")
+    parser.add_argument("--token-rate", type=float, default=400, help="stand-in tokens per second")
+    parser.add_argument("--modes", nargs="+", default=["post", "post-keep", "sse-keep", "ws"],
+                        choices=["post", "post-keep", "sse-keep", "ws"])
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,194 @@
+"""Bounded in-process LRU cache with TTL and an optional second tier.
+
+Entries evicted from memory because of the size bound are written to the
+second tier (a ``SharedState``; ``spill_path`` opens a SQLite one) and
+promoted back on the next read, so a burst of new keys does not silently
+drop older, still-valid entries. With ``write_through`` the tier is instead
+a copy that every write goes to, which lets several processes share entries.
+For mutable state that other workers may change, ``local_copies=False``
+skips the memory tier so every read sees the latest shared value. Any call
+on a cache with a tier may do I/O (a write-through, a spill, a promotion),
+so async code wraps calls in ``run()``; ``get_async()`` answers memory hits
+inline and only leaves the event loop for the tier. Values must be
+JSON-serialisable to reach the tier.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from shared_state import HOT_BUSY_TIMEOUT, SharedState, SQLiteState, StateBusyError
+
+_MISSING = object()
+
+
+class TTLCache:
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        ttl: float = 3600.0,
+        spill_path: Optional[str] = None,
+        name: str = "cache",
+        sliding: bool = False,
+        write_through: bool = False,
+        tier: Optional[SharedState] = None,
+        local_copies: bool = True,
+    ):
+        self.maxsize = max(1, maxsize)
+        self.ttl = ttl
+        self.name = name
+        self.sliding = sliding  # refresh the TTL on every read (session-style expiry)
+        # write_through: every set also goes to the tier and reads leave entries in place,
+        # so the tier acts as a copy shared with other processes.
+        self._tier = tier if tier is not None else (SQLiteState(spill_path) if spill_path else None)
+        self.write_through = write_through and self._tier is not None
+        self.local_copies = local_copies or not self.write_through
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.spilled = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        if not self.local_copies:
+            return self._get_shared(key, default)
+
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                expires_at, value = item
+                if expires_at > now:
+                    self._data.move_to_end(key)
+                    if self.sliding:
+                        self._data[key] = (now + self.ttl, value)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+
+            value = self._load_spilled(key, remove=not self.write_through)
+            if value is not _MISSING:
+                self.hits += 1
+                self._store(key, value, now)
+                return value
+
+            self.misses += 1
+            return default
+
+    def _get_shared(self, key: Hashable, default: Any) -> Any:
+        if self.sliding:
+            # Read and push the expiry out in one step so idle time is measured across workers
+            try:
+                value = self._tier.update(
+                    self.name, str(key), lambda current: current, self.ttl, busy_timeout=HOT_BUSY_TIMEOUT
+                )
+            except StateBusyError:
+                # Another worker is writing: a plain read is enough, the expiry moves on the next lookup
+                value = self._tier.get(self.name, str(key))
+        else:
+            value = self._tier.get(self.name, str(key))
+        if value is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            if self.local_copies:
+                self._store(key, value, time.monotonic())
+            if self.write_through:
+                self._write_spilled(key, value, self.ttl)
+
+    def update(self, key: Hashable, fn: Callable[[Any], Any]) -> Any:
+        """Atomically replace the value with ``fn(current)`` (see SharedState.update)."""
+        if not self.local_copies:
+            return self._tier.update(self.name, str(key), fn, self.ttl)
+        with self._lock:
+            value = fn(self.get(key))
+            if value is not None:
+                self.set(key, value)
+            return value
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """``fn(*args)`` (a method of this cache) off the event loop when the cache has a tier."""
+        if self._tier is None:
+            return fn(*args)
+        return await self._tier.run(fn, *args)
+
+    async def get_async(self, key: Hashable, default: Any = None) -> Any:
+        """``get`` for async code: a memory hit is answered inline, anything else goes through ``run``."""
+        if self.local_copies and self._lock.acquire(blocking=False):
+            # Not waiting for the lock: its holder may be on the store's thread, in the middle of I/O
+            try:
+                item = self._data.get(key)
+                now = time.monotonic()
+                if item is not None and item[0] > now:
+                    self._data.move_to_end(key)
+                    if self.sliding:
+                        self._data[key] = (now + self.ttl, item[1])
+                    self.hits += 1
+                    return item[1]
+            finally:
+                self._lock.release()
+        return await self.run(self.get, key, default)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.pop(key, None)
+            spilled = self._load_spilled(key)
+            if item is not None:
+                return item[1]
+            return default if spilled is _MISSING else spilled
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            if self._tier is not None:
+                self._tier.clear(self.name)
+
+    def _store(self, key: Hashable, value: Any, now: float) -> None:
+        self._data[key] = (now + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            old_key, (expires_at, old_value) = self._data.popitem(last=False)
+            self.evictions += 1
+            if expires_at > now and not self.write_through:
+                self._write_spilled(old_key, old_value, expires_at - now)
+
+    # Second tier: SharedState keeps wall-clock expiry, so spilled entries survive restarts.
+    def _write_spilled(self, key: Hashable, value: Any, remaining: float) -> None:
+        if self._tier is None:
+            return
+        try:
+            self._tier.set(self.name, str(key), value, remaining)
+        except (TypeError, ValueError):
+            return
+        self.spilled += 1
+
+    def _load_spilled(self, key: Hashable, remove: bool = True) -> Any:
+        """Return ``key`` from the second tier (removing it when spilled), or _MISSING."""
+        if self._tier is None:
+            return _MISSING
+        value = self._tier.get(self.name, str(key), _MISSING)
+        if value is not _MISSING and remove:
+            self._tier.delete(self.name, str(key))
+        return value
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "spilled": self.spilled,
+            "shared": bool(self._tier is not None and self._tier.shared and self.write_through),
+        }
@@ -0,0 +1,72 @@
+"""Outgoing side of the conversation WebSocket (``/sessions/{id}/ws``).
+
+A WebSocket turn produces events much faster than a phone on a weak
+network may read them. Handlers never await the socket directly; they
+``put`` events into an ``Outbox`` and a sender task writes them out:
+
+* backpressure - while the client is behind, consecutive ``token`` events
+  waiting in the outbox are merged into one frame, so the model stream is
+  never held up by a slow reader (holding it would keep a model slot busy)
+  and the client receives fewer, larger frames instead of a growing
+  backlog. Other events are never merged or reordered.
+* keepalive - after ``keepalive`` seconds without outgoing traffic a
+  ``{"type": "ping"}`` frame is sent, which keeps mobile NATs and proxies
+  that ignore protocol-level pings from dropping an idle conversation.
+
+Configuration (environment variables):
+    WS_KEEPALIVE      seconds of silence before the server sends a ping (default 25)
+    WS_IDLE_TIMEOUT   seconds without a client message before the socket is closed (default 600)
+"""
+import asyncio
+import os
+from collections import deque
+from typing import Any, Deque, Dict
+
+from metrics import REGISTRY
+
+WS_KEEPALIVE = float(os.environ.get("WS_KEEPALIVE", 25))
+WS_IDLE_TIMEOUT = float(os.environ.get("WS_IDLE_TIMEOUT", 600))
+
+CONNECTIONS = REGISTRY.gauge("ws_connections", "Open conversation WebSockets")
+COALESCED = REGISTRY.counter("ws_tokens_coalesced_total", "Token events merged because the client was behind")
+
+
+class Outbox:
+    def __init__(self, websocket, keepalive: float = WS_KEEPALIVE):
+        self.websocket = websocket
+        self.keepalive = keepalive
+        self._pending: Deque[Dict[str, Any]] = deque()
+        self._ready = asyncio.Event()
+        self.sent = 0
+
+    def put(self, event: Dict[str, Any]) -> None:
+        last = self._pending[-1] if self._pending else None
+        if last is not None and last["type"] == "token" and event["type"] == "token":
+            last["text"] += event["text"]
+            COALESCED.inc()
+        else:
+            self._pending.append(dict(event))
+        self._ready.set()
+
+    async def run(self) -> None:
+        """Sender loop; ends when the socket fails (the receive side sees the disconnect)."""
+        while True:
+            if not self._pending:
+                self._ready.clear()
+                try:
+                    await asyncio.wait_for(self._ready.wait(), self.keepalive)
+                except asyncio.TimeoutError:
+                    self._pending.append({"type": "ping"})
+            event = self._pending.popleft()
+            try:
+                await self.websocket.send_json(event)
+            except Exception:
+                return
+            self.sent += 1
+
+    async def drain(self, timeout: float = 5.0) -> None:
+        """Wait until everything put so far has been handed to the socket."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self._pending and loop.time() < deadline:
+            await asyncio.sleep(0.01)
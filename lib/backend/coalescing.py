@@ -0,0 +1,92 @@
+"""Single-flight: one upstream call for identical concurrent requests.
+
+When a class starts the same scenario at the same moment, the reply cache
+cannot help - none of the identical opening prompts has finished yet - and
+each one would be sent to the model and paid for separately. ``SingleFlight``
+lets the first caller for a key start the call and every caller that
+arrives while it is running await the same task:
+
+* the shared task is shielded, so one client disconnecting - the one that
+  started it included - does not cancel the call for the others; it is
+  cancelled only when every waiter is gone;
+* it runs in the context passed in (by default an empty one), never in a
+  copy of the first caller's, so request-scoped state of whoever happened to
+  arrive first does not travel into a call made on behalf of everyone;
+* errors reach every waiter, like the result does;
+* nothing is kept once the call finishes - the reply cache stores results,
+  this only joins calls that overlap in time.
+
+Coalescing is per process; the reply cache's shared tier covers the rest.
+"""
+import asyncio
+import contextvars
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+
+def prompt_key(*parts: Any, prompt: str) -> str:
+    """Key for a call: ``parts`` verbatim, the prompt with whitespace runs folded."""
+    normalized = " ".join(prompt.split())
+    canonical = json.dumps([parts, normalized], ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, call: Callable[[], Awaitable[Any]],
+                 context: Optional[contextvars.Context] = None) -> Tuple[Any, bool]:
+        """Result of ``call()``, shared with concurrent callers of ``key``; True when joined, not started.
+
+        A new call runs in ``context`` (default: a new, empty context).
+        """
+        entry: Optional[_Call] = self._calls.get(key)
+        shared = entry is not None
+        if entry is None:
+            self.calls += 1
+            task = asyncio.get_running_loop().create_task(
+                call(), context=contextvars.Context() if context is None else context
+            )
+            entry = self._calls[key] = _Call(task)
+            entry.task.add_done_callback(lambda task: self._finished(key, entry))
+        else:
+            self.coalesced += 1
+        entry.waiters += 1
+        try:
+            return await asyncio.shield(entry.task), shared
+        finally:
+            entry.waiters -= 1
+            if entry.waiters == 0 and not entry.task.done():
+                # Everyone who wanted the answer has gone. Forget the call now, not when the task
+                # finishes cancelling, so a caller arriving in between starts afresh instead of
+                # joining a call that is already cancelled.
+                self._forget(key, entry)
+                entry.task.cancel()
+
+    def _forget(self, key: str, entry: _Call) -> None:
+        if self._calls.get(key) is entry:
+            del self._calls[key]
+
+    def _finished(self, key: str, entry: _Call) -> None:
+        self._forget(key, entry)
+        if not entry.task.cancelled():
+            entry.task.exception()  # retrieved here so an unawaited failure is not logged as lost
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    def stats(self) -> Dict[str, int]:
+        return {"in_flight": self.in_flight, "calls": self.calls, "coalesced": self.coalesced}
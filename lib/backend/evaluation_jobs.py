@@ -0,0 +1,232 @@
+"""Background IELTS evaluation jobs.
+
+Grading a whole mock exam is the slowest model call we make, and when a
+class finishes at the same time the synchronous endpoint kept one HTTP
+connection open per candidate for the full grading time. Here a submission
+returns a job id straight away (with an instant provisional score) and the
+grading happens in a small pool of worker tasks:
+
+* Job ids are derived from the transcript, so submitting an identical
+  transcript again - a retry, a double tap - joins the existing job
+  instead of grading it twice, and a finished result is served from the
+  store until it expires.
+* A worker takes up to ``EVAL_BATCH_SIZE`` queued jobs (waiting at most
+  ``EVAL_BATCH_WAIT`` for the batch to fill) and grades them with one model
+  call. If a batched call fails, its jobs are retried one by one.
+* Job records live in a TTLCache backed by the shared state when several
+  workers run, so a job can be polled from any worker. The queue itself is
+  per process: the worker that accepted a job grades it.
+* The workers' model calls all go to the fair queue as one standard-lane
+  client, so a wave of exams cannot crowd out live conversations.
+
+Configuration (environment variables):
+    EVAL_WORKERS      concurrent grading workers per process (default 2)
+    EVAL_BATCH_SIZE   transcripts graded per model call (default 4)
+    EVAL_BATCH_WAIT   seconds a worker waits for a batch to fill (default 0.05)
+    EVAL_JOB_TTL      seconds a job and its result are kept (default 3600)
+    EVAL_SYNC_WAIT    seconds /ielts/evaluate waits for its job before answering with the
+                      provisional score and the job id to poll (default 5)
+"""
+import asyncio
+import hashlib
+import json
+import os
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from admission import Client, set_client
+from cache import TTLCache
+from llm import LLMBusyError
+from shared_state import SharedState, shared_state
+from split_feedback import SHARED_POLL_INTERVAL
+
+# Grades several payloads with one model call; one result (or None when unusable) per payload
+GradeBatch = Callable[[List[Any]], Awaitable[List[Optional[dict]]]]
+
+EVAL_SYNC_WAIT = float(os.environ.get("EVAL_SYNC_WAIT", 5))
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+JOBS_CLIENT = Client("evaluation-jobs")
+
+
+def job_id_for(payload: Any) -> str:
+    canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:32]
+
+
+class EvaluationJobs:
+    def __init__(
+        self,
+        grade: GradeBatch,
+        workers: int = 2,
+        batch_size: int = 4,
+        batch_wait: float = 0.05,
+        ttl: float = 3600.0,
+        maxsize: int = 4096,
+        shared: Optional[SharedState] = None,
+    ):
+        self.grade = grade
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.batch_wait = batch_wait
+        self._jobs = TTLCache(
+            maxsize=maxsize,
+            ttl=ttl,
+            name="evaluation_jobs",
+            tier=shared,
+            write_through=shared is not None,
+            local_copies=shared is None,
+        )
+        self._queue: "asyncio.Queue[Tuple[str, Any]]" = asyncio.Queue()
+        self._done: Dict[str, asyncio.Event] = {}
+        self._tasks: List[asyncio.Task] = []
+        self.submitted = 0
+        self.deduplicated = 0
+        self.batches = 0
+        self.completed = 0
+        self.failed = 0
+
+    # -- submission and lookup ---------------------------------------------------
+
+    async def submit(self, payload: Any, provisional: dict, final: bool = False) -> Dict[str, Any]:
+        """Queue ``payload`` for grading unless an identical job exists; returns the job record.
+
+        With ``final`` there is nothing to grade and the provisional score is stored as the result.
+        """
+        job_id = job_id_for(payload)
+        created: Dict[str, bool] = {}
+
+        def claim(current: Optional[dict]) -> Optional[dict]:
+            if current is not None and current["status"] != FAILED:
+                return None  # already queued, running or done
+            created["new"] = True
+            if final:
+                return {"status": DONE, "provisional": provisional, "result": provisional}
+            return {"status": QUEUED, "provisional": provisional, "result": None}
+
+        record = await self._jobs.run(self._jobs.update, job_id, claim)
+        if created and not final:
+            self.submitted += 1
+            self._done[job_id] = asyncio.Event()
+            self._queue.put_nowait((job_id, payload))
+        elif not created:
+            self.deduplicated += 1
+            record = await self._jobs.run(self._jobs.get, job_id)
+        return {"job_id": job_id, **record}
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        record = await self._jobs.run(self._jobs.get, job_id)
+        return None if record is None else {"job_id": job_id, **record}
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """Like get(), but give an unfinished job up to ``timeout`` seconds."""
+        event = self._done.get(job_id)
+        if event is not None and timeout > 0:
+            try:
+                await asyncio.wait_for(event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            return await self.get(job_id)
+
+        record = await self.get(job_id)
+        deadline = asyncio.get_running_loop().time() + timeout
+        # Accepted by another worker: poll the shared state until it finishes
+        while record is not None and record["status"] in (QUEUED, RUNNING) and asyncio.get_running_loop().time() < deadline:
+            await asyncio.sleep(SHARED_POLL_INTERVAL)
+            record = await self.get(job_id)
+        return record
+
+    # -- workers -----------------------------------------------------------------
+
+    def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    async def _next_batch(self) -> List[Tuple[str, Any]]:
+        batch = [await self._queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.batch_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - asyncio.get_running_loop().time()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                break
+        return batch
+
+    async def _worker(self) -> None:
+        set_client(JOBS_CLIENT)
+        while True:
+            batch = await self._next_batch()
+            for job_id, _ in batch:
+                await self._set(job_id, status=RUNNING)
+            try:
+                await self._grade(batch)
+            except LLMBusyError as e:
+                # Overloaded: put the jobs back and give the queue room before trying again
+                for item in batch:
+                    record = await self._jobs.run(self._jobs.get, item[0])
+                    if record is not None and record["status"] == RUNNING:
+                        await self._set(item[0], status=QUEUED)
+                        self._queue.put_nowait(item)
+                await asyncio.sleep(e.retry_after or 1.0)
+
+    async def _grade(self, batch: List[Tuple[str, Any]]) -> None:
+        self.batches += 1
+        try:
+            results = await self.grade([payload for _, payload in batch])
+        except LLMBusyError:
+            raise
+        except Exception as e:
+            print(f"IELTS evaluation batch error: {type(e).__name__}: {e}")
+            results = [None] * len(batch)
+
+        retry = []
+        for (job_id, payload), result in zip(batch, results):
+            if result is not None:
+                await self._finish(job_id, DONE, result)
+            elif len(batch) > 1:
+                retry.append((job_id, payload))
+            else:
+                await self._finish(job_id, FAILED, None)
+        for item in retry:
+            await self._grade([item])
+
+    async def _set(self, job_id: str, **fields: Any) -> None:
+        await self._jobs.run(self._jobs.update, job_id, lambda current: None if current is None else {**current, **fields})
+
+    async def _finish(self, job_id: str, status: str, result: Optional[dict]) -> None:
+        await self._set(job_id, status=status, result=result)
+        if status == DONE:
+            self.completed += 1
+        else:
+            self.failed += 1
+        event = self._done.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self._queue.qsize(),
+            "submitted": self.submitted,
+            "deduplicated": self.deduplicated,
+            "batches": self.batches,
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+
+def jobs_from_env(grade: GradeBatch) -> EvaluationJobs:
+    return EvaluationJobs(
+        grade,
+        workers=int(os.environ.get("EVAL_WORKERS", 2)),
+        batch_size=int(os.environ.get("EVAL_BATCH_SIZE", 4)),
+        batch_wait=float(os.environ.get("EVAL_BATCH_WAIT", 0.05)),
+        ttl=float(os.environ.get("EVAL_JOB_TTL", 3600)),
+        shared=shared_state(),
+    )
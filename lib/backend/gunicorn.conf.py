@@ -0,0 +1,52 @@
+"""Gunicorn settings for the multi-worker deployment.
+
+    gunicorn main:app -c gunicorn.conf.py
+
+``preload_app`` imports main.py once in the master, so scenario files and
+prompt prefixes are parsed and configuration is read before the workers are
+forked. The model client, background tasks and SQLite connections are
+created per worker (in the lifespan handler or lazily on first use).
+
+WEB_CONCURRENCY is exported before main.py is imported; with more than one
+worker, sessions, split-mode feedback and the reply cache move to the shared
+state file (see shared_state.py) so every worker sees the same entries.
+Metrics, concurrency limits and circuit breakers stay per worker.
+
+Configuration (environment variables):
+    PORT              port to bind (default 8000)
+    WEB_CONCURRENCY   worker processes (default: one per CPU core)
+    GUNICORN_TIMEOUT  seconds before a silent worker is restarted (default 120)
+"""
+import os
+
+
+def _cpu_count() -> int:
+    # Cores this process may run on (respects container CPU sets), not all host cores
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY") or _cpu_count())
+worker_class = "uvicorn_worker.UvicornWorker"
+preload_app = True
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+graceful_timeout = 30
+keepalive = 5
+
+# Read by shared_state.py while the app is preloaded
+os.environ["WEB_CONCURRENCY"] = str(workers)
+
+
+def on_starting(server):
+    # The default shared state file only covers one run; drop what a previous run left in /dev/shm
+    if workers > 1 and not os.environ.get("SHARED_STATE_PATH"):
+        from shared_state import default_shared_path
+
+        path = default_shared_path()
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.remove(path + suffix)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,52 @@
+"""Background upstream prober behind the cheap ``/health`` check.
+
+``/health`` used to send a live model request on every probe, so each
+load-balancer or uptime check was a paid Gemini call. The prober makes that
+call once per interval in the background and ``/health`` only reads the last
+result.
+
+Configuration (environment variables):
+    HEALTH_PROBE_INTERVAL  seconds between upstream probes, 0 disables (default 300)
+"""
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+
+class UpstreamProber:
+    def __init__(self, probe: Callable[[], Awaitable[str]], interval: float = 300.0):
+        self._probe = probe
+        self.interval = interval
+        self.status: Dict[str, Any] = {"gemini_status": "unknown", "checked_at": None}
+
+    async def probe_once(self) -> Dict[str, Any]:
+        started = time.perf_counter()
+        status: Dict[str, Any]
+        try:
+            response_text = await self._probe()
+            status = {"gemini_status": "working", "gemini_response": response_text[:100]}
+        except Exception as e:
+            status = {
+                "gemini_status": "error",
+                "gemini_error_type": type(e).__name__,
+                "gemini_error": str(e)[:300],
+            }
+        status["checked_at"] = time.time()
+        status["probe_latency"] = round(time.perf_counter() - started, 3)
+        self.status = status
+        return status
+
+    async def run(self) -> None:
+        while True:
+            await self.probe_once()
+            await asyncio.sleep(self.interval)
+
+    def age(self) -> Optional[float]:
+        """Seconds since the last probe finished, or None before the first one."""
+        checked_at = self.status.get("checked_at")
+        return None if checked_at is None else time.time() - checked_at
+
+
+def probe_interval_from_env() -> float:
+    return float(os.environ.get("HEALTH_PROBE_INTERVAL", 300))
@@ -0,0 +1,165 @@
+"""Local, deterministic pre-scoring of IELTS Speaking transcripts.
+
+A cheap text analysis of the candidate's answers that runs before (and
+without) the model:
+
+* per message - words, distinct words, sentence lengths, linking words
+  ("because", "however", "on the other hand"...) and rough grammar flags
+  (doubled words, "he don't", "a apple", lowercase "i"). Messages are
+  analysed once and cached by content, so a transcript that grows by one
+  answer per turn only analyses the new answer;
+* per transcript - the message features are summed in one pass into
+  lexical diversity (Guiraud's index, distinct words / sqrt(words), which
+  unlike the plain type/token ratio does not fall as answers get longer),
+  mean and spread of sentence length, connectives and grammar flags per
+  100 words.
+
+``prompt_hints`` turns the result into one compact line for the evaluation
+prompt, so the examiner model starts from measured facts instead of
+counting itself. ``provisional_bands`` maps the same features to the four
+criteria and an overall band; that is the instant score for evaluation
+jobs and the answer when the model is unavailable.
+
+The bands are rough heuristics, not an examiner, and are always marked
+provisional.
+"""
+import hashlib
+import math
+import re
+from typing import Dict, List, Optional
+
+from cache import TTLCache
+
+_WORD = re.compile(r"[A-Za-z]+(?:'[A-Za-z]+)?")
+_SENTENCE_END = re.compile(r"[.!?]+")
+
+CONNECTIVES = (
+    "and then", "because", "so", "but", "however", "although", "though", "while", "whereas",
+    "therefore", "moreover", "furthermore", "also", "besides", "for example", "for instance",
+    "such as", "in addition", "on the other hand", "as a result", "in my opinion", "i think",
+    "actually", "unless", "since", "firstly", "secondly", "finally", "overall", "in fact",
+)
+_CONNECTIVE = re.compile(r"\b(" + "|".join(re.escape(c) for c in sorted(CONNECTIVES, key=len, reverse=True)) + r")\b")
+
+_GRAMMAR_FLAGS = (
+    re.compile(r"\b(\w+) \1\b"),  # doubled word
+    # "were" is left out for he/she/it ("if she were") and "was" for i ("I was born")
+    re.compile(r"\b(he|she|it) (don't|have|are)\b"),
+    re.compile(r"\b(you|we|they) (doesn't|has|is|was)\b"),
+    re.compile(r"\bi (doesn't|has|is)\b"),
+    re.compile(r"\b(i|you|we|they) (?!(?:has|does|was)\b)(\w+[^s\W]s) (to|a|the|my)\b"),  # "I likes to"
+    re.compile(r"\ban? (a|an|the)\b"),
+    re.compile(r"\ba [aeiou]\w+"),
+    re.compile(r"\b(did|didn't|doesn't) (?!\w*eed\b)\w+ed\b"),  # "didn't liked"
+)
+_LOWERCASE_I = re.compile(r"(?:^|\s)i(?:\s|'|$)")
+# Words that start with a vowel letter but take "a"
+_A_EXCEPTIONS = re.compile(r"\ba (uni\w*|use\w*|usual\w*|one\w*|euro\w*|once)\b")
+
+_features = TTLCache(maxsize=8192, ttl=3600, name="message_features")
+
+
+def message_features(text: str) -> Dict[str, object]:
+    """Features of one candidate answer, cached by content."""
+    key = hashlib.sha1(text.encode("utf-8")).hexdigest()
+    cached = _features.get(key)
+    if cached is not None:
+        return cached
+
+    lowered = text.lower()
+    words = _WORD.findall(lowered)
+    sentences = [len(_WORD.findall(s)) for s in _SENTENCE_END.split(lowered)]
+    sentences = [n for n in sentences if n] or ([len(words)] if words else [])
+    flags = sum(len(p.findall(lowered)) for p in _GRAMMAR_FLAGS)
+    flags -= len(_A_EXCEPTIONS.findall(lowered))
+    if text != lowered:  # all-lowercase text (e.g. from speech-to-text) has no capitals to check
+        flags += len(_LOWERCASE_I.findall(text))
+    features = {
+        "words": len(words),
+        "types": sorted(set(words)),
+        "sentence_lengths": sentences,
+        "connectives": _CONNECTIVE.findall(lowered),
+        "grammar_flags": max(0, flags),
+    }
+    _features.set(key, features)
+    return features
+
+
+def transcript_features(candidate_responses: List[str]) -> Optional[Dict[str, float]]:
+    """Aggregate features over all answers, or None when there is nothing to analyse."""
+    per_message = [message_features(r) for r in candidate_responses if r and r.strip()]
+    words = sum(m["words"] for m in per_message)
+    if not words:
+        return None
+
+    types = set().union(*(m["types"] for m in per_message))
+    lengths = [n for m in per_message for n in m["sentence_lengths"]]
+    mean = sum(lengths) / len(lengths)
+    variance = sum((n - mean) ** 2 for n in lengths) / len(lengths)
+    connectives = [c for m in per_message for c in m["connectives"]]
+    return {
+        "answers": len(per_message),
+        "words": words,
+        "avg_answer_words": round(words / len(per_message), 1),
+        "lexical_diversity": round(len(types) / math.sqrt(words), 2),
+        "sentence_mean": round(mean, 1),
+        "sentence_stdev": round(math.sqrt(variance), 1),
+        "connectives_per_100": round(100 * len(connectives) / words, 1),
+        "distinct_connectives": len(set(connectives)),
+        "grammar_flags_per_100": round(100 * sum(m["grammar_flags"] for m in per_message) / words, 1),
+    }
+
+
+def prompt_hints(features: Optional[Dict[str, float]]) -> str:
+    """One line of measured facts for the examiner prompt."""
+    if features is None:
+        return "LOCAL ANALYSIS: no candidate speech."
+    return (
+        "LOCAL ANALYSIS (automatic text measures; use as hints, judge the language yourself): "
+        f"answers={features['answers']} words={features['words']} avg_answer_words={features['avg_answer_words']} "
+        f"lexical_diversity={features['lexical_diversity']} (Guiraud; ~5 basic, ~8 wide range) "
+        f"sentence_words={features['sentence_mean']}±{features['sentence_stdev']} "
+        f"connectives_per_100_words={features['connectives_per_100']} ({features['distinct_connectives']} distinct) "
+        f"grammar_flags_per_100_words={features['grammar_flags_per_100']}"
+    )
+
+
+def _band(value: float) -> float:
+    return min(9.0, max(3.0, round(value * 2) / 2))
+
+
+def _scale(value: float, low: float, high: float) -> float:
+    """0.0 at ``low``, 1.0 at ``high``, clamped."""
+    return min(1.0, max(0.0, (value - low) / (high - low)))
+
+
+def provisional_bands(features: Dict[str, float]) -> Dict[str, object]:
+    """Criterion bands and overall band (average rounded to 0.5) from the local features."""
+    length = _scale(features["avg_answer_words"], 8, 60)
+    variety = _scale(features["sentence_stdev"], 1, 7)
+    linking = _scale(features["connectives_per_100"], 0.5, 5) * 0.6 + _scale(features["distinct_connectives"], 1, 8) * 0.4
+    fluency = 4.0 + 2.5 * length + 1.0 * variety + 0.5 * linking
+    coherence = 4.0 + 2.5 * linking + 1.0 * length + 0.5 * variety
+    vocabulary = 4.0 + 3.5 * _scale(features["lexical_diversity"], 4.5, 8.5) + 0.5 * length
+    accuracy = 1.0 - _scale(features["grammar_flags_per_100"], 0.5, 6)
+    complexity = _scale(features["sentence_mean"], 6, 16)
+    grammar = 4.0 + 2.5 * accuracy + 1.5 * complexity
+
+    scores = {
+        "fluency_score": _band(fluency),
+        "vocabulary_score": _band(vocabulary),
+        "grammar_score": _band(grammar),
+        "coherence_score": _band(coherence),
+    }
+    weakest = min(scores, key=scores.get)
+    advice = {
+        "fluency_score": "Give longer answers and develop each point with a reason or an example.",
+        "vocabulary_score": "Use a wider range of words instead of repeating the same ones.",
+        "grammar_score": "Check subject-verb agreement and articles, and try some longer, complex sentences.",
+        "coherence_score": "Link your ideas with words like 'because', 'however' and 'for example'.",
+    }[weakest]
+    return {
+        "band_score": _band(sum(scores.values()) / len(scores)),
+        "feedback": f"Provisional score from an automatic analysis of your answers. {advice}",
+        **scores,
+    }
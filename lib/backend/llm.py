@@ -0,0 +1,367 @@
+"""Non-blocking model calls behind global and per-endpoint concurrency limits.
+
+The handlers in main.py are ``async def``; calling the synchronous
+``generate_content`` from them stalls the whole event loop for the length of a
+Gemini round-trip. Everything here awaits the provider (see providers.py),
+which uses the native async client or a bounded thread pool.
+
+Configuration (environment variables):
+    LLM_MAX_CONCURRENCY       in-flight LLM calls across all endpoints (default 16)
+    LLM_ENDPOINT_CONCURRENCY  per-endpoint overrides, e.g. "conversation=8,ielts_evaluate=4"
+    LLM_DEFAULT_ENDPOINT_CONCURRENCY  limit for endpoints not listed above (default: global)
+    LLM_QUEUE_TIMEOUT         seconds a request may wait for a slot (default 10)
+    LLM_QUEUE_MAX_DEPTH / LLM_PRIORITY_WEIGHT  fair-queue settings, see admission.py
+    LLM_EXECUTOR_WORKERS      thread pool size for the blocking fallback (default: global)
+    LLM_STRUCTURED_OUTPUT     "0" stops sending JSON schemas with JSON-only requests (default "1")
+    LLM_COALESCE              "0" stops sharing one model call between identical concurrent
+                              prompts (default "1", see coalescing.py)
+
+Latency, queue wait, approximate prompt/response token counts and errors are
+recorded per endpoint in the metrics registry (served at ``/metrics``).
+
+Each call also runs through ``resilience`` (circuit breaker, retry budget,
+deadline, optional hedging); see resilience.py for its settings.
+"""
+import asyncio
+import contextvars
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+from admission import PRIORITY, STANDARD, FairQueue, QueueFullError, current_client, queue_weights_from_env, set_client
+from coalescing import SingleFlight, prompt_key
+from metrics import REGISTRY, TOKEN_BUCKETS
+from prompting import count_tokens
+from providers import ModelProvider, provider_from_env
+from resilience import ResilientCaller, caller_from_env
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def _parse_endpoint_limits(raw: str) -> Dict[str, int]:
+    """"conversation=8, ielts_evaluate=4" -> {"conversation": 8, "ielts_evaluate": 4}"""
+    limits: Dict[str, int] = {}
+    for item in raw.split(","):
+        name, _, value = item.partition("=")
+        if name.strip() and value.strip().isdigit():
+            limits[name.strip()] = int(value)
+    return limits
+
+
+QUEUE_WAIT = REGISTRY.histogram("llm_queue_wait_seconds", "Time spent waiting for an LLM concurrency slot", ["endpoint"])
+LATENCY = REGISTRY.histogram("llm_request_duration_seconds", "Model call latency including retries", ["endpoint", "outcome"])
+PROMPT_TOKENS = REGISTRY.histogram("llm_prompt_tokens", "Approximate prompt size in tokens", ["endpoint"], TOKEN_BUCKETS)
+RESPONSE_TOKENS = REGISTRY.histogram("llm_response_tokens", "Approximate completion size in tokens", ["endpoint"], TOKEN_BUCKETS)
+ERRORS = REGISTRY.counter("llm_errors_total", "Failed model calls by error type", ["endpoint", "error"])
+REJECTED = REGISTRY.counter("llm_rejected_total", "Calls rejected after waiting too long for a slot", ["endpoint"])
+SHED = REGISTRY.counter("llm_shed_total", "Calls shed because the fair queue was full", ["endpoint", "lane"])
+COALESCED = REGISTRY.counter(
+    "llm_coalesced_total", "Requests answered by an identical call already in flight", ["endpoint"]
+)
+
+
+class LLMBusyError(Exception):
+    """Raised when a request waited longer than the queue timeout for an LLM slot."""
+
+    def __init__(self, endpoint: str, timeout: float, retry_after: Optional[float] = None):
+        super().__init__(f"LLM capacity exhausted for '{endpoint}' (waited {timeout:.1f}s)")
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self.retry_after = timeout if retry_after is None else retry_after
+
+
+class _NoLimit:
+    def locked(self) -> bool:
+        return False
+
+    async def acquire(self) -> bool:
+        return True
+
+    def release(self) -> None:
+        pass
+
+
+_NO_LIMIT = _NoLimit()
+
+
+class ConcurrencyLimiter:
+    """Two-level gate: one slot per endpoint, then one global slot.
+
+    Endpoint slots are FIFO semaphores; global slots come from a weighted
+    fair queue (see admission.py) that favours the priority lane and rotates
+    between clients. A waiter that does not get both slots before
+    ``queue_timeout`` gives up with :class:`LLMBusyError`, and one that finds
+    the fair queue full is shed straight away with the same error.
+    """
+
+    def __init__(
+        self,
+        global_limit: int,
+        endpoint_limits: Optional[Dict[str, int]] = None,
+        default_endpoint_limit: Optional[int] = None,
+        queue_timeout: float = 10.0,
+        max_queue_depth: int = 64,
+        lane_weights: Optional[Dict[str, float]] = None,
+    ):
+        self.global_limit = max(1, global_limit)
+        self.endpoint_limits = dict(endpoint_limits or {})
+        self.default_endpoint_limit = max(1, default_endpoint_limit or self.global_limit)
+        self.queue_timeout = queue_timeout
+        self._global = FairQueue(
+            self.global_limit, lane_weights or {PRIORITY: 3.0, STANDARD: 1.0}, max_depth=max_queue_depth
+        )
+        self._endpoints: Dict[str, asyncio.Semaphore] = {}
+        self.in_flight = 0
+        self.rejected = 0
+
+    def _endpoint_semaphore(self, endpoint: str) -> "asyncio.Semaphore | _NoLimit":
+        sem = self._endpoints.get(endpoint)
+        if sem is None:
+            limit = self.endpoint_limits.get(endpoint, self.default_endpoint_limit)
+            # A limit at or above the global one can never bind; skipping it keeps the
+            # FIFO semaphore from lining requests up before the fair queue sees them
+            sem = asyncio.Semaphore(max(1, limit)) if limit < self.global_limit else _NO_LIMIT
+            self._endpoints[endpoint] = sem
+        return sem
+
+    @asynccontextmanager
+    async def slot(self, endpoint: str, timeout: Optional[float] = None):
+        timeout = self.queue_timeout if timeout is None else timeout
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        endpoint_sem = self._endpoint_semaphore(endpoint)
+
+        try:
+            # asyncio.timeout, not wait_for: on 3.11 wait_for drops a cancellation that races the acquire
+            async with asyncio.timeout(timeout):
+                await endpoint_sem.acquire()
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            REJECTED.inc(endpoint=endpoint)
+            raise LLMBusyError(endpoint, timeout) from None
+        client = current_client()
+        try:
+            await self._global.acquire(client, max(0.0, deadline - loop.time()))
+        except asyncio.TimeoutError:
+            endpoint_sem.release()
+            self.rejected += 1
+            REJECTED.inc(endpoint=endpoint)
+            raise LLMBusyError(endpoint, timeout) from None
+        except QueueFullError:
+            endpoint_sem.release()
+            self.rejected += 1
+            SHED.inc(endpoint=endpoint, lane=client.lane)
+            raise LLMBusyError(endpoint, loop.time() - (deadline - timeout), retry_after=1.0) from None
+        except BaseException:
+            endpoint_sem.release()
+            raise
+
+        QUEUE_WAIT.observe(timeout - (deadline - loop.time()), endpoint=endpoint)
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._global.release()
+            endpoint_sem.release()
+
+    async def try_reserve(self, endpoint: str) -> Optional[Callable[[], None]]:
+        """Both slots for ``endpoint`` if they are free right now (for a hedged attempt).
+
+        Returns the function that gives them back, or None without waiting.
+        """
+        endpoint_sem = self._endpoint_semaphore(endpoint)
+        if endpoint_sem.locked() or not self._global.try_acquire(current_client()):
+            return None
+        await endpoint_sem.acquire()  # not locked, so this returns at once
+        self.in_flight += 1
+
+        def release() -> None:
+            self.in_flight -= 1
+            self._global.release()
+            endpoint_sem.release()
+
+        return release
+
+    def saturated(self) -> bool:
+        """True when the fair queue is full, so a new call would be shed."""
+        return self._global.depth >= self._global.max_depth
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "global_limit": self.global_limit,
+            "in_flight": self.in_flight,
+            "rejected": self.rejected,
+            "queue_timeout": self.queue_timeout,
+            "queue": self._global.stats(),
+        }
+
+
+def limiter_from_env() -> ConcurrencyLimiter:
+    global_limit = _env_int("LLM_MAX_CONCURRENCY", 16)
+    return ConcurrencyLimiter(
+        global_limit=global_limit,
+        endpoint_limits=_parse_endpoint_limits(os.environ.get("LLM_ENDPOINT_CONCURRENCY", "")),
+        default_endpoint_limit=_env_int("LLM_DEFAULT_ENDPOINT_CONCURRENCY", global_limit),
+        queue_timeout=_env_float("LLM_QUEUE_TIMEOUT", 10.0),
+        max_queue_depth=_env_int("LLM_QUEUE_MAX_DEPTH", 64),
+        lane_weights=queue_weights_from_env(),
+    )
+
+
+limiter = limiter_from_env()
+resilience = caller_from_env()
+_provider: Optional[ModelProvider] = None
+
+# JSON-only requests carry their schema to the provider (see providers.py)
+STRUCTURED_OUTPUT = os.environ.get("LLM_STRUCTURED_OUTPUT", "1") != "0"
+
+# Identical prompts in flight at the same time share one model call
+COALESCE = os.environ.get("LLM_COALESCE", "1") != "0"
+inflight = SingleFlight()
+
+# Endpoints whose calls may go to a smaller, cheaper model
+CHEAP_MODEL = os.environ.get("LLM_CHEAP_MODEL") or None
+CHEAP_ENDPOINTS = {
+    name.strip() for name in os.environ.get("LLM_CHEAP_ENDPOINTS", "feedback,health").split(",") if name.strip()
+}
+
+
+def get_provider() -> ModelProvider:
+    """The active provider, created from the environment on first use."""
+    global _provider
+    if _provider is None:
+        _provider = provider_from_env()
+    return _provider
+
+
+def configure(new_limiter: Optional[ConcurrencyLimiter] = None,
+              provider: Optional[ModelProvider] = None,
+              caller: Optional[ResilientCaller] = None) -> None:
+    """Swap the limiter, provider and/or resilient caller (load tests plug the local stand-in in here)."""
+    global limiter, _provider, resilience
+    if new_limiter is not None:
+        limiter = new_limiter
+    if provider is not None:
+        _provider = provider
+    if caller is not None:
+        resilience = caller
+
+
+def model_for(endpoint: str) -> Optional[str]:
+    """Model name for an endpoint; None means the provider's default."""
+    if CHEAP_MODEL and endpoint in CHEAP_ENDPOINTS:
+        return CHEAP_MODEL
+    return None
+
+
+def saturated(endpoint: str) -> bool:
+    """True when a call for ``endpoint`` would be shed or short-circuited right now."""
+    breaker = resilience.breakers.get(model_for(endpoint) or "default")
+    return limiter.saturated() or (breaker is not None and breaker.is_open())
+
+
+async def generate_text(prompt: str, endpoint: str, json_schema: Optional[dict] = None) -> str:
+    """Run one completion without blocking the event loop and return its text.
+
+    ``json_schema`` asks for schema-constrained JSON where the provider
+    supports it; the text still goes through structured_output on our side.
+    A call with the same endpoint, model, schema and (whitespace-folded)
+    prompt that is already in flight is joined instead of repeated.
+
+    Raises CircuitOpenError / DeadlineExceeded / provider errors when the
+    model is unavailable; callers serve their fallbacks on any of them.
+    """
+    if not COALESCE:
+        return await _call_model(prompt, endpoint, json_schema)
+    key = prompt_key(endpoint, model_for(endpoint), json_schema, prompt=prompt)
+    text, shared = await inflight.do(key, lambda: _call_model(prompt, endpoint, json_schema), _call_context())
+    if shared:
+        COALESCED.inc(endpoint=endpoint)
+    return text
+
+
+def _call_context() -> contextvars.Context:
+    """Context for a call that other requests may join: empty except for the fair-queue client.
+
+    The client is carried over explicitly - the slot has to be charged to
+    someone, and charging every shared call to one common client would undo
+    per-client fairness - while nothing else of the starting request is.
+    """
+    context = contextvars.Context()
+    context.run(set_client, current_client())
+    return context
+
+
+async def _call_model(prompt: str, endpoint: str, json_schema: Optional[dict]) -> str:
+    async with limiter.slot(endpoint):
+        model = model_for(endpoint)
+        provider = get_provider()
+        schema = json_schema if STRUCTURED_OUTPUT else None
+        PROMPT_TOKENS.observe(count_tokens(prompt), endpoint=endpoint)
+        started = time.perf_counter()
+        try:
+            text = await resilience.call(
+                model or "default",
+                lambda: provider.generate(prompt, model=model, json_schema=schema),
+                reserve=lambda: limiter.try_reserve(endpoint),
+            )
+        except Exception as e:
+            _record_failure(endpoint, e, started)
+            raise
+        LATENCY.observe(time.perf_counter() - started, endpoint=endpoint, outcome="ok")
+        RESPONSE_TOKENS.observe(count_tokens(text), endpoint=endpoint)
+        return text
+
+
+def _record_failure(endpoint: str, error: Exception, started: float) -> None:
+    LATENCY.observe(time.perf_counter() - started, endpoint=endpoint, outcome="error")
+    ERRORS.inc(endpoint=endpoint, error=type(error).__name__)
+
+
+async def stream_text(prompt: str, endpoint: str) -> AsyncIterator[str]:
+    """Yield completion text chunks as the model produces them.
+
+    The concurrency slot is held until the stream is exhausted or closed.
+    Streams go through the circuit breaker but are not retried or hedged:
+    tokens may already have reached the client.
+    """
+    async with limiter.slot(endpoint):
+        model = model_for(endpoint)
+        breaker = resilience.breaker(model or "default")
+        PROMPT_TOKENS.observe(count_tokens(prompt), endpoint=endpoint)
+        started = time.perf_counter()
+        try:
+            breaker.before_call()
+        except Exception as e:
+            _record_failure(endpoint, e, started)
+            raise
+        completion = []
+        try:
+            async for chunk in get_provider().stream(prompt, model=model):
+                completion.append(chunk)
+                yield chunk
+        except (GeneratorExit, asyncio.CancelledError):
+            # Closed or cancelled by a client that went away: no verdict, but a probe must not wedge the breaker
+            breaker.probe_in_flight = False
+            raise
+        except Exception as e:
+            breaker.record_failure()
+            _record_failure(endpoint, e, started)
+            raise
+        breaker.record_success()
+        LATENCY.observe(time.perf_counter() - started, endpoint=endpoint, outcome="ok")
+        RESPONSE_TOKENS.observe(count_tokens("".join(completion)), endpoint=endpoint)
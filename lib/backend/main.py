@@ -1,17 +1,42 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Request
-from fastapi.staticfiles import StaticFiles
+import startup  # ilk import olmalı: açılış süreleri buradan ölçülür
+from fastapi import Depends, FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.requests import HTTPConnection
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, AsyncIterator, Awaitable, Callable, Tuple
 from dotenv import load_dotenv
 from contextlib import asynccontextmanager
-import google.generativeai as genai
+import asyncio
 import os
 import json
-import shutil
-import uuid
+import math
 from datetime import datetime
 
+import llm
+import stt
+from admission import Client, RateLimitedError, bucket_from_env, client_address, client_for, set_client
+from avatars import AvatarError, avatars_from_env
+from channel import CONNECTIONS, WS_IDLE_TIMEOUT, Outbox
+from evaluation_jobs import EVAL_SYNC_WAIT, jobs_from_env
+from health import UpstreamProber, probe_interval_from_env
+from ielts_features import prompt_hints, provisional_bands, transcript_features
+from llm import LLMBusyError
+from metrics import REGISTRY, HTTPMetricsMiddleware
+from multipart_stream import ENVELOPE_BYTES, FileField, MultipartError, check_length
+from resilience import CircuitOpenError, DeadlineExceeded
+from registry import registry_from_env
+from progress import progress_from_env
+from prompting import EVALUATION_TOKEN_BUDGET, render_history
+from response_cache import cache_from_env
+from sessions import store_from_env
+from static_files import uploads_from_env
+from split_feedback import SPLIT_FEEDBACK_GRACE, turns_from_env
+from structured_output import TRUNCATED, extract_json
+from streaming import FeedbackStreamParser, parse_completion, parse_feedback_json, sse_event, sse_stream
+
+startup.timer.mark("imports")
+
 load_dotenv()
 
 UPLOADS_DIR = "uploads"
@@ -23,13 +48,36 @@ os.makedirs(UPLOADS_DIR, exist_ok=True)
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    gemini_key = os.environ.get("GEMINI_API_KEY")
-    if not gemini_key:
-        print("⚠️  WARNING: GEMINI_API_KEY not found in environment variables!")
-    else:
-        print("✅ Gemini API Key loaded successfully")
-        genai.configure(api_key=gemini_key)
-
+    with startup.timer.timed("lifespan"):
+        gemini_key = os.environ.get("GEMINI_API_KEY")
+        provider = llm.get_provider()  # ucuz: SDK burada değil, aşağıdaki warm-up'ta yüklenir
+        if provider.name != "gemini":
+            print(f"🧪 Using '{provider.name}' model provider (no Gemini calls)")
+        elif not gemini_key:
+            print("⚠️  WARNING: GEMINI_API_KEY not found in environment variables!")
+        else:
+            print("✅ Gemini API Key loaded successfully")
+
+        # SDK importu (~1 sn) portun açılmasını beklemez; ilk model çağrısı bitmesini bekler
+        warmup = asyncio.create_task(warm_provider(provider))
+
+        prober = None
+        if (gemini_key or provider.name != "gemini") and upstream_prober.interval > 0:
+            prober = asyncio.create_task(upstream_prober.run())
+
+        watcher = None
+        reload_interval = float(os.environ.get("SCENARIO_RELOAD_INTERVAL", 5))
+        if reload_interval > 0:
+            watcher = asyncio.create_task(scenario_registry.watch(reload_interval))
+
+        evaluation_jobs.start()
+
+        # STT modeli her işçi sürecinde bir kez yüklenir
+        if stt_engine.available:
+            stt_engine.start()
+            print(f"🎙️  Speech-to-text: {stt_engine.name} ({stt_engine.stats().get('model')})")
+
+    print(f"⏱️  Startup: {startup.timer.summary()}")
     print("\n🚀 Language Learning API READY")
     print("📖 Swagger: http://localhost:8000/docs")
     print("🔗 Base URL: http://localhost:8000")
@@ -37,15 +85,50 @@ async def lifespan(app: FastAPI):
     yield
     
     # Shutdown
+    for task in (warmup, watcher, prober):
+        if task is not None:
+            task.cancel()
+    evaluation_jobs.stop()
+    stt_engine.close()
     print("\n👋 Language Learning API shutting down...")
 
+async def warm_provider(provider):
+    """Model SDK'sını ilk istekten önce arka planda yükler"""
+    # Uyanma isteği GIL için SDK importuyla yarışmasın; model isteyen bir istek gelirse import hemen başlar
+    await asyncio.sleep(startup.warmup_delay())
+    try:
+        with startup.timer.timed("provider_warmup"):
+            await provider.warm()
+    except Exception as e:
+        print(f"⚠️  Model provider warm-up failed: {type(e).__name__}: {e}")
+        return
+    print(f"✅ Model provider ready ({provider.name}, {startup.timer.phases['provider_warmup']:.2f}s)")
+
 app = FastAPI(
     title="Language Learning API - Gemini Edition",
     lifespan=lifespan
 )
 
+# Parse edilmiş LLM yanıtları için önbellek
+response_cache = cache_from_env()
+
+# Split modunda arka planda süren feedback analizleri
+feedback_turns = turns_from_env()
+
+# /health her istekte modeli çağırmaz; arka plandaki prober'ın son sonucunu okur
+upstream_prober = UpstreamProber(
+    lambda: llm.generate_text("Say hello in one word", endpoint="health"), probe_interval_from_env()
+)
+
+# Avatarlar içerik hash'iyle uploads/avatars altında saklanır
+avatar_store = avatars_from_env(UPLOADS_DIR)
+
+# Konuşma tanıma motoru (varsayılan: kapalı)
+stt_engine = stt.engine_from_env()
+
 # Mount uploads to /uploads
-app.mount("/uploads", StaticFiles(directory=UPLOADS_DIR), name="uploads")
+uploads = uploads_from_env(UPLOADS_DIR)
+app.mount("/uploads", uploads, name="uploads")
 
 # CORS ayarları
 app.add_middleware(
@@ -55,33 +138,73 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(HTTPMetricsMiddleware)
+
+@app.exception_handler(LLMBusyError)
+async def llm_busy_handler(request: Request, exc: LLMBusyError):
+    """LLM kuyruğu zaman aşımına uğradığında 503 döndürür"""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Server is busy, please try again shortly."},
+        headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))},
+    )
+
+@app.exception_handler(RateLimitedError)
+async def rate_limited_handler(request: Request, exc: RateLimitedError):
+    """İstemci hız sınırını aştığında 429 döndürür"""
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "Too many requests, please slow down."},
+        headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))},
+    )
+
+# İstemci başına token bucket (çoklu worker'da paylaşılan state'te tutulur)
+rate_limiter = bucket_from_env()
+
+def connection_client(conn: HTTPConnection) -> Client:
+    """İsteği (HTTP veya WebSocket) yapan istemci: API anahtarı, kullanıcı id'si veya IP.
+    Öncelikli kuyruk yalnızca Premium API anahtarıyla gelir."""
+    return client_for(
+        conn.headers.get("x-api-key"),
+        conn.headers.get("x-user-id"),
+        client_address(conn.client.host if conn.client else None, conn.headers.get("x-forwarded-for")),
+    )
+
+
+async def admit(request: Request) -> None:
+    """Model çağıran endpoint'ler için: istemciyi tanır, hız sınırını uygular, kuyruğu seçer"""
+    client = connection_client(request)
+    await rate_limiter.take(client)
+    set_client(client)
+
+# Gövde akıştan okunduğu için (boyut sınırı okurken uygulanır) dosya alanı şemada elle tanımlanır
+AVATAR_UPLOAD_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {"multipart/form-data": {"schema": {
+            "type": "object",
+            "properties": {"file": {"type": "string", "format": "binary"}},
+            "required": ["file"],
+        }}},
+    }
+}
 
-@app.post("/upload/avatar")
-async def upload_avatar(request: Request, file: UploadFile = File(...)):
-    """Avatar yükle ve URL döndür"""
+@app.post("/upload/avatar", openapi_extra=AVATAR_UPLOAD_BODY)
+async def upload_avatar(request: Request):
+    """Avatar yükle ve URL döndür (aynı görsel tekrar yüklenirse mevcut dosya kullanılır)"""
     try:
-        # Dosya uzantısını al
-        filename = file.filename or ""
-        file_ext = os.path.splitext(filename)[1]
-        if not file_ext or file_ext.lower() not in ['.jpg', '.jpeg', '.png', '.gif', '.webp']:
-            raise HTTPException(status_code=400, detail="Only images are allowed")
-            
-        # Benzersiz isim oluştur
-        new_filename = f"{uuid.uuid4()}{file_ext}"
-        file_path = os.path.join(UPLOADS_DIR, new_filename)
-        
-        # Dosyayı kaydet
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-            
-        # Dinamik URL oluştur (localhost veya production)
-        base_url = str(request.base_url).rstrip("/")
-        file_url = f"{base_url}/uploads/{new_filename}"
-        
-        return {"url": file_url}
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        avatar_store.check_length(request.headers.get("content-length"))
+        stored = await avatar_store.save(request.stream(), request.headers.get("content-type"))
+    except AvatarError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+    # Dinamik URL oluştur (localhost veya production)
+    base_url = f"{str(request.base_url).rstrip('/')}/uploads/avatars"
+    variants = {str(size): f"{base_url}/{name}" for size, name in stored.variants.items()}
+    original = f"{base_url}/{stored.original}"
+    # İstemci "url" alanını saklar: tam boy fotoğraf yerine en büyük küçük boyutu ver
+    url = variants[max(variants, key=int)] if variants else original
+    return {"url": url, "original": original, "variants": variants}
 
 # Models
 # ... models ...
@@ -90,12 +213,22 @@ class ConversationRequest(BaseModel):
     user_message: str
     conversation_history: List[dict] = []
     user_level: str = "beginner"
+    feedback_mode: str = "inline"  # "inline" veya "split" (yanıt ve feedback paralel üretilir)
 
 class ConversationResponse(BaseModel):
     ai_message: str
     feedback: Optional[str] = None
     grammar_corrections: List[str] = []
     vocabulary_suggestions: List[str] = []
+    turn_id: Optional[str] = None  # split modunda feedback bu id ile /feedback/{turn_id}'den alınır
+    feedback_pending: bool = False
+
+class FeedbackResult(BaseModel):
+    turn_id: str
+    status: str  # "pending", "ready" veya "failed"
+    feedback: Optional[str] = None
+    grammar_corrections: List[str] = []
+    vocabulary_suggestions: List[str] = []
 
 class ScenarioInfo(BaseModel):
     id: str
@@ -120,6 +253,7 @@ class ProgressUpdate(BaseModel):
     completed_scenario: Optional[str] = None
     added_xp: Optional[int] = None
     display_name: Optional[str] = None
+    avatar_url: Optional[str] = None
 
 class LeaderboardEntry(BaseModel):
     rank: int
@@ -128,80 +262,170 @@ class LeaderboardEntry(BaseModel):
     weekly_xp: int
     avatar_url: Optional[str] = None
 
-# Senaryolar - TÜM SENARYOLAR EKLENDİ
-SCENARIOS = [
-    {
-        "id": "restaurant",
-        "title": "Ordering at a Restaurant",
-        "description": "Learn how to order food at a restaurant",
-        "difficulty": "beginner",
-        "estimated_time": 5,
-        "system_prompt": """You are a friendly waiter at a restaurant. Help the user practice ordering food in English. Speak naturally but clearly. After each user message, provide gentle corrections if needed.
+# Senaryolar ve IELTS promptları scenarios/ klasöründen yüklenir (değişiklikte otomatik yenilenir)
+scenario_registry = registry_from_env()
 
-IMPORTANT CONTEXT RULE: This conversation is ONLY about a restaurant dining experience - ordering food, asking about the menu, making reservations, or anything related to eating at a restaurant. If the user says something completely unrelated to a restaurant setting (e.g., talking about job interviews, airports, shopping for clothes, etc.), you MUST politely redirect them. For example: "I appreciate your enthusiasm, but I'm your waiter today! 🍽️ Let's focus on your dining experience. Would you like to see our menu or would you like to hear today's specials?" Stay in character as a waiter at all times.
+def get_scenario_by_id(scenario_id: str):
+    return scenario_registry.get(scenario_id)
 
-CRITICAL LENGTH RULE: Keep your responses short, natural, and conversational. Do NOT exceed 2-3 sentences and maximum 30 words per response."""
-    },
-    {
-        "id": "job_interview",
-        "title": "Job Interview",
-        "description": "Introduce yourself and answer questions in a job interview",
-        "difficulty": "intermediate",
-        "estimated_time": 10,
-        "system_prompt": """You are a professional interviewer conducting a job interview. Ask relevant questions and help the user practice professional English. Be encouraging but realistic.
+def conversation_prompt_prefix(scenario: dict, user_level: str) -> str:
+    """Senaryo rolü ve kullanıcı seviyesi - önceden hazırlanmış prefix"""
+    return scenario_registry.conversation_prefix(scenario, user_level)
 
-IMPORTANT CONTEXT RULE: This conversation is ONLY about a job interview setting. If the user says something completely unrelated to a job interview (e.g., ordering food, asking for directions, casual chatting about hobbies unrelated to the interview), you MUST politely redirect them back to the interview. For example: "That's interesting, but let's stay focused on the interview. This is a professional setting, so let me ask you: could you tell me about your relevant experience?" Stay in character as an interviewer at all times.
+def build_conversation_prompt(
+    prefix: str, conversation_history: List[dict], user_message: str, with_feedback: bool = True
+) -> str:
+    """Hazır prefix ve konuşma geçmişinden Gemini prompt'unu oluşturur"""
+    # Konuşma geçmişini token bütçesine göre metne dönüştür (eski mesajlar özetlenir)
+    history_text = render_history(conversation_history, assistant_label="Assistant", user_label="User")
 
-CRITICAL LENGTH RULE: Keep your responses short, natural, and conversational. Do NOT exceed 2-3 sentences and maximum 30 words per response."""
-    },
-    {
-        "id": "shopping",
-        "title": "Shopping",
-        "description": "Speak English while shopping at a store",
-        "difficulty": "beginner",
-        "estimated_time": 5,
-        "system_prompt": """You are a helpful shop assistant at a clothing and general goods store. Help the user practice shopping vocabulary and common phrases used when buying things.
+    if not with_feedback:
+        # Split modu: feedback ayrı bir istekte üretilir
+        return f"""{prefix}
 
-IMPORTANT CONTEXT RULE: This conversation is ONLY about shopping at a store - looking for items, asking about prices, sizes, colors, trying things on, or paying. If the user says something completely unrelated to shopping (e.g., talking about job interviews, ordering food at a restaurant, etc.), you MUST politely redirect them. For example: "I'd love to help, but I'm a shop assistant! 🛍️ Let's focus on finding something great for you. Are you looking for anything in particular today?" Stay in character as a shop assistant at all times.
+Previous conversation:
+{history_text}
 
-CRITICAL LENGTH RULE: Keep your responses short, natural, and conversational. Do NOT exceed 2-3 sentences and maximum 30 words per response."""
-    },
-    {
-        "id": "airport",
-        "title": "At the Airport",
-        "description": "Check-in, passport control and security procedures",
-        "difficulty": "intermediate",
-        "estimated_time": 8,
-        "system_prompt": """You are an airport staff member (check-in agent, security officer, or customs official). Help the user practice airport-related English conversations.
+User's new message: {user_message}
 
-IMPORTANT CONTEXT RULE: This conversation is ONLY about airport situations - check-in, boarding, passport control, security, customs, baggage, flight information, etc. If the user says something completely unrelated to an airport experience (e.g., ordering food, job interviews, shopping), you MUST politely redirect them. For example: "I understand, but we're at the airport right now! ✈️ Let's focus on getting you through check-in. May I see your passport and boarding pass, please?" Stay in character as an airport staff member at all times.
+Instructions:
+1. Respond naturally to the user's message as your character
+2. Keep your response conversational and engaging
+3. Reply with your in-character message only - no feedback, notes or formatting"""
 
-CRITICAL LENGTH RULE: Keep your responses short, natural, and conversational. Do NOT exceed 2-3 sentences and maximum 30 words per response."""
-    },
-    {
-        "id": "small_talk",
-        "title": "Small Talk",
-        "description": "Have a friendly chat with someone you just met",
-        "difficulty": "beginner",
-        "estimated_time": 5,
-        "system_prompt": """You are a friendly person meeting someone new at a social event. Have a casual conversation, ask about their interests, hobbies, and life. Keep it natural and friendly.
+    return f"""{prefix}
+
+Previous conversation:
+{history_text}
+
+User's new message: {user_message}
+
+Instructions:
+1. Respond naturally to the user's message as your character
+2. Keep your response conversational and engaging
+3. After your response, provide feedback in JSON format inside <feedback> tags
+
+Response format:
+[Your natural conversational response here]
 
-IMPORTANT CONTEXT RULE: This conversation is about casual small talk and getting to know someone. Topics like weather, hobbies, travel, family, work (briefly), and interests are all fine. However, if the user tries to start a completely different scenario (e.g., pretending to order food, conducting a job interview, etc.), gently guide them back. For example: "Ha, that's funny! But let's just chat normally - I'd love to get to know you better. So, what do you enjoy doing in your free time?" Stay in character as a friendly acquaintance.
+<feedback>
+{{
+  "grammar_corrections": ["list any grammar mistakes - keep it to 1-2 most important ones"],
+  "vocabulary_suggestions": ["suggest 1-2 better words or phrases they could use"],
+  "general_feedback": "One encouraging sentence about their English"
+}}
+</feedback>"""
+
+def log_model_error(gemini_error: Exception) -> None:
+    """Model hatasını loglar; devre açıkken traceback basmaz"""
+    if isinstance(gemini_error, (CircuitOpenError, DeadlineExceeded)):
+        print(f"⚠️  Serving fallback reply: {gemini_error}")
+        return
+    import traceback
+    print(f"❌ Gemini Error Type: {type(gemini_error).__name__}")
+    print(f"❌ Gemini Error: {gemini_error}")
+    traceback.print_exception(type(gemini_error), gemini_error, gemini_error.__traceback__)
+
+def conversation_fallback(scenario_id: str) -> Callable[[Exception], str]:
+    """Senaryoya uygun yedek yanıt üretir; hata detayı kullanıcıya gösterilmez"""
+    def fallback(gemini_error: Exception) -> str:
+        log_model_error(gemini_error)
+        return scenario_registry.fallback_reply(scenario_id)
+    return fallback
+
+async def generate_reply(
+    prompt: str,
+    endpoint: str,
+    fallback_text: Callable[[Exception], str],
+    cache_keys: Optional[Tuple[str, str]] = None,
+) -> ConversationResponse:
+    """Gemini'den yanıt alır ve mesaj/feedback olarak ayrıştırır (önbellek varsa önce ona bakar)"""
+    cached = await response_cache.get(cache_keys)
+    if cached is not None:
+        return ConversationResponse(**cached)
+
+    try:
+        ai_response_raw = await llm.generate_text(prompt, endpoint=endpoint)
+    except LLMBusyError:
+        raise
+    except Exception as gemini_error:
+        # Yedek yanıtlar önbelleğe alınmaz
+        return ConversationResponse(**parse_completion(fallback_text(gemini_error)))
+
+    response = ConversationResponse(**parse_completion(ai_response_raw))
+    await response_cache.set(cache_keys, response.model_dump())
+    return response
+
+def build_feedback_prompt(user_message: str, learner: str, previous_ai_message: Optional[str] = None) -> str:
+    """Split modu için sadece dil geri bildirimi isteyen kısa prompt"""
+    context = f'They were replying to: "{previous_ai_message}"\n' if previous_ai_message else ""
+    return f"""You are an English teacher reviewing one message written by {learner}.
+{context}
+Learner's message: {user_message}
+
+Return ONLY this JSON, with no other text:
+{{
+  "grammar_corrections": ["list any grammar mistakes - keep it to 1-2 most important ones"],
+  "vocabulary_suggestions": ["suggest 1-2 better words or phrases they could use"],
+  "general_feedback": "One encouraging sentence about their English"
+}}"""
 
-CRITICAL LENGTH RULE: Keep your responses short, natural, and conversational. Do NOT exceed 2-3 sentences and maximum 30 words per response."""
+# Split modundaki sadece-JSON feedback isteğiyle modele gönderilen şema
+FEEDBACK_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "grammar_corrections": {"type": "array", "items": {"type": "string"}},
+        "vocabulary_suggestions": {"type": "array", "items": {"type": "string"}},
+        "general_feedback": {"type": "string"},
     },
-    {
-        "id": "general",
-        "title": "General Conversation (Premium)",
-        "description": "Unlimited conversation practice on any topic",
-        "difficulty": "all levels",
-        "estimated_time": 0,
-        "system_prompt": "You are a helpful and friendly English language partner. The user can discuss any topic with you. Keep the conversation engaging naturally."
-    }
-]
+    "required": ["grammar_corrections", "vocabulary_suggestions", "general_feedback"],
+}
 
-def get_scenario_by_id(scenario_id: str):
-    return next((s for s in SCENARIOS if s["id"] == scenario_id), None)
+def _last_ai_message(conversation_history: List[dict]) -> Optional[str]:
+    return next((m.get("content") for m in reversed(conversation_history) if m.get("role") == "assistant"), None)
+
+async def _analyze_feedback(feedback_prompt: str) -> Optional[dict]:
+    return parse_feedback_json(await llm.generate_text(feedback_prompt, endpoint="feedback", json_schema=FEEDBACK_SCHEMA))
+
+async def generate_split_reply(
+    reply_prompt: str,
+    feedback_prompt: str,
+    endpoint: str,
+    fallback_text: Callable[[Exception], str],
+    cache_keys: Optional[Tuple[str, str]] = None,
+) -> ConversationResponse:
+    """Yanıt ve feedback'i iki paralel istekle üretir; yanıt hazır olunca hemen döner"""
+    cached = await response_cache.get(cache_keys)
+    if cached is not None and "feedback" in cached:
+        return ConversationResponse(**cached)
+
+    turn_id, feedback_task = await feedback_turns.start(_analyze_feedback(feedback_prompt))
+    from_model = True
+    if cached is not None:
+        # Normalize edilmiş eşleşme: yanıt aynı, ama feedback bu mesajın kendi yazımı için yeniden üretilir
+        ai_message = cached["ai_message"]
+    else:
+        try:
+            ai_message = (await llm.generate_text(reply_prompt, endpoint=endpoint)).strip()
+        except LLMBusyError:
+            feedback_task.cancel()
+            raise
+        except Exception as gemini_error:
+            ai_message = fallback_text(gemini_error)
+            from_model = False
+
+    # Feedback kısa bir süre içinde biterse yanıtla birlikte gönder, yoksa turn_id ile sonradan alınır
+    result = await feedback_turns.wait(turn_id, SPLIT_FEEDBACK_GRACE)
+    response = ConversationResponse(ai_message=ai_message, turn_id=turn_id)
+    if result and result["status"] == "ready":
+        response.feedback = result.get("feedback")
+        response.grammar_corrections = result.get("grammar_corrections", [])
+        response.vocabulary_suggestions = result.get("vocabulary_suggestions", [])
+        if from_model:
+            await response_cache.set(cache_keys, response.model_dump(exclude={"turn_id", "feedback_pending"}))
+    else:
+        response.feedback_pending = result is not None and result["status"] == "pending"
+    return response
 
 @app.get("/")
 async def root():
@@ -213,44 +437,48 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    """Gemini API bağlantısını test eder"""
+    """Ucuz canlılık kontrolü: model bağlantısı arka planda periyodik olarak test edilir"""
     gemini_key = os.environ.get("GEMINI_API_KEY")
+    provider = llm.get_provider()
     result = {
+        "status": "ok",
+        "provider": provider.name,
         "api_key_present": bool(gemini_key),
         "api_key_prefix": gemini_key[:10] + "..." if gemini_key else None,
     }
-    
-    if gemini_key:
-        try:
-            genai.configure(api_key=gemini_key)
-            model = genai.GenerativeModel('gemini-2.5-flash')
-            response = model.generate_content("Say hello in one word")
-            result["gemini_status"] = "working"
-            result["gemini_response"] = response.text[:100]
-        except Exception as e:
-            result["gemini_status"] = "error"
-            result["gemini_error_type"] = type(e).__name__
-            result["gemini_error"] = str(e)[:300]
+
+    if gemini_key or provider.name != "gemini":
+        result.update(upstream_prober.status)
+        age = upstream_prober.age()
+        result["checked_seconds_ago"] = None if age is None else round(age, 1)
     else:
         result["gemini_status"] = "no_api_key"
-    
+
+    result["response_cache"] = response_cache.stats()
+    result["startup_seconds"] = startup.timer.phases
     return result
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus metin formatında metrikler"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/llm/status")
+async def llm_status():
+    """Devre kesici durumu, yeniden deneme bütçesi ve eşzamanlılık sayaçları"""
+    return {
+        "provider": llm.get_provider().name,
+        "resilience": llm.resilience.stats(),
+        "concurrency": llm.limiter.stats(),
+        "coalescing": llm.inflight.stats(),
+    }
+
 @app.get("/scenarios", response_model=List[ScenarioInfo])
 async def get_scenarios():
     """Tüm senaryoların listesini döndürür"""
-    return [
-        ScenarioInfo(
-            id=s["id"],
-            title=s["title"],
-            description=s["description"],
-            difficulty=s["difficulty"],
-            estimated_time=s["estimated_time"]
-        )
-        for s in SCENARIOS
-    ]
+    return scenario_registry.list_infos()
 
-@app.post("/conversation", response_model=ConversationResponse)
+@app.post("/conversation", response_model=ConversationResponse, dependencies=[Depends(admit)])
 async def create_conversation(request: ConversationRequest):
     """Google Gemini kullanarak sohbet ve geri bildirim oluşturur"""
     try:
@@ -258,88 +486,259 @@ async def create_conversation(request: ConversationRequest):
         if not scenario:
             raise HTTPException(status_code=404, detail="Scenario not found")
 
-        # Konuşma geçmişini metne dönüştür
-        history_text = ""
-        for msg in request.conversation_history[-10:]:  # Son 10 mesajı al
-            role = "Assistant" if msg["role"] == "assistant" else "User"
-            history_text += f"{role}: {msg['content']}\n"
+        prefix = conversation_prompt_prefix(scenario, request.user_level)
+        prompt = build_conversation_prompt(prefix, request.conversation_history, request.user_message)
+        cache_keys = response_cache.keys_for(
+            ("scenario", request.scenario, request.user_level), request.conversation_history, request.user_message, prefix
+        )
+        if request.feedback_mode == "split":
+            return await generate_split_reply(
+                build_conversation_prompt(prefix, request.conversation_history, request.user_message, with_feedback=False),
+                build_feedback_prompt(
+                    request.user_message,
+                    f"a {request.user_level} English learner practising the \"{scenario['title']}\" scenario",
+                    _last_ai_message(request.conversation_history),
+                ),
+                endpoint="conversation",
+                fallback_text=conversation_fallback(request.scenario),
+                cache_keys=cache_keys,
+            )
+        return await generate_reply(
+            prompt, endpoint="conversation", fallback_text=conversation_fallback(request.scenario), cache_keys=cache_keys
+        )
 
-        # Gemini Prompt
-        prompt = f"""You are playing the following role: {scenario['system_prompt']}
+    except (HTTPException, LLMBusyError):
+        raise
+    except Exception as e:
+        print(f"Conversation Error: {e}")
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
-The user's English level is: {request.user_level}
+async def _single_chunk(text: str) -> AsyncIterator[str]:
+    yield text
 
-Previous conversation:
-{history_text}
 
-User's new message: {request.user_message}
+async def open_llm_stream(
+    prompt: str, endpoint: str, fallback_text: Callable[[Exception], str]
+) -> Tuple[AsyncIterator[str], bool]:
+    """Stream'i açar; kapasite hatası (503) header'lar gönderilmeden önce yükselir.
 
-Instructions:
-1. Respond naturally to the user's message as your character
-2. Keep your response conversational and engaging
-3. After your response, provide feedback in JSON format inside <feedback> tags
+    İkinci değer yanıtın modelden gelip gelmediğini (yedek mesaj değil) belirtir.
+    """
+    chunks = llm.stream_text(prompt, endpoint=endpoint)
+    try:
+        first_chunk = await chunks.__anext__()
+    except StopAsyncIteration:
+        return _single_chunk(""), True
+    except LLMBusyError:
+        raise
+    except Exception as gemini_error:
+        return _single_chunk(fallback_text(gemini_error)), False
+
+    async def _chained() -> AsyncIterator[str]:
+        try:
+            yield first_chunk
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await chunks.aclose()
 
-Response format:
-[Your natural conversational response here]
+    return _chained(), True
 
-<feedback>
-{{
-  "grammar_corrections": ["list any grammar mistakes - keep it to 1-2 most important ones"],
-  "vocabulary_suggestions": ["suggest 1-2 better words or phrases they could use"],
-  "general_feedback": "One encouraging sentence about their English"
-}}
-</feedback>"""
 
-        # Google Gemini çağrısı
-        try:
-            model = genai.GenerativeModel('gemini-2.5-flash')
-            response = model.generate_content(prompt)
-            ai_response_raw = response.text
-        except Exception as gemini_error:
-            # Gemini hatası detaylarını logla
-            import traceback
-            print(f"❌ Gemini Error Type: {type(gemini_error).__name__}")
-            print(f"❌ Gemini Error: {gemini_error}")
-            traceback.print_exc()
-            # Hata detayını da döndür (debug amaçlı)
-            ai_response_raw = f"I'm having a temporary issue. Error: {type(gemini_error).__name__}: {str(gemini_error)[:200]}"
-
-        # Feedback'i ayrıştır
-        feedback_data = {
-            "ai_message": ai_response_raw,
-            "feedback": None,
-            "grammar_corrections": [],
-            "vocabulary_suggestions": []
+async def conversation_events(
+    chunks: AsyncIterator[str],
+    on_complete: Optional[Callable[["ConversationResponse"], Awaitable[None]]] = None,
+) -> AsyncIterator[Tuple[str, dict]]:
+    """Model çıktısını token / feedback / done olaylarına dönüştürür (SSE ve WebSocket ortak)"""
+    parser = FeedbackStreamParser()
+    try:
+        async for chunk in chunks:
+            delta, feedback = parser.feed(chunk)
+            if delta:
+                yield "token", {"text": delta}
+            if feedback:
+                yield "feedback", feedback
+    except Exception as e:
+        print(f"Stream Error: {e}")
+        yield "error", {"detail": "The response stream was interrupted."}
+        on_complete = None
+
+    delta, feedback = parser.close()
+    if delta:
+        yield "token", {"text": delta}
+    if feedback:
+        yield "feedback", feedback
+
+    response = ConversationResponse(ai_message=parser.message, **(parser.feedback or {}))
+    if on_complete is not None:
+        await on_complete(response)
+    yield "done", response.model_dump()
+
+
+async def cached_events(
+    response: "ConversationResponse",
+    on_complete: Optional[Callable[["ConversationResponse"], Awaitable[None]]] = None,
+) -> AsyncIterator[Tuple[str, dict]]:
+    """Önbellekteki yanıtı stream ile aynı olay sırasında gönderir"""
+    yield "token", {"text": response.ai_message}
+    if response.feedback is not None or response.grammar_corrections or response.vocabulary_suggestions:
+        yield "feedback", {
+            "feedback": response.feedback,
+            "grammar_corrections": response.grammar_corrections,
+            "vocabulary_suggestions": response.vocabulary_suggestions,
         }
-        
-        if "<feedback>" in ai_response_raw and "</feedback>" in ai_response_raw:
-            parts = ai_response_raw.split("<feedback>")
-            feedback_data["ai_message"] = parts[0].strip()
-            
-            try:
-                feedback_json_str = parts[1].split("</feedback>")[0].strip()
-                fb_json = json.loads(feedback_json_str)
-                feedback_data["feedback"] = fb_json.get("general_feedback", "")
-                feedback_data["grammar_corrections"] = fb_json.get("grammar_corrections", [])
-                feedback_data["vocabulary_suggestions"] = fb_json.get("vocabulary_suggestions", [])
-            except json.JSONDecodeError as e:
-                print(f"JSON Parse Error: {e}")
-                # Feedback parse edilemezse devam et
+    if on_complete is not None:
+        await on_complete(response)
+    yield "done", response.model_dump()
+
+
+async def reply_events(
+    prompt: str,
+    endpoint: str,
+    fallback_text: Callable[[Exception], str],
+    cache_keys: Optional[Tuple[str, str]] = None,
+    on_complete: Optional[Callable[["ConversationResponse"], Awaitable[None]]] = None,
+) -> AsyncIterator[Tuple[str, dict]]:
+    """Önbellek ve stream açma; kapasite hatası (LLMBusyError) ilk olaydan önce yükselir"""
+    cached = await response_cache.get(cache_keys)
+    if cached is not None:
+        return cached_events(ConversationResponse(**cached), on_complete)
+
+    chunks, from_model = await open_llm_stream(prompt, endpoint=endpoint, fallback_text=fallback_text)
+
+    async def _complete(response: ConversationResponse) -> None:
+        if from_model:
+            await response_cache.set(cache_keys, response.model_dump())
+        if on_complete is not None:
+            await on_complete(response)
+
+    return conversation_events(chunks, on_complete=_complete)
+
+
+async def stream_reply(
+    prompt: str,
+    endpoint: str,
+    fallback_text: Callable[[Exception], str],
+    cache_keys: Optional[Tuple[str, str]] = None,
+    on_complete: Optional[Callable[["ConversationResponse"], Awaitable[None]]] = None,
+) -> StreamingResponse:
+    """generate_reply'ın SSE sürümü"""
+    events = await reply_events(prompt, endpoint, fallback_text, cache_keys, on_complete)
+    return sse_response(sse_stream(events))
+
+
+def sse_response(events: AsyncIterator[str]) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/conversation/stream", dependencies=[Depends(admit)])
+async def create_conversation_stream(request: ConversationRequest):
+    """/conversation'ın SSE ile token token yanıt veren sürümü"""
+    scenario = get_scenario_by_id(request.scenario)
+    if not scenario:
+        raise HTTPException(status_code=404, detail="Scenario not found")
+
+    prefix = conversation_prompt_prefix(scenario, request.user_level)
+    prompt = build_conversation_prompt(prefix, request.conversation_history, request.user_message)
+    cache_keys = response_cache.keys_for(
+        ("scenario", request.scenario, request.user_level), request.conversation_history, request.user_message, prefix
+    )
+    return await stream_reply(
+        prompt, endpoint="conversation", fallback_text=conversation_fallback(request.scenario), cache_keys=cache_keys
+    )
+
+STT_UPLOAD_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {"multipart/form-data": {"schema": {
+            "type": "object",
+            "properties": {"audio": {"type": "string", "format": "binary"}},
+            "required": ["audio"],
+        }}},
+    }
+}
 
-        return ConversationResponse(**feedback_data)
 
-    except Exception as e:
-        print(f"Conversation Error: {e}")
-        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+@app.post("/speech-to-text", openapi_extra=STT_UPLOAD_BODY)
+async def speech_to_text(request: Request):
+    """Ses kaydını metne çevir (STT_ENGINE; yapılandırılmamışsa kullanıcıdan yazması istenir)"""
+    if not stt_engine.available:
+        return await stt_engine.transcribe(b"", stt.SAMPLE_RATE)
 
-@app.post("/speech-to-text")
-async def speech_to_text(audio: UploadFile = File(...)):
-    """Ses-metin dönüşümü (şimdilik devre dışı - AssemblyAI kaldırıldı)"""
-    return {
-        "text": "Speech-to-text feature temporarily disabled. Please type your message.",
-        "confidence": 0.0,
-        "words": []
-    }
+    # Gövde geldikçe okunur (önce diske yazılmaz); sınır aşılınca okumayı bırak
+    limit = stt.max_upload_bytes()
+    chunks, size = [], 0
+    try:
+        check_length(request.headers.get("content-length"), limit + ENVELOPE_BYTES)
+        field = FileField(request.headers.get("content-type"), b"audio", limit + ENVELOPE_BYTES)
+        async for data in field.chunks(request.stream()):
+            size += len(data)
+            if size > limit:
+                raise MultipartError("Audio too large", too_large=True)
+            chunks.append(data)
+    except MultipartError as e:
+        if e.too_large:
+            stt.REQUESTS.inc(engine=stt_engine.name, outcome="too_large")
+            raise HTTPException(status_code=413, detail=f"Audio must be at most {limit // 1024} KB")
+        stt.REQUESTS.inc(engine=stt_engine.name, outcome="bad_audio")
+        raise HTTPException(status_code=400, detail=e.detail)
+    if not chunks:
+        stt.REQUESTS.inc(engine=stt_engine.name, outcome="bad_audio")
+        raise HTTPException(status_code=400, detail="Empty audio file" if field.found else "No audio uploaded")
+
+    try:
+        pcm, sample_rate = await stt.decode_audio(b"".join(chunks))
+    except stt.AudioFormatError as e:
+        stt.REQUESTS.inc(engine=stt_engine.name, outcome="bad_audio")
+        raise HTTPException(status_code=415, detail=str(e))
+    result = await stt_engine.transcribe(pcm, sample_rate)
+    stt.REQUESTS.inc(engine=stt_engine.name, outcome="ok")
+    return result
+
+
+@app.websocket("/speech-to-text/stream")
+async def speech_to_text_stream(websocket: WebSocket, sample_rate: int = stt.SAMPLE_RATE):
+    """Canlı kayıt: istemci 16-bit mono PCM parçaları gönderir, ara sonuçlar anında döner.
+
+    Binary mesajlar ses, "end" metni kaydın bittiğini bildirir. Sunucu
+    {"type": "partial", "text"} ve en sonda {"type": "final", "text", "confidence", "words"} gönderir.
+    """
+    await websocket.accept()
+    if not stt.MIN_SAMPLE_RATE <= sample_rate <= stt.MAX_SAMPLE_RATE:
+        stt.REQUESTS.inc(engine=stt_engine.name, outcome="bad_audio")
+        await websocket.close(
+            code=1008, reason=f"sample_rate must be {stt.MIN_SAMPLE_RATE}-{stt.MAX_SAMPLE_RATE} Hz"
+        )  # 1008: kurala aykırı istek
+        return
+    stream = stt_engine.stream(sample_rate)
+    limit, size = stt.max_upload_bytes(), 0
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            if message.get("bytes"):
+                size += len(message["bytes"])
+                if size > limit:
+                    stt.REQUESTS.inc(engine=stt_engine.name, outcome="too_large")
+                    await websocket.close(code=1009, reason="Recording too long")
+                    return
+                # Bir sonraki parça, bu parça tanınana kadar okunmaz (doğal geri basınç)
+                partial = await stream.feed(message["bytes"])
+                if partial is not None:
+                    await websocket.send_json({"type": "partial", "text": partial})
+            elif message.get("text") == "end":
+                break
+        result = await stream.finish()
+        stt.REQUESTS.inc(engine=stt_engine.name, outcome="ok")
+        await websocket.send_json({"type": "final", **result})
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
 
 
 # IELTS Speaking Models
@@ -348,78 +747,43 @@ class IeltsConversationRequest(BaseModel):
     user_message: str
     conversation_history: List[dict] = []
     topic_card: Optional[str] = None
+    feedback_mode: str = "inline"  # "inline" veya "split"
 
 
-# IELTS Part prompts
-IELTS_PROMPTS = {
-    1: """You are a professional IELTS speaking examiner conducting Part 1 of the test.
-Your role:
-- Ask general questions about the candidate's life, work, studies, hobbies, etc.
-- Be professional but friendly
-- Ask ONE clear question at a time
-- If this is the first message, introduce yourself briefly and ask about their name
-- Follow up naturally on their responses
-- Keep questions simple and direct
-
-Remember: In Part 1, questions are about familiar topics. Ask about things like:
-- Home/accommodation, family, work/studies, hobbies, daily routine, hometown
-
-IMPORTANT CONTEXT RULE: This is a formal IELTS Speaking exam. If the candidate says something completely unrelated to the exam (e.g., ordering food, asking random questions), politely redirect them: "Let's stay focused on the exam. I'll ask you a question, and please answer as clearly as you can." Stay in character as an IELTS examiner at all times.""",
-
-    2: """You are a professional IELTS speaking examiner conducting Part 2 of the test.
-The candidate has been given a topic card and has just finished speaking for 1-2 minutes.
-Your role:
-- Listen to their response about the topic card
-- Ask 1-2 brief follow-up questions related to their topic
-- Be encouraging but professional
-- Transition smoothly when ready to move to Part 3
-
-Topic card given to candidate: {topic_card}
-
-IMPORTANT CONTEXT RULE: This is a formal IELTS Speaking exam. If the candidate goes completely off-topic from the topic card, gently guide them back: "That's interesting, but let's focus on the topic card. Could you tell me more about [topic]?" Stay in character as an IELTS examiner.""",
-
-    3: """You are a professional IELTS speaking examiner conducting Part 3 of the test.
-Your role:
-- Ask deeper, more abstract questions related to the Part 2 topic
-- Encourage the candidate to give extended answers with opinions and explanations
-- Ask about general/societal aspects, not personal experiences
-- Challenge them to think critically
-- Ask ONE question at a time
-
-Focus on:
-- Asking "why" and "how" questions
-- Exploring different perspectives
-- Discussing trends, changes, and future implications
-
-IMPORTANT CONTEXT RULE: This is a formal IELTS Speaking exam. If the candidate says something completely unrelated to the discussion topic, redirect them professionally: "That's an interesting thought, but let's stay on topic. Let me rephrase my question..." Stay in character as an IELTS examiner."""
-}
+def ielts_prompt_prefix(part: int, topic_card: Optional[str]) -> str:
+    """Part'a ait examiner sistem promptu - oturum boyunca değişmeyen kısım"""
+    return scenario_registry.ielts_prefix(part, topic_card)
 
 
-@app.post("/ielts/conversation", response_model=ConversationResponse)
-async def ielts_conversation(request: IeltsConversationRequest):
-    """IELTS Speaking sınavı için özel endpoint"""
-    try:
-        # Part için sistem promptunu al
-        part = min(max(request.part, 1), 3)  # 1-3 arası sınırla
-        system_prompt = IELTS_PROMPTS.get(part, IELTS_PROMPTS[1])
-        
-        # Part 2 için topic card'ı prompt'a ekle
-        if part == 2 and request.topic_card:
-            system_prompt = system_prompt.format(topic_card=request.topic_card)
+def build_ielts_prompt(
+    prefix: str, conversation_history: List[dict], user_message: str, with_feedback: bool = True
+) -> str:
+    """Examiner prefix'i ve konuşma geçmişinden prompt'u oluşturur"""
+    # Konuşma geçmişini token bütçesine göre metne dönüştür (eski mesajlar özetlenir)
+    history_text = render_history(conversation_history, assistant_label="Examiner", user_label="Candidate")
 
-        # Konuşma geçmişini metne dönüştür
-        history_text = ""
-        for msg in request.conversation_history[-10:]:
-            role = "Examiner" if msg["role"] == "assistant" else "Candidate"
-            history_text += f"{role}: {msg['content']}\n"
+    if not with_feedback:
+        # Split modu: feedback ayrı bir istekte üretilir
+        return f"""{prefix}
 
-        # Gemini Prompt
-        prompt = f"""{system_prompt}
+Previous conversation:
+{history_text}
+
+Candidate's response: {user_message}
+
+Instructions:
+1. Respond naturally as an IELTS examiner
+2. For Part 1: Ask another general question OR acknowledge and move on
+3. For Part 2: Give brief feedback and ask a follow-up question
+4. For Part 3: Acknowledge their point and ask a deeper related question
+5. Reply with your examiner response only - keep it concise and professional, no JSON or notes"""
+
+    return f"""{prefix}
 
 Previous conversation:
 {history_text}
 
-Candidate's response: {request.user_message}
+Candidate's response: {user_message}
 
 Instructions:
 1. Respond naturally as an IELTS examiner
@@ -445,54 +809,83 @@ Response format:
 }}
 </feedback>"""
 
-        # Google Gemini çağrısı
-        try:
-            model = genai.GenerativeModel('gemini-2.5-flash')
-            response = model.generate_content(prompt)
-            ai_response_raw = response.text
-        except Exception as gemini_error:
-            print(f"Gemini Error: {gemini_error}")
-            if part == 1:
-                ai_response_raw = "That's interesting. Can you tell me about your hobbies or what you like to do in your free time?"
-            elif part == 2:
-                ai_response_raw = "Thank you for that response. Is there anything else you'd like to add about this topic?"
-            else:
-                ai_response_raw = "That's a thoughtful perspective. Why do you think this is the case in modern society?"
-
-        # Feedback'i ayrıştır
-        feedback_data = {
-            "ai_message": ai_response_raw,
-            "feedback": None,
-            "grammar_corrections": [],
-            "vocabulary_suggestions": []
-        }
-        
-        if "<feedback>" in ai_response_raw and "</feedback>" in ai_response_raw:
-            parts = ai_response_raw.split("<feedback>")
-            feedback_data["ai_message"] = parts[0].strip()
-            
-            try:
-                feedback_json_str = parts[1].split("</feedback>")[0].strip()
-                fb_json = json.loads(feedback_json_str)
-                feedback_data["feedback"] = fb_json.get("general_feedback", "")
-                feedback_data["grammar_corrections"] = fb_json.get("grammar_corrections", [])
-                feedback_data["vocabulary_suggestions"] = fb_json.get("vocabulary_suggestions", [])
-            except json.JSONDecodeError as e:
-                print(f"JSON Parse Error: {e}")
 
-        return ConversationResponse(**feedback_data)
+def ielts_fallback_message(part: int) -> Callable[[Exception], str]:
+    """Gemini erişilemezken part'a uygun yedek examiner sorusu"""
+    def fallback(gemini_error: Exception) -> str:
+        log_model_error(gemini_error)
+        return scenario_registry.ielts_fallback(part)
+    return fallback
 
+
+@app.post("/ielts/conversation", response_model=ConversationResponse, dependencies=[Depends(admit)])
+async def ielts_conversation(request: IeltsConversationRequest):
+    """IELTS Speaking sınavı için özel endpoint"""
+    try:
+        part = min(max(request.part, 1), 3)  # 1-3 arası sınırla
+        prefix = ielts_prompt_prefix(part, request.topic_card)
+        prompt = build_ielts_prompt(prefix, request.conversation_history, request.user_message)
+        cache_keys = response_cache.keys_for(
+            ("ielts", part, request.topic_card), request.conversation_history, request.user_message, prefix
+        )
+        if request.feedback_mode == "split":
+            return await generate_split_reply(
+                build_ielts_prompt(prefix, request.conversation_history, request.user_message, with_feedback=False),
+                build_feedback_prompt(
+                    request.user_message,
+                    f"a candidate in Part {part} of the IELTS Speaking test",
+                    _last_ai_message(request.conversation_history),
+                ),
+                endpoint="ielts_conversation",
+                fallback_text=ielts_fallback_message(part),
+                cache_keys=cache_keys,
+            )
+        return await generate_reply(
+            prompt,
+            endpoint="ielts_conversation",
+            fallback_text=ielts_fallback_message(part),
+            cache_keys=cache_keys,
+        )
+
+    except (HTTPException, LLMBusyError):
+        raise
     except Exception as e:
         print(f"IELTS Conversation Error: {e}")
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
 
+@app.post("/ielts/conversation/stream", dependencies=[Depends(admit)])
+async def ielts_conversation_stream(request: IeltsConversationRequest):
+    """/ielts/conversation'ın SSE ile token token yanıt veren sürümü"""
+    part = min(max(request.part, 1), 3)
+    prefix = ielts_prompt_prefix(part, request.topic_card)
+    prompt = build_ielts_prompt(prefix, request.conversation_history, request.user_message)
+    cache_keys = response_cache.keys_for(
+        ("ielts", part, request.topic_card), request.conversation_history, request.user_message, prefix
+    )
+    return await stream_reply(
+        prompt,
+        endpoint="ielts_conversation",
+        fallback_text=ielts_fallback_message(part),
+        cache_keys=cache_keys,
+    )
+
+
+@app.get("/feedback/{turn_id}", response_model=FeedbackResult)
+async def get_turn_feedback(turn_id: str, wait: float = 0.0):
+    """Split modunda sonradan tamamlanan feedback'i döndürür (wait ile kısa süre bekleyebilir)"""
+    result = await feedback_turns.wait(turn_id, min(max(wait, 0.0), 30.0))
+    if result is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired turn id")
+    return FeedbackResult(turn_id=turn_id, **result)
+
+
 # IELTS Band Score Evaluation
 class IeltsEvaluationRequest(BaseModel):
     conversation_history: List[dict]
 
 
-class IeltsEvaluationResponse(BaseModel):
+class IeltsScores(BaseModel):
     band_score: float
     feedback: str
     fluency_score: Optional[float] = None
@@ -501,94 +894,529 @@ class IeltsEvaluationResponse(BaseModel):
     coherence_score: Optional[float] = None
 
 
-@app.post("/ielts/evaluate", response_model=IeltsEvaluationResponse)
-async def evaluate_ielts_speaking(request: IeltsEvaluationRequest):
-    """IELTS Speaking sınavını değerlendir ve band score hesapla"""
-    try:
-        # Konuşma geçmişini metne dönüştür
-        conversation_text = ""
-        candidate_responses = []
-        
-        for msg in request.conversation_history:
-            role = "Examiner" if msg["role"] == "assistant" else "Candidate"
-            conversation_text += f"{role}: {msg['content']}\n"
-            if msg["role"] == "user":
-                candidate_responses.append(msg["content"])
-
-        if not candidate_responses:
-            return IeltsEvaluationResponse(
-                band_score=0.0,
-                feedback="No candidate responses to evaluate."
-            )
+class IeltsEvaluationResponse(IeltsScores):
+    provisional: bool = False  # True: model sonucu henüz yok, yerel metin analizine (ielts_features) dayalı tahmin
+    job_id: Optional[str] = None  # kesin sonuç /ielts/evaluations/{job_id}'den alınabilir
 
-        # Gemini ile değerlendirme
-        prompt = f"""You are an experienced IELTS Speaking examiner. Evaluate the following IELTS Speaking test conversation.
 
-CONVERSATION:
-{conversation_text}
+class IeltsEvaluationBatchRequest(BaseModel):
+    transcripts: List[IeltsEvaluationRequest]
+
+
+class IeltsEvaluationJob(BaseModel):
+    job_id: str
+    status: str  # "queued", "running", "done" veya "failed"
+    provisional: IeltsScores
+    result: Optional[IeltsScores] = None
+
 
-Evaluate the candidate's performance based on the official IELTS Speaking assessment criteria:
+class IeltsEvaluationJobs(BaseModel):
+    jobs: List[IeltsEvaluationJob]
+
+
+IELTS_CRITERIA = """Evaluate the candidate's performance based on the official IELTS Speaking assessment criteria:
 1. Fluency and Coherence (0-9)
 2. Lexical Resource / Vocabulary (0-9)
 3. Grammatical Range and Accuracy (0-9)
 4. Pronunciation (assume average pronunciation since this is text-based) (0-9)
 
-Calculate the overall band score as the average of these four criteria, rounded to the nearest 0.5.
+Calculate the overall band score as the average of these four criteria, rounded to the nearest 0.5."""
 
-Provide your assessment in the following JSON format ONLY (no other text):
-{{
+IELTS_RESULT_FORMAT = """{
   "band_score": <overall band score as float, e.g. 6.5>,
   "fluency_score": <fluency score>,
   "vocabulary_score": <vocabulary score>,
   "grammar_score": <grammar score>,
   "coherence_score": <coherence score>,
   "feedback": "<Brief 2-3 sentence feedback in English summarizing the candidate's strengths and areas for improvement>"
-}}"""
+}"""
+
+IELTS_RESULT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "band_score": {"type": "number"},
+        "fluency_score": {"type": "number"},
+        "vocabulary_score": {"type": "number"},
+        "grammar_score": {"type": "number"},
+        "coherence_score": {"type": "number"},
+        "feedback": {"type": "string"},
+    },
+    "required": ["band_score", "fluency_score", "vocabulary_score", "grammar_score", "coherence_score", "feedback"],
+}
 
-        try:
-            model = genai.GenerativeModel('gemini-2.5-flash')
-            response = model.generate_content(prompt)
-            result_text = response.text.strip()
-            
-            # Extract JSON from response
-            if "```json" in result_text:
-                result_text = result_text.split("```json")[1].split("```")[0].strip()
-            elif "```" in result_text:
-                result_text = result_text.split("```")[1].split("```")[0].strip()
-            
-            result = json.loads(result_text)
-            
-            return IeltsEvaluationResponse(
-                band_score=float(result.get("band_score", 5.0)),
-                feedback=result.get("feedback", "Evaluation completed."),
-                fluency_score=result.get("fluency_score"),
-                vocabulary_score=result.get("vocabulary_score"),
-                grammar_score=result.get("grammar_score"),
-                coherence_score=result.get("coherence_score")
-            )
+MAX_EVALUATION_BATCH = 20
 
-        except Exception as gemini_error:
-            print(f"Gemini Evaluation Error: {gemini_error}")
-            # Basit bir fallback hesaplama
-            avg_response_length = sum(len(r.split()) for r in candidate_responses) / len(candidate_responses)
-            
-            # Basit bir puan tahmini
-            if avg_response_length >= 50:
-                estimated_score = 7.0
-            elif avg_response_length >= 30:
-                estimated_score = 6.0
-            elif avg_response_length >= 15:
-                estimated_score = 5.0
-            else:
-                estimated_score = 4.5
-            
-            return IeltsEvaluationResponse(
-                band_score=estimated_score,
-                feedback="Your exam performance has been evaluated. You can increase your score by giving longer and more detailed answers."
-            )
 
-    except Exception as e:
-        print(f"IELTS Evaluation Error: {e}")
-        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+def candidate_responses_of(conversation_history: List[dict]) -> List[str]:
+    return [msg["content"] for msg in conversation_history if msg["role"] == "user"]
+
 
-# Test 
\ No newline at end of file
+def build_ielts_evaluation_prompt(histories: List[List[dict]]) -> str:
+    """Tek sınav için klasik prompt; birden fazla sınav tek çağrıda değerlendirilir (JSON dizisi döner)"""
+    # Yerel analiz (önbellekli) her sınavın altına kısa ipucu satırı olarak eklenir
+    rendered = [
+        render_history(h, assistant_label="Examiner", user_label="Candidate", budget=EVALUATION_TOKEN_BUDGET)
+        + "\n\n" + prompt_hints(transcript_features(candidate_responses_of(h)))
+        for h in histories
+    ]
+    if len(rendered) == 1:
+        return f"""You are an experienced IELTS Speaking examiner. Evaluate the following IELTS Speaking test conversation.
+
+CONVERSATION:
+{rendered[0]}
+
+{IELTS_CRITERIA}
+
+Provide your assessment in the following JSON format ONLY (no other text):
+{IELTS_RESULT_FORMAT}"""
+
+    tests = "\n\n".join(f"=== TEST {i} ===\n{text}" for i, text in enumerate(rendered, 1))
+    return f"""You are an experienced IELTS Speaking examiner. Evaluate each of the following {len(rendered)} IELTS Speaking test conversations on its own; they are different candidates.
+
+{tests}
+
+{IELTS_CRITERIA}
+
+Provide your assessments as a JSON array ONLY (no other text), with exactly {len(rendered)} objects in test order, each in this format:
+{IELTS_RESULT_FORMAT}"""
+
+
+def _scores_from(data) -> Optional[dict]:
+    if not isinstance(data, dict):
+        return None
+    try:
+        return IeltsScores(
+            band_score=float(data.get("band_score", 5.0)),
+            feedback=data.get("feedback", "Evaluation completed."),
+            fluency_score=data.get("fluency_score"),
+            vocabulary_score=data.get("vocabulary_score"),
+            grammar_score=data.get("grammar_score"),
+            coherence_score=data.get("coherence_score"),
+        ).model_dump()
+    except (TypeError, ValueError):
+        return None
+
+
+async def grade_ielts_transcripts(histories: List[List[dict]]) -> List[Optional[dict]]:
+    """Sınavları tek model çağrısıyla puanlar; kullanılamayan sonuçlar None döner"""
+    schema = IELTS_RESULT_SCHEMA if len(histories) == 1 else {"type": "array", "items": IELTS_RESULT_SCHEMA}
+    result_text = await llm.generate_text(
+        build_ielts_evaluation_prompt(histories), endpoint="ielts_evaluate", json_schema=schema
+    )
+    extracted = extract_json(result_text, kind="ielts_evaluation")
+    if extracted is None:
+        return [None] * len(histories)
+    results = extracted.value
+    if isinstance(results, dict):
+        results = [results]
+    if not isinstance(results, list):
+        return [None] * len(histories)
+    required = IELTS_RESULT_SCHEMA["required"]
+    if extracted.outcome == TRUNCATED and results and not (isinstance(results[-1], dict) and all(k in results[-1] for k in required)):
+        # Son nesne yarım kalmış: eksik puanları varsayılanla doldurmak yerine o sınav tek başına tekrar denenir
+        results = results[:-1]
+    if len(results) > len(histories):
+        return [None] * len(histories)
+    results += [None] * (len(histories) - len(results))
+    return [_scores_from(r) for r in results]
+
+
+def provisional_ielts_score(candidate_responses: List[str]) -> dict:
+    """Modelsiz, anında verilen tahmini puan (yerel metin analizine göre)"""
+    features = transcript_features(candidate_responses)
+    if features is None:
+        return IeltsScores(band_score=0.0, feedback="No candidate responses to evaluate.").model_dump()
+    return IeltsScores(**provisional_bands(features)).model_dump()
+
+
+# Değerlendirmeler arka planda, gruplanarak ve aynı transkript tekrar puanlanmadan yapılır
+evaluation_jobs = jobs_from_env(grade_ielts_transcripts)
+
+
+async def submit_evaluation(conversation_history: List[dict]) -> dict:
+    candidate_responses = candidate_responses_of(conversation_history)
+    return await evaluation_jobs.submit(
+        conversation_history, provisional_ielts_score(candidate_responses), final=not candidate_responses
+    )
+
+
+@app.post("/ielts/evaluate", response_model=IeltsEvaluationResponse, dependencies=[Depends(admit)])
+async def evaluate_ielts_speaking(request: IeltsEvaluationRequest):
+    """IELTS Speaking sınavını değerlendir ve band score hesapla"""
+    job = await submit_evaluation(request.conversation_history)
+    # Model doluyken/erişilemezken beklemeden yerel analizden gelen tahmini puanı ver
+    wait = 0.0 if llm.saturated("ielts_evaluate") else EVAL_SYNC_WAIT
+    job = await evaluation_jobs.wait(job["job_id"], wait) or job
+    if job["status"] == "done":
+        return IeltsEvaluationResponse(**job["result"], job_id=job["job_id"])
+    # Model sonuç veremedi (hata veya süre aşımı): tahmini puan, job arka planda sürüyorsa sonra alınabilir
+    return IeltsEvaluationResponse(**job["provisional"], provisional=True, job_id=job["job_id"])
+
+
+@app.post("/ielts/evaluations", response_model=IeltsEvaluationJobs, status_code=202, dependencies=[Depends(admit)])
+async def submit_ielts_evaluations(request: IeltsEvaluationBatchRequest):
+    """Bir veya daha fazla sınavı değerlendirme kuyruğuna ekler; anında tahmini puan ve job id döner"""
+    if not 1 <= len(request.transcripts) <= MAX_EVALUATION_BATCH:
+        raise HTTPException(status_code=400, detail=f"Send between 1 and {MAX_EVALUATION_BATCH} transcripts")
+    return IeltsEvaluationJobs(jobs=[await submit_evaluation(t.conversation_history) for t in request.transcripts])
+
+
+@app.get("/ielts/evaluations/{job_id}", response_model=IeltsEvaluationJob)
+async def get_ielts_evaluation(job_id: str, wait: float = 0.0):
+    """Değerlendirme durumunu döndürür; ?wait= ile en fazla 30 sn sonucu bekler"""
+    job = await evaluation_jobs.wait(job_id, min(max(wait, 0.0), 30.0))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Evaluation job not found or expired")
+    return job
+
+
+@app.get("/ielts/evaluations/{job_id}/stream")
+async def stream_ielts_evaluation(job_id: str):
+    """SSE: önce tahmini puan (provisional), değerlendirme bitince sonuç (result) olayı"""
+    job = await evaluation_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Evaluation job not found or expired")
+
+    async def events() -> AsyncIterator[str]:
+        current = job
+        yield sse_event("provisional", {"job_id": job_id, "status": current["status"], **current["provisional"]})
+        while current is not None and current["status"] not in ("done", "failed"):
+            current = await evaluation_jobs.wait(job_id, 15.0)
+            if current is not None and current["status"] not in ("done", "failed"):
+                yield ": keepalive\n\n"  # proxy'ler bağlantıyı kapatmasın
+        if current is None:
+            yield sse_event("failed", {"job_id": job_id, "status": "expired"})
+        elif current["status"] == "done":
+            yield sse_event("result", {"job_id": job_id, "status": "done", **current["result"]})
+        else:
+            yield sse_event("failed", {"job_id": job_id, "status": "failed"})
+
+    return sse_response(events())
+
+# Test 
+
+
+# User Progress & Leaderboard
+# SQLite (WAL) deposu; users_db.json varsa ilk açılışta içe aktarılır
+progress_store = progress_from_env()
+
+
+def _progress_response(user_id: str, progress: Optional[dict]) -> UserProgress:
+    if progress is None:
+        # Henüz kaydı olmayan kullanıcı için boş ilerleme
+        return UserProgress(
+            user_id=user_id, total_conversations=0, total_time_minutes=0,
+            current_level="beginner", completed_scenarios=[],
+        )
+    return UserProgress(**progress)
+
+
+# SQLite çağrıları kısa ama bloklayıcı; bu yüzden endpoint'ler thread pool'da çalışan def fonksiyonlar
+@app.get("/user/progress/{user_id}", response_model=UserProgress)
+def get_user_progress(user_id: str):
+    """Kullanıcının ilerlemesini ve haftalık sıralamasını döndürür"""
+    return _progress_response(user_id, progress_store.get(user_id))
+
+
+@app.post("/user/progress/{user_id}", response_model=UserProgress)
+def update_user_progress(user_id: str, update: ProgressUpdate):
+    """İlerlemeyi günceller; added_xp atomik olarak eklenir"""
+    progress = progress_store.update(
+        user_id,
+        added_xp=update.added_xp or 0,
+        total_conversations=update.total_conversations,
+        total_time_minutes=update.total_time_minutes,
+        completed_scenario=update.completed_scenario,
+        display_name=update.display_name,
+        avatar_url=update.avatar_url,
+    )
+    return _progress_response(user_id, progress)
+
+
+@app.get("/leaderboard", response_model=List[LeaderboardEntry])
+def get_leaderboard(limit: int = 50):
+    """Haftalık XP sıralaması (weekly_xp indeksinden okunur)"""
+    entries = progress_store.leaderboard(min(max(limit, 1), 200))
+    return [LeaderboardEntry(**{**e, "display_name": e["display_name"] or "Anonymous"}) for e in entries]
+
+
+# Conversation Sessions
+session_store = store_from_env()
+
+
+@REGISTRY.collector
+def component_metrics():
+    """Kendi sayaçlarını tutan bileşenleri /metrics'e aktarır"""
+    cache = response_cache.stats()
+    yield "response_cache_lookups_total", "counter", "Reply cache lookups by result", [
+        ({"result": "exact_hit"}, cache["exact_hits"]),
+        ({"result": "normalized_hit"}, cache["normalized_hits"]),
+        ({"result": "miss"}, cache["misses"]),
+        ({"result": "skipped"}, cache["skipped"]),
+    ]
+    yield "response_cache_entries", "gauge", "Entries in the in-memory reply cache", [({}, cache["size"])]
+    sessions = session_store.stats()
+    yield "sessions_active", "gauge", "Sessions held in memory", [({}, sessions["size"])]
+    yield "sessions_evicted_total", "counter", "Sessions evicted from memory", [({}, sessions["evictions"])]
+    yield "feedback_turns_pending", "gauge", "Split-mode feedback analyses still running", [({}, feedback_turns.pending)]
+    yield "llm_in_flight", "gauge", "Model calls currently holding a concurrency slot", [({}, llm.limiter.in_flight)]
+    queue = llm.limiter.stats()["queue"]
+    yield "llm_queue_depth", "gauge", "Requests waiting in the fair queue by lane", [
+        ({"lane": lane}, depth) for lane, depth in queue["depth"].items()
+    ]
+    yield "uploads_hot_cache_bytes", "gauge", "Bytes of upload files held in memory", [
+        ({}, uploads.hot_cache.size)
+    ]
+    jobs = evaluation_jobs.stats()
+    yield "ielts_evaluation_jobs_queued", "gauge", "IELTS evaluations waiting for a grading worker", [({}, jobs["queued"])]
+    yield "ielts_evaluation_jobs_total", "counter", "IELTS evaluation submissions by outcome", [
+        ({"outcome": "deduplicated"}, jobs["deduplicated"]),
+        ({"outcome": "completed"}, jobs["completed"]),
+        ({"outcome": "failed"}, jobs["failed"]),
+    ]
+    yield "ielts_evaluation_batches_total", "counter", "Model calls made by the grading workers", [({}, jobs["batches"])]
+    yield "rate_limited_total", "counter", "Requests rejected by the per-client rate limit", [({}, rate_limiter.limited)]
+    yield "rate_limit_unchecked_total", "counter", "Requests let through because the shared rate-limit state was busy", [({}, rate_limiter.unchecked)]
+    yield "startup_phase_seconds", "gauge", "Seconds spent in each startup phase", [
+        ({"phase": phase}, seconds) for phase, seconds in startup.timer.phases.items()
+    ]
+
+    resilience = llm.resilience.stats()
+    yield "llm_retries_total", "counter", "Model call retries", [({}, resilience["retries"])]
+    yield "llm_hedges_total", "counter", "Hedged second requests sent", [({}, resilience["hedges"])]
+    yield "llm_hedges_skipped_total", "counter", "Hedges not sent because no concurrency slot was free", [({}, resilience["hedges_skipped"])]
+    yield "llm_not_retried_total", "counter", "Failed model calls not retried because the error was not transient", [({}, resilience["not_retried"])]
+    yield "llm_retry_budget_tokens", "gauge", "Retries currently available in the retry budget", [
+        ({}, resilience["retry_budget_tokens"])
+    ]
+    breakers = resilience["breakers"].items()
+    yield "llm_circuit_open", "gauge", "1 while the model's circuit breaker is open or half-open", [
+        ({"model": model}, 0 if b["state"] == "closed" else 1) for model, b in breakers
+    ]
+    yield "llm_short_circuited_total", "counter", "Calls rejected by an open circuit breaker", [
+        ({"model": model}, b["short_circuited"]) for model, b in breakers
+    ]
+
+
+class SessionCreateRequest(BaseModel):
+    scenario: Optional[str] = None
+    ielts_part: Optional[int] = None  # scenario yerine IELTS part (1, 2, 3)
+    topic_card: Optional[str] = None
+    user_level: str = "beginner"
+
+
+class SessionInfo(BaseModel):
+    session_id: str
+    kind: str
+    scenario: Optional[str] = None
+    ielts_part: Optional[int] = None
+    user_level: str
+    expires_in: int
+    conversation_history: List[dict] = []
+
+
+class SessionMessageRequest(BaseModel):
+    user_message: str
+
+
+def _session_info(session: dict) -> SessionInfo:
+    return SessionInfo(
+        session_id=session["session_id"],
+        kind=session["kind"],
+        scenario=session["scenario"],
+        ielts_part=session["ielts_part"],
+        user_level=session["user_level"],
+        expires_in=int(session_store.ttl),
+        conversation_history=session["history"],
+    )
+
+
+async def _get_session_or_404(session_id: str) -> dict:
+    session = await session_store.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found or expired")
+    return session
+
+
+def _session_turn(session: dict, user_message: str) -> Tuple[str, str, Callable[[Exception], str], Optional[Tuple[str, str]]]:
+    """Oturumun türüne göre (prompt, endpoint, fallback, cache_keys) hazırlar"""
+    history = session["history"]
+    if session["kind"] == "ielts":
+        part = session["ielts_part"]
+        prompt = build_ielts_prompt(session["prompt_prefix"], history, user_message)
+        cache_keys = response_cache.keys_for(
+            ("ielts", part, session["topic_card"]), history, user_message, session["prompt_prefix"]
+        )
+        return prompt, "ielts_conversation", ielts_fallback_message(part), cache_keys
+    prompt = build_conversation_prompt(session["prompt_prefix"], history, user_message)
+    cache_keys = response_cache.keys_for(
+        ("scenario", session["scenario"], session["user_level"]), history, user_message, session["prompt_prefix"]
+    )
+    return prompt, "conversation", conversation_fallback(session["scenario"]), cache_keys
+
+
+@app.post("/sessions", response_model=SessionInfo)
+async def create_session(request: SessionCreateRequest):
+    """Senaryo veya IELTS part'ı için sunucu tarafında konuşma oturumu açar"""
+    if request.ielts_part is not None:
+        part = min(max(request.ielts_part, 1), 3)
+        session = await session_store.create(
+            kind="ielts",
+            prompt_prefix=ielts_prompt_prefix(part, request.topic_card),
+            ielts_part=part,
+            topic_card=request.topic_card,
+            user_level=request.user_level,
+        )
+    elif request.scenario:
+        scenario = get_scenario_by_id(request.scenario)
+        if not scenario:
+            raise HTTPException(status_code=404, detail="Scenario not found")
+        session = await session_store.create(
+            kind="scenario",
+            prompt_prefix=conversation_prompt_prefix(scenario, request.user_level),
+            scenario=request.scenario,
+            user_level=request.user_level,
+        )
+    else:
+        raise HTTPException(status_code=400, detail="Either scenario or ielts_part is required")
+    return _session_info(session)
+
+
+@app.get("/sessions/{session_id}", response_model=SessionInfo)
+async def get_session(session_id: str):
+    """Oturum bilgisini ve konuşma geçmişini döndürür"""
+    return _session_info(await _get_session_or_404(session_id))
+
+
+@app.delete("/sessions/{session_id}")
+async def delete_session(session_id: str):
+    """Oturumu sonlandırır"""
+    if not await session_store.delete(session_id):
+        raise HTTPException(status_code=404, detail="Session not found or expired")
+    return {"deleted": True}
+
+
+@app.post("/sessions/{session_id}/messages", response_model=ConversationResponse, dependencies=[Depends(admit)])
+async def post_session_message(session_id: str, request: SessionMessageRequest):
+    """Sadece yeni kullanıcı mesajını alır; geçmiş sunucuda tutulur"""
+    session = await _get_session_or_404(session_id)
+    prompt, endpoint, fallback_text, cache_keys = _session_turn(session, request.user_message)
+    response = await generate_reply(prompt, endpoint=endpoint, fallback_text=fallback_text, cache_keys=cache_keys)
+    await session_store.append_turn(session_id, request.user_message, response.ai_message)
+    return response
+
+
+@app.post("/sessions/{session_id}/messages/stream", dependencies=[Depends(admit)])
+async def post_session_message_stream(session_id: str, request: SessionMessageRequest):
+    """Oturum mesajının SSE ile token token yanıt veren sürümü"""
+    session = await _get_session_or_404(session_id)
+    prompt, endpoint, fallback_text, cache_keys = _session_turn(session, request.user_message)
+    return await stream_reply(
+        prompt,
+        endpoint=endpoint,
+        fallback_text=fallback_text,
+        cache_keys=cache_keys,
+        on_complete=lambda response: session_store.append_turn(session_id, request.user_message, response.ai_message),
+    )
+
+
+async def _channel_turn(session_id: str, user_message: str, client: Client, outbox: Outbox) -> None:
+    """WebSocket üzerinden tek tur: olaylar SSE ile aynı (token, feedback, done)"""
+    session = await session_store.get(session_id)
+    if session is None:
+        outbox.put({"type": "error", "detail": "Session not found or expired"})
+        return
+    set_client(client)
+    try:
+        await rate_limiter.take(client)
+        prompt, endpoint, fallback_text, cache_keys = _session_turn(session, user_message)
+        events = await reply_events(
+            prompt,
+            endpoint=endpoint,
+            fallback_text=fallback_text,
+            cache_keys=cache_keys,
+            on_complete=lambda response: session_store.append_turn(session_id, user_message, response.ai_message),
+        )
+    except (RateLimitedError, LLMBusyError) as e:
+        # HTTP'deki 429/503 karşılığı: istemci retry_after saniye sonra tekrar dener
+        outbox.put({"type": "busy", "retry_after": max(1, math.ceil(getattr(e, "retry_after", None) or 1))})
+        return
+    async for event, data in events:
+        outbox.put({"type": event, **data})
+
+
+# Bir tur sürerken sıraya alınabilecek en fazla mesaj
+WS_MAX_PENDING_TURNS = 4
+
+
+async def _channel_turns(session_id: str, client: Client, outbox: Outbox, messages: "asyncio.Queue[str]") -> None:
+    """Sıradaki mesajları tek tek işler; bağlantı kapanınca iptal edilir (süren model çağrısıyla birlikte)"""
+    while True:
+        user_message = await messages.get()
+        try:
+            await _channel_turn(session_id, user_message, client, outbox)
+        except Exception as e:
+            print(f"WebSocket turn error: {type(e).__name__}: {e}")
+            outbox.put({"type": "error", "detail": "The reply could not be generated"})
+
+
+@app.websocket("/sessions/{session_id}/ws")
+async def session_channel(websocket: WebSocket, session_id: str):
+    """Oturum için kalıcı bağlantı: her turda yalnızca yeni mesaj gelir, yanıt token token döner.
+
+    İstemci {"type": "message", "user_message": "..."} veya {"type": "ping"} gönderir (JSON metin çerçeveleri).
+    Turlar ayrı bir görevde sırayla işlenir; bu sırada ping'ler yanıtlanır, bağlantı koparsa süren tur iptal edilir.
+    """
+    await websocket.accept()
+    if await session_store.get(session_id) is None:
+        await websocket.send_json({"type": "error", "detail": "Session not found or expired"})
+        await websocket.close(code=4404)
+        return
+
+    client = connection_client(websocket)
+    outbox = Outbox(websocket)
+    sender = asyncio.create_task(outbox.run())
+    messages: "asyncio.Queue[str]" = asyncio.Queue(maxsize=WS_MAX_PENDING_TURNS)
+    turns = asyncio.create_task(_channel_turns(session_id, client, outbox, messages))
+    CONNECTIONS.inc()
+
+    async def close(code: int, reason: str) -> None:
+        turns.cancel()
+        await outbox.drain()
+        await websocket.close(code=code, reason=reason)
+
+    try:
+        while True:
+            try:
+                frame = await asyncio.wait_for(websocket.receive(), WS_IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                await close(1000, "Idle timeout")
+                return
+            if frame["type"] == "websocket.disconnect":
+                return
+            if frame.get("text") is None:
+                await close(1003, "Only JSON text frames are accepted")  # 1003: desteklenmeyen veri
+                return
+            try:
+                message = json.loads(frame["text"])
+            except ValueError:
+                message = None
+            kind = message.get("type") if isinstance(message, dict) else None
+            if kind == "ping":
+                outbox.put({"type": "pong"})
+            elif kind == "message" and str(message.get("user_message") or "").strip():
+                try:
+                    messages.put_nowait(str(message["user_message"]))
+                except asyncio.QueueFull:
+                    outbox.put({"type": "error", "detail": "Too many messages waiting for a reply"})
+            elif kind != "pong":
+                outbox.put({"type": "error", "detail": 'Expected {"type": "message", "user_message": "..."}'})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        CONNECTIONS.dec()
+        turns.cancel()
+        sender.cancel()
+
+
+startup.timer.mark("init")
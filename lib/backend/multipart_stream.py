@@ -0,0 +1,113 @@
+"""Size-capped streaming of one file field out of a multipart/form-data body.
+
+FastAPI's ``UploadFile`` parameters are filled before the handler runs:
+Starlette reads the whole body and spools it to disk first, so a size cap
+checked in the handler only refuses an upload that has already been
+received and written. Upload handlers take the raw ``request.stream()``
+instead and read it through ``FileField``:
+
+* the body is parsed with python-multipart as it arrives, and the file
+  field's data is handed over chunk by chunk;
+* the upload is aborted as soon as the body passes its cap, and
+  ``check_length`` refuses a declared Content-Length that is already over it
+  before anything is read.
+"""
+from typing import AsyncIterator, List, Optional
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ModuleNotFoundError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+# Multipart boundaries and part headers around the file data
+ENVELOPE_BYTES = 16 * 1024
+
+
+class MultipartError(Exception):
+    """Not a usable multipart upload; ``too_large`` when the body went over its cap."""
+
+    def __init__(self, detail: str, too_large: bool = False):
+        super().__init__(detail)
+        self.detail = detail
+        self.too_large = too_large
+
+
+def check_length(content_length: Optional[str], max_body: int) -> None:
+    """Refuse a request whose declared body is already over ``max_body``."""
+    try:
+        declared = int(content_length or 0)
+    except ValueError:
+        return
+    if declared > max_body:
+        raise MultipartError("Request body too large", too_large=True)
+
+
+class FileField:
+    """Data of the first field called ``name`` in a multipart body, read as it streams in."""
+
+    def __init__(self, content_type: Optional[str], name: bytes, max_body: int):
+        media_type, options = parse_options_header(content_type)
+        if media_type != b"multipart/form-data" or not options.get(b"boundary"):
+            raise MultipartError("Expected a multipart/form-data upload")
+        self.name = name
+        self.max_body = max_body
+        self.found = False  # the field was present (it may still be empty)
+        self._parser = MultipartParser(options[b"boundary"], self._callbacks())
+        self._data: List[bytes] = []
+        self._in_field = False
+        self._header = b""
+        self._value = b""
+        self._disposition = b""
+
+    async def chunks(self, body: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        """The field's data, one piece per body chunk that carried some."""
+        received = 0
+        async for chunk in body:
+            received += len(chunk)
+            if received > self.max_body:
+                raise MultipartError("Request body too large", too_large=True)  # e.g. chunked, no Content-Length
+            try:
+                self._parser.write(chunk)
+            except ValueError:
+                raise MultipartError("Malformed multipart body") from None
+            if self._data:
+                data = b"".join(self._data)
+                self._data.clear()
+                yield data
+
+    def _callbacks(self) -> dict:
+        return {
+            "on_part_begin": self._part_begin,
+            "on_header_field": self._header_field,
+            "on_header_value": self._header_value,
+            "on_header_end": self._header_end,
+            "on_headers_finished": self._headers_finished,
+            "on_part_data": self._part_data,
+            "on_part_end": self._part_end,
+        }
+
+    def _part_begin(self) -> None:
+        self._disposition = b""
+
+    def _header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header += data[start:end]
+
+    def _header_value(self, data: bytes, start: int, end: int) -> None:
+        self._value += data[start:end]
+
+    def _header_end(self) -> None:
+        if self._header.lower() == b"content-disposition":
+            self._disposition = self._value
+        self._header = self._value = b""
+
+    def _headers_finished(self) -> None:
+        _, options = parse_options_header(self._disposition)
+        self._in_field = not self.found and options.get(b"name") == self.name
+        self.found = self.found or self._in_field
+
+    def _part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._in_field:
+            self._data.append(data[start:end])
+
+    def _part_end(self) -> None:
+        self._in_field = False
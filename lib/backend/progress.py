@@ -0,0 +1,246 @@
+"""User progress and weekly leaderboard on an embedded SQLite (WAL) store.
+
+Replaces the whole-file rewrite of ``users_db.json``:
+
+* XP is added with a single ``UPDATE ... SET weekly_xp = weekly_xp + ?``
+  upsert, so concurrent writers (other requests, other worker processes)
+  never lose an increment.
+* ``users_weekly_xp`` indexes users by (weekly_xp DESC, user_id). The top-N
+  leaderboard is an index walk with LIMIT, and a user's rank is a count of
+  the index entries ahead of them; neither touches the table rows or sorts.
+  SQLite keeps no per-subtree counts, so that count is O(rank), not
+  O(log n): cheap near the top, a scan of most of the index for the tail.
+* The weekly reset is one bulk UPDATE, run lazily by whichever call first
+  notices that the ISO week changed. The current week is stored in the
+  database, so several processes agree on when the reset happened.
+* An existing ``users_db.json`` is imported once, into an empty database.
+
+Configuration (environment variables):
+    PROGRESS_DB_PATH     SQLite file (default "progress.sqlite3")
+    LEGACY_USERS_DB      JSON file imported on first start (default "users_db.json")
+"""
+import json
+import os
+import sqlite3
+import threading
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    display_name TEXT,
+    avatar_url TEXT,
+    total_conversations INTEGER NOT NULL DEFAULT 0,
+    total_time_minutes INTEGER NOT NULL DEFAULT 0,
+    current_level TEXT NOT NULL DEFAULT 'beginner',
+    weekly_xp INTEGER NOT NULL DEFAULT 0,
+    last_active TEXT
+);
+CREATE INDEX IF NOT EXISTS users_weekly_xp ON users (weekly_xp DESC, user_id);
+CREATE TABLE IF NOT EXISTS completed_scenarios (
+    user_id TEXT NOT NULL,
+    scenario_id TEXT NOT NULL,
+    PRIMARY KEY (user_id, scenario_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+
+def current_week(today: Optional[date] = None) -> str:
+    year, week, _ = (today or date.today()).isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def _legacy_weekly_xp(data: Dict[str, Any]) -> int:
+    """Weekly XP of an imported user; XP earned in an earlier week no longer counts."""
+    try:
+        active_week = current_week(datetime.fromisoformat(data["last_active"]).date())
+    except (KeyError, TypeError, ValueError):
+        return 0
+    return int(data.get("weekly_xp", 0)) if active_week == current_week() else 0
+
+
+class ProgressStore:
+    def __init__(self, path: str, legacy_json: Optional[str] = None):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid = 0
+        self._week: Optional[str] = None
+        if legacy_json and os.path.exists(legacy_json):
+            self._import_legacy(legacy_json)
+        self.roll_week()
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        # Opened per process: the store is created before gunicorn forks its workers
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            conn.executescript(_SCHEMA)
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    # -- maintenance -------------------------------------------------------------
+
+    def _import_legacy(self, legacy_json: str) -> None:
+        with self._lock:
+            if self._db.execute("SELECT 1 FROM users LIMIT 1").fetchone() is not None:
+                return
+            try:
+                with open(legacy_json, encoding="utf-8") as f:
+                    users = json.load(f).get("users", {})
+            except (OSError, ValueError) as e:
+                print(f"⚠️  Could not import {legacy_json}: {e}")
+                return
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                for user_id, data in users.items():
+                    self._db.execute(
+                        "INSERT OR IGNORE INTO users (user_id, display_name, avatar_url, total_conversations,"
+                        " total_time_minutes, current_level, weekly_xp, last_active) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (
+                            user_id,
+                            data.get("display_name"),
+                            data.get("avatar_url"),
+                            int(data.get("total_conversations", 0)),
+                            int(data.get("total_time_minutes", 0)),
+                            data.get("current_level", "beginner"),
+                            _legacy_weekly_xp(data),
+                            data.get("last_active"),
+                        ),
+                    )
+                    self._db.executemany(
+                        "INSERT OR IGNORE INTO completed_scenarios (user_id, scenario_id) VALUES (?, ?)",
+                        [(user_id, s) for s in data.get("completed_scenarios", [])],
+                    )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            print(f"📥 Imported {len(users)} users from {legacy_json}")
+
+    def roll_week(self, week: Optional[str] = None) -> bool:
+        """Zero everyone's weekly XP in one statement if the ISO week changed. Returns True on reset."""
+        week = week or current_week()
+        if week == self._week:
+            return False
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute("SELECT value FROM meta WHERE key = 'week'").fetchone()
+                reset = row is not None and row["value"] != week
+                if reset:
+                    # The index on weekly_xp limits this to users who earned XP
+                    self._db.execute("UPDATE users SET weekly_xp = 0 WHERE weekly_xp > 0")
+                self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('week', ?)", (week,))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            self._week = week
+        if reset:
+            print(f"🗓️  Weekly XP reset for {week}")
+        return reset
+
+    # -- reads -------------------------------------------------------------------
+
+    def _rank_of(self, weekly_xp: int, user_id: str) -> int:
+        """1-based leaderboard position: XP descending, ties by user_id.
+
+        Counts the users ahead with two covering-index searches (SQLite's
+        MULTI-INDEX OR plan: ``weekly_xp > ?`` and ``weekly_xp = ? AND
+        user_id < ?``), so the cost grows with the rank, not with log n.
+        """
+        row = self._db.execute(
+            "SELECT COUNT(*) FROM users WHERE weekly_xp > ? OR (weekly_xp = ? AND user_id < ?)",
+            (weekly_xp, weekly_xp, user_id),
+        ).fetchone()
+        return row[0] + 1
+
+    def get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        self.roll_week()
+        with self._lock:
+            row = self._db.execute("SELECT * FROM users WHERE user_id = ?", (user_id,)).fetchone()
+            if row is None:
+                return None
+            completed = [
+                r[0] for r in self._db.execute(
+                    "SELECT scenario_id FROM completed_scenarios WHERE user_id = ? ORDER BY scenario_id", (user_id,)
+                )
+            ]
+            progress = dict(row)
+            progress["completed_scenarios"] = completed
+            progress["rank"] = self._rank_of(row["weekly_xp"], user_id)
+        return progress
+
+    def leaderboard(self, limit: int = 50) -> List[Dict[str, Any]]:
+        self.roll_week()
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT user_id, display_name, avatar_url, weekly_xp FROM users"
+                " ORDER BY weekly_xp DESC, user_id LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [{"rank": i + 1, **dict(row)} for i, row in enumerate(rows)]
+
+    # -- writes ------------------------------------------------------------------
+
+    def update(
+        self,
+        user_id: str,
+        added_xp: int = 0,
+        total_conversations: Optional[int] = None,
+        total_time_minutes: Optional[int] = None,
+        completed_scenario: Optional[str] = None,
+        display_name: Optional[str] = None,
+        avatar_url: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """Apply one progress update atomically; XP is an increment, the other fields are set if given."""
+        self.roll_week()
+        now = datetime.now().isoformat()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute(
+                    "INSERT INTO users (user_id, display_name, avatar_url, total_conversations, total_time_minutes,"
+                    " weekly_xp, last_active) VALUES (?, ?, ?, COALESCE(?, 0), COALESCE(?, 0), ?, ?)"
+                    " ON CONFLICT (user_id) DO UPDATE SET"
+                    " weekly_xp = weekly_xp + excluded.weekly_xp,"
+                    " display_name = COALESCE(?, display_name),"
+                    " avatar_url = COALESCE(?, avatar_url),"
+                    " total_conversations = COALESCE(?, total_conversations),"
+                    " total_time_minutes = COALESCE(?, total_time_minutes),"
+                    " last_active = excluded.last_active",
+                    (
+                        user_id, display_name, avatar_url, total_conversations, total_time_minutes,
+                        max(0, added_xp), now,
+                        display_name, avatar_url, total_conversations, total_time_minutes,
+                    ),
+                )
+                if completed_scenario:
+                    self._db.execute(
+                        "INSERT OR IGNORE INTO completed_scenarios (user_id, scenario_id) VALUES (?, ?)",
+                        (user_id, completed_scenario),
+                    )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return self.get(user_id)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            users = self._db.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+        return {"users": users, "week": self._week}
+
+
+def progress_from_env() -> ProgressStore:
+    return ProgressStore(
+        os.environ.get("PROGRESS_DB_PATH", "progress.sqlite3"),
+        legacy_json=os.environ.get("LEGACY_USERS_DB", "users_db.json"),
+    )
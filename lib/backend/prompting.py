@@ -0,0 +1,147 @@
+"""Token-budgeted history rendering with a rolling summary of older turns.
+
+Prompts used to include exactly the last 10 messages, however long they
+were. ``render_history`` instead walks the history from the newest message
+backwards until a token budget is spent, and folds everything older into a
+compact running summary. Summaries are cached by a digest of the folded
+prefix, and a new fold only summarises the messages added since the nearest
+cached prefix, so long sessions do not re-summarise their whole past each turn.
+
+Token counts are approximate (about four characters per token for English),
+which is close enough to keep prompt size and cost bounded.
+
+Configuration (environment variables):
+    PROMPT_HISTORY_TOKENS        budget for verbatim conversation turns (default 1500)
+    PROMPT_SUMMARY_TOKENS        budget for the summary of older turns (default 300)
+    EVALUATION_TRANSCRIPT_TOKENS budget for the /ielts/evaluate transcript (default 6000)
+"""
+import hashlib
+import os
+import re
+from typing import List, Optional, Tuple
+
+from cache import TTLCache
+
+HISTORY_TOKEN_BUDGET = int(os.environ.get("PROMPT_HISTORY_TOKENS", 1500))
+SUMMARY_TOKEN_BUDGET = int(os.environ.get("PROMPT_SUMMARY_TOKENS", 300))
+EVALUATION_TOKEN_BUDGET = int(os.environ.get("EVALUATION_TRANSCRIPT_TOKENS", 6000))
+
+# How far back from the current fold point to look for a reusable summary.
+_SUMMARY_LOOKBACK = 16
+_SUMMARY_WORDS_PER_TURN = 20
+
+_sentence_end = re.compile(r"(?<=[.!?])\s")
+summary_cache = TTLCache(maxsize=2048, ttl=3600, name="history_summaries")
+
+
+def count_tokens(text: str) -> int:
+    """Approximate token count (~4 characters per token, at least 1 for non-empty text)."""
+    if not text:
+        return 0
+    return max(1, (len(text) + 3) // 4)
+
+
+def _role_label(msg: dict, assistant_label: str, user_label: str) -> str:
+    return assistant_label if msg.get("role") == "assistant" else user_label
+
+
+def _condense(content: str) -> str:
+    """First sentence of a turn, capped at a few words."""
+    first = _sentence_end.split(content.strip(), maxsplit=1)[0]
+    words = first.split()
+    if len(words) > _SUMMARY_WORDS_PER_TURN:
+        return " ".join(words[:_SUMMARY_WORDS_PER_TURN]) + "…"
+    return " ".join(words)
+
+
+def _trim_summary(lines: List[str], budget: int) -> List[str]:
+    """Drop the oldest summary lines until the summary fits ``budget`` tokens."""
+    total = sum(count_tokens(line) + 1 for line in lines)
+    start = 0
+    while total > budget and start < len(lines) - 1:
+        total -= count_tokens(lines[start]) + 1
+        start += 1
+    return lines[start:]
+
+
+def _prefix_digests(history: List[dict], upto: int) -> List[str]:
+    """digests[i] identifies history[:i]."""
+    running = hashlib.sha1()
+    digests = [running.hexdigest()]
+    for msg in history[:upto]:
+        running.update(f"{msg.get('role')}\x1f{msg.get('content', '')}\x1e".encode("utf-8"))
+        digests.append(running.hexdigest())
+    return digests
+
+
+def summarize_prefix(
+    history: List[dict],
+    fold_count: int,
+    assistant_label: str,
+    user_label: str,
+    budget: int = SUMMARY_TOKEN_BUDGET,
+) -> str:
+    """Summary of ``history[:fold_count]``, extended incrementally from a cached shorter prefix."""
+    digests = _prefix_digests(history, fold_count)
+    key = (digests[fold_count], assistant_label, user_label, budget)
+    cached = summary_cache.get(key)
+    if cached is not None:
+        return cached
+
+    start, lines = 0, []
+    for i in range(fold_count - 1, max(0, fold_count - _SUMMARY_LOOKBACK) - 1, -1):
+        previous = summary_cache.get((digests[i], assistant_label, user_label, budget))
+        if previous is not None:
+            start, lines = i, previous.split("\n")
+            break
+
+    for msg in history[start:fold_count]:
+        condensed = _condense(str(msg.get("content", "")))
+        if condensed:
+            lines.append(f"- {_role_label(msg, assistant_label, user_label)}: {condensed}")
+
+    summary = "\n".join(_trim_summary(lines, budget))
+    summary_cache.set(key, summary)
+    return summary
+
+
+def select_recent(history: List[dict], budget: int, assistant_label: str, user_label: str) -> Tuple[int, List[str]]:
+    """Pick turns from the newest backwards until ``budget`` tokens are used.
+
+    Returns the number of older messages left over and the rendered lines
+    (oldest first). The newest message is always kept.
+    """
+    lines: List[str] = []
+    used = 0
+    index = len(history)
+    while index > 0:
+        msg = history[index - 1]
+        line = f"{_role_label(msg, assistant_label, user_label)}: {msg.get('content', '')}"
+        cost = count_tokens(line) + 1
+        if lines and used + cost > budget:
+            break
+        lines.append(line)
+        used += cost
+        index -= 1
+    lines.reverse()
+    return index, lines
+
+
+def render_history(
+    history: List[dict],
+    assistant_label: str = "Assistant",
+    user_label: str = "User",
+    budget: Optional[int] = None,
+    summary_budget: Optional[int] = None,
+) -> str:
+    """History text for a prompt: a summary of older turns plus the newest turns verbatim."""
+    budget = HISTORY_TOKEN_BUDGET if budget is None else budget
+    summary_budget = SUMMARY_TOKEN_BUDGET if summary_budget is None else summary_budget
+
+    fold_count, lines = select_recent(history, budget, assistant_label, user_label)
+    text = "".join(f"{line}\n" for line in lines)
+    if fold_count == 0:
+        return text
+
+    summary = summarize_prefix(history, fold_count, assistant_label, user_label, summary_budget)
+    return f"Summary of earlier conversation:\n{summary}\n\n{text}"
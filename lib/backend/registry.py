@@ -0,0 +1,220 @@
+"""Scenario and IELTS prompt registry loaded from ``scenarios/``.
+
+Each conversation scenario is one JSON (or YAML, when PyYAML is installed)
+file in ``scenarios/``; IELTS examiner prompts live in ``scenarios/ielts/``
+as ``part1`` .. ``part3``. Either kind of file may carry an optional
+``fallback_replies`` list: in-character lines served while the model is
+unavailable (see resilience.py). The registry parses them into an immutable
+snapshot with an id index and the static prompt prefixes pre-rendered for
+every scenario x level, so the request path does dictionary lookups instead
+of list scans and f-string/``.format()`` work.
+
+A background watcher polls the directory and swaps in a new snapshot when a
+file changes. A snapshot is only published once every file in it parsed and
+validated, so a half-written or broken file never replaces a good registry.
+
+Configuration (environment variables):
+    SCENARIOS_DIR             directory to load (default: ./scenarios next to this file)
+    SCENARIO_RELOAD_INTERVAL  seconds between change checks, 0 disables (default 5)
+"""
+import asyncio
+import json
+import os
+import random
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import yaml
+except ImportError:  # YAML scenario files are optional
+    yaml = None
+
+LEVELS = ("beginner", "intermediate", "advanced")
+SCENARIO_FIELDS = ("id", "title", "description", "difficulty", "estimated_time", "system_prompt")
+TOPIC_CARD_PLACEHOLDER = "{topic_card}"
+_EXTENSIONS = (".json", ".yaml", ".yml")
+
+# Used when a scenario or IELTS part file has no fallback_replies of its own
+DEFAULT_FALLBACK_REPLIES = [
+    "Sorry, could you say that again in a different way?",
+    "That's interesting! Can you tell me a bit more about it?",
+    "I see. What would you like to talk about next?",
+]
+
+
+def render_conversation_prefix(system_prompt: str, user_level: str) -> str:
+    """Static head of a conversation prompt: the scenario role and the user's level."""
+    return f"""You are playing the following role: {system_prompt}
+
+The user's English level is: {user_level}"""
+
+
+class RegistryError(Exception):
+    pass
+
+
+def _load_file(path: str) -> Dict[str, Any]:
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".json"):
+            data = json.load(f)
+        elif yaml is not None:
+            data = yaml.safe_load(f)
+        else:
+            raise RegistryError(f"{path}: PyYAML is not installed")
+    if not isinstance(data, dict):
+        raise RegistryError(f"{path}: expected a mapping at the top level")
+    return data
+
+
+def _list_files(directory: str) -> List[str]:
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        os.path.join(directory, name)
+        for name in os.listdir(directory)
+        if name.endswith(_EXTENSIONS) and not name.startswith(".")
+    )
+
+
+def _check_fallbacks(path: str, data: Dict[str, Any]) -> None:
+    replies = data.get("fallback_replies")
+    if replies is not None and not (isinstance(replies, list) and all(isinstance(r, str) for r in replies)):
+        raise RegistryError(f"{path}: 'fallback_replies' must be a list of strings")
+
+
+class RegistrySnapshot:
+    """Immutable, fully parsed view of the scenario directory."""
+
+    def __init__(
+        self,
+        scenarios: List[Dict[str, Any]],
+        ielts_prompts: Dict[int, str],
+        ielts_fallbacks: Dict[int, List[str]],
+        signature: Tuple,
+    ):
+        self.signature = signature
+        self.scenario_list = scenarios
+        self.scenarios = {s["id"]: s for s in scenarios}
+        self.infos = [{k: s[k] for k in SCENARIO_FIELDS if k != "system_prompt"} for s in scenarios]
+        self.ielts_prompts = ielts_prompts
+        self.conversation_prefixes = {
+            (s["id"], level): render_conversation_prefix(s["system_prompt"], level)
+            for s in scenarios
+            for level in LEVELS
+        }
+        # Part 2 has a {topic_card} slot: keep the text around it so filling it is a join
+        self.ielts_templates = {
+            part: prompt.split(TOPIC_CARD_PLACEHOLDER) for part, prompt in ielts_prompts.items()
+        }
+        self.fallback_replies = {s["id"]: s.get("fallback_replies") or DEFAULT_FALLBACK_REPLIES for s in scenarios}
+        self.ielts_fallbacks = {part: ielts_fallbacks.get(part) or DEFAULT_FALLBACK_REPLIES for part in ielts_prompts}
+
+
+class ScenarioRegistry:
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.reloads = 0
+        self.reload_errors = 0
+        self._snapshot = self._build()
+
+    # -- loading -----------------------------------------------------------------
+
+    def _signature(self) -> Tuple:
+        files = _list_files(self.directory) + _list_files(os.path.join(self.directory, "ielts"))
+        entries = []
+        for path in files:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((path, stat.st_mtime_ns, stat.st_size))
+        return tuple(entries)
+
+    def _build(self) -> RegistrySnapshot:
+        signature = self._signature()
+        scenarios = []
+        for path in _list_files(self.directory):
+            data = _load_file(path)
+            missing = [k for k in SCENARIO_FIELDS if k not in data]
+            if missing:
+                raise RegistryError(f"{path}: missing fields {missing}")
+            _check_fallbacks(path, data)
+            scenarios.append(data)
+        if not scenarios:
+            raise RegistryError(f"No scenario files found in {self.directory}")
+        ids = [s["id"] for s in scenarios]
+        if len(set(ids)) != len(ids):
+            raise RegistryError(f"Duplicate scenario ids in {self.directory}")
+        scenarios.sort(key=lambda s: (s.get("order", 0), s["id"]))
+
+        ielts_prompts: Dict[int, str] = {}
+        ielts_fallbacks: Dict[int, List[str]] = {}
+        for path in _list_files(os.path.join(self.directory, "ielts")):
+            data = _load_file(path)
+            if "part" not in data or "system_prompt" not in data:
+                raise RegistryError(f"{path}: 'part' and 'system_prompt' are required")
+            _check_fallbacks(path, data)
+            ielts_prompts[int(data["part"])] = data["system_prompt"]
+            ielts_fallbacks[int(data["part"])] = data.get("fallback_replies") or []
+        if 1 not in ielts_prompts:
+            raise RegistryError("IELTS Part 1 prompt is required")
+
+        return RegistrySnapshot(scenarios, ielts_prompts, ielts_fallbacks, signature)
+
+    def reload_if_changed(self) -> bool:
+        """Rebuild and swap the snapshot if any file changed; keep the old one on errors."""
+        if self._signature() == self._snapshot.signature:
+            return False
+        try:
+            snapshot = self._build()
+        except Exception as e:
+            # Anything a bad edit can raise (YAML syntax, a list where a string belongs, ...) must
+            # not escape: it would end the watcher task and hot reload with it until a restart
+            self.reload_errors += 1
+            print(f"⚠️  Scenario reload failed, keeping previous registry: {type(e).__name__}: {e}")
+            return False
+        self._snapshot = snapshot
+        self.reloads += 1
+        print(f"🔄 Scenario registry reloaded ({len(snapshot.scenario_list)} scenarios)")
+        return True
+
+    async def watch(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            self.reload_if_changed()
+
+    # -- lookups -----------------------------------------------------------------
+
+    def get(self, scenario_id: str) -> Optional[Dict[str, Any]]:
+        return self._snapshot.scenarios.get(scenario_id)
+
+    def list_infos(self) -> List[Dict[str, Any]]:
+        return self._snapshot.infos
+
+    def conversation_prefix(self, scenario: Dict[str, Any], user_level: str) -> str:
+        prefix = self._snapshot.conversation_prefixes.get((scenario["id"], user_level))
+        if prefix is None:
+            # Free-form level strings from clients are rendered on demand
+            prefix = render_conversation_prefix(scenario["system_prompt"], user_level)
+        return prefix
+
+    def ielts_prefix(self, part: int, topic_card: Optional[str]) -> str:
+        snapshot = self._snapshot
+        if part not in snapshot.ielts_prompts:
+            part = 1
+        # Only Part 2 takes a topic card; without one the template is sent unchanged
+        if part == 2 and topic_card:
+            return topic_card.join(snapshot.ielts_templates[part])
+        return snapshot.ielts_prompts[part]
+
+    def fallback_reply(self, scenario_id: str) -> str:
+        """A canned in-character line for the scenario, used while the model is unavailable."""
+        return random.choice(self._snapshot.fallback_replies.get(scenario_id) or DEFAULT_FALLBACK_REPLIES)
+
+    def ielts_fallback(self, part: int) -> str:
+        """A canned examiner question for the IELTS part, used while the model is unavailable."""
+        return random.choice(self._snapshot.ielts_fallbacks.get(part) or DEFAULT_FALLBACK_REPLIES)
+
+
+def registry_from_env() -> ScenarioRegistry:
+    default_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scenarios")
+    return ScenarioRegistry(os.environ.get("SCENARIOS_DIR", default_dir))
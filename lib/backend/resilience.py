@@ -0,0 +1,317 @@
+"""Resilience around model calls: circuit breaker, retry budget, deadline, hedging.
+
+``ResilientCaller.call`` wraps one logical completion:
+
+* a per-model ``CircuitBreaker`` fails fast with ``CircuitOpenError`` once the
+  model keeps failing, then lets a single probe through after a cool-down;
+* attempts that failed for a transient reason (``is_transient``: timeouts,
+  connection errors, 5xx / unavailable) are retried with capped exponential
+  backoff and jitter, but only while the global ``RetryBudget`` has tokens
+  (every success earns a fraction of a retry), so a degraded upstream is not
+  hit with extra load. Anything else - a rejected prompt, a bad key, a
+  blocked reply - fails at once, since sending it again gives the same answer;
+* the whole call, retries included, must finish within a per-request deadline;
+* optionally a hedged second request starts once the first has been running
+  longer than the recent p95 latency, and whichever finishes first wins. The
+  hedge needs a concurrency slot of its own (``reserve``); when none is free
+  it is skipped rather than run beyond the configured limit.
+
+Handlers catch the resulting exceptions and serve their canned fallbacks, so
+an open breaker answers immediately instead of waiting out a failing call.
+
+Configuration (environment variables):
+    LLM_DEADLINE                 seconds per logical call, retries included (default 25)
+    LLM_MAX_RETRIES              retries after the first attempt (default 2)
+    LLM_RETRY_BASE_DELAY         first backoff delay in seconds (default 0.2)
+    LLM_RETRY_MAX_DELAY          backoff cap in seconds (default 2)
+    LLM_RETRY_BUDGET_RATIO       retry tokens earned per success (default 0.1)
+    LLM_HEDGE                    "1" enables hedged requests (default off)
+    LLM_HEDGE_MIN_DELAY          lower bound for the hedge delay in seconds (default 0.5)
+    BREAKER_FAILURE_THRESHOLD    consecutive failures that open the breaker (default 5)
+    BREAKER_OPEN_SECONDS         cool-down before a probe is allowed (default 30)
+"""
+import asyncio
+import os
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+# Takes a spare concurrency slot without waiting: its release function, or None when none is free
+Reserve = Callable[[], Awaitable[Optional[Callable[[], None]]]]
+
+# HTTP statuses worth another attempt (google.api_core errors carry them as ``code``)
+_TRANSIENT_STATUSES = {408, 500, 502, 503, 504}
+# gRPC status names for the same conditions
+_TRANSIENT_GRPC = {"UNAVAILABLE", "DEADLINE_EXCEEDED", "INTERNAL"}
+
+
+def is_transient(error: BaseException) -> bool:
+    """True for failures a retry may fix: timeouts, connection errors, 5xx / unavailable."""
+    transient = getattr(error, "transient", None)
+    if isinstance(transient, bool):
+        return transient
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    code = getattr(error, "code", None)
+    if isinstance(code, int):
+        return code in _TRANSIENT_STATUSES
+    grpc_code = getattr(error, "grpc_status_code", None)
+    return getattr(grpc_code, "name", None) in _TRANSIENT_GRPC
+
+
+class CircuitOpenError(Exception):
+    """The model's circuit breaker is open; the call was not attempted."""
+
+    def __init__(self, model: str, retry_in: float):
+        super().__init__(f"Circuit open for model '{model}', retry in {retry_in:.0f}s")
+        self.model = model
+        self.retry_in = retry_in
+
+
+class DeadlineExceeded(Exception):
+    """The call, including retries, ran past its deadline."""
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int = 5, open_seconds: float = 30.0):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.times_opened = 0
+        self.short_circuited = 0
+
+    def before_call(self) -> None:
+        if self.state == CLOSED:
+            return
+        elapsed = time.monotonic() - self.opened_at
+        if self.state == OPEN and elapsed >= self.open_seconds:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN and not self.probe_in_flight:
+            self.probe_in_flight = True
+            return
+        self.short_circuited += 1
+        raise CircuitOpenError(self.name, max(0.0, self.open_seconds - elapsed))
+
+    def is_open(self) -> bool:
+        """True while calls are being short-circuited (open and not yet due for a probe)."""
+        return self.state == OPEN and time.monotonic() - self.opened_at < self.open_seconds
+
+    def record_success(self) -> None:
+        self.consecutive_failures = 0
+        self.probe_in_flight = False
+        self.state = CLOSED
+
+    def record_failure(self) -> None:
+        self.consecutive_failures += 1
+        was_probe = self.probe_in_flight
+        self.probe_in_flight = False
+        if was_probe or self.consecutive_failures >= self.failure_threshold:
+            if self.state != OPEN:
+                self.times_opened += 1
+                print(f"⚠️  Circuit breaker OPEN for model '{self.name}'")
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "times_opened": self.times_opened,
+            "short_circuited": self.short_circuited,
+        }
+
+
+class RetryBudget:
+    """Token bucket shared by all calls: successes deposit ``ratio``, retries withdraw 1."""
+
+    def __init__(self, ratio: float = 0.1, initial: float = 10.0, cap: float = 100.0):
+        self.ratio = ratio
+        self.cap = cap
+        self.tokens = initial
+        self.exhausted = 0
+
+    def deposit(self) -> None:
+        self.tokens = min(self.cap, self.tokens + self.ratio)
+
+    def try_withdraw(self) -> bool:
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        self.exhausted += 1
+        return False
+
+
+class LatencyTracker:
+    """Recent successful call latencies, for the hedge delay."""
+
+    def __init__(self, size: int = 200):
+        self._samples: Deque[float] = deque(maxlen=size)
+
+    def add(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        if len(self._samples) < 20:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+
+class ResilientCaller:
+    def __init__(
+        self,
+        deadline: float = 25.0,
+        max_retries: int = 2,
+        base_delay: float = 0.2,
+        max_delay: float = 2.0,
+        budget_ratio: float = 0.1,
+        hedge: bool = False,
+        hedge_min_delay: float = 0.5,
+        failure_threshold: int = 5,
+        open_seconds: float = 30.0,
+    ):
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.budget = RetryBudget(ratio=budget_ratio)
+        self.latency = LatencyTracker()
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.counters = {"calls": 0, "successes": 0, "failures": 0, "retries": 0, "not_retried": 0, "hedges": 0,
+                         "hedge_wins": 0, "hedges_skipped": 0, "deadline_exceeded": 0}
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        breaker = self.breakers.get(model)
+        if breaker is None:
+            breaker = self.breakers[model] = CircuitBreaker(model, self.failure_threshold, self.open_seconds)
+        return breaker
+
+    async def call(self, model: str, attempt: Callable[[], Awaitable[str]], reserve: Optional[Reserve] = None) -> str:
+        """Run ``attempt`` under the breaker, retry budget, deadline and optional hedge.
+
+        ``reserve`` takes the concurrency slot a hedged attempt needs; without it hedges are not limited.
+        """
+        self.counters["calls"] += 1
+        breaker = self.breaker(model)
+        breaker.before_call()
+        try:
+            result = await asyncio.wait_for(self._with_retries(attempt, reserve), self.deadline)
+        except asyncio.CancelledError:
+            breaker.probe_in_flight = False  # a cancelled probe must not wedge the breaker
+            raise
+        except asyncio.TimeoutError:
+            self.counters["deadline_exceeded"] += 1
+            self.counters["failures"] += 1
+            breaker.record_failure()
+            raise DeadlineExceeded(f"Model call exceeded {self.deadline:.0f}s deadline") from None
+        except CircuitOpenError:
+            raise
+        except Exception:
+            self.counters["failures"] += 1
+            breaker.record_failure()
+            raise
+        self.counters["successes"] += 1
+        breaker.record_success()
+        self.budget.deposit()
+        return result
+
+    async def _with_retries(self, attempt: Callable[[], Awaitable[str]], reserve: Optional[Reserve]) -> str:
+        retry = 0
+        while True:
+            try:
+                return await self._hedged(attempt, reserve)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if not is_transient(e):
+                    self.counters["not_retried"] += 1
+                    raise
+                if retry >= self.max_retries or not self.budget.try_withdraw():
+                    raise
+                retry += 1
+                self.counters["retries"] += 1
+                delay = min(self.max_delay, self.base_delay * (2 ** (retry - 1)))
+                print(f"🔁 Model call failed ({type(e).__name__}), retry {retry} in {delay:.2f}s")
+                await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+
+    async def _timed(self, attempt: Callable[[], Awaitable[str]]) -> str:
+        started = time.monotonic()
+        result = await attempt()
+        self.latency.add(time.monotonic() - started)
+        return result
+
+    async def _hedged(self, attempt: Callable[[], Awaitable[str]], reserve: Optional[Reserve]) -> str:
+        p95 = self.latency.percentile(95) if self.hedge else None
+        if p95 is None:
+            return await self._timed(attempt)
+
+        primary = asyncio.ensure_future(self._timed(attempt))
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=max(self.hedge_min_delay, p95))
+        except asyncio.CancelledError:
+            primary.cancel()  # asyncio.wait leaves its tasks running; do not orphan the attempt and its slot
+            raise
+        if done:
+            return await primary
+        release = await reserve() if reserve is not None else None
+        if reserve is not None and release is None:
+            self.counters["hedges_skipped"] += 1  # every slot is taken: a hedge would exceed the limit
+            return await primary
+        if not self.budget.try_withdraw():
+            if release is not None:
+                release()
+            return await primary
+
+        self.counters["hedges"] += 1
+        secondary = asyncio.ensure_future(self._timed(attempt))
+        if release is not None:
+            secondary.add_done_callback(lambda _: release())
+        pending = {primary, secondary}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is secondary:
+                            self.counters["hedge_wins"] += 1
+                        return task.result()
+            # Both attempts failed: surface the primary's error
+            return primary.result()
+        finally:
+            for task in (primary, secondary):
+                if not task.done():
+                    task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            "retry_budget_tokens": round(self.budget.tokens, 2),
+            "retry_budget_exhausted": self.budget.exhausted,
+            "latency_p95": self.latency.percentile(95),
+            "breakers": {name: b.stats() for name, b in self.breakers.items()},
+        }
+
+
+def caller_from_env() -> ResilientCaller:
+    return ResilientCaller(
+        deadline=float(os.environ.get("LLM_DEADLINE", 25)),
+        max_retries=int(os.environ.get("LLM_MAX_RETRIES", 2)),
+        base_delay=float(os.environ.get("LLM_RETRY_BASE_DELAY", 0.2)),
+        max_delay=float(os.environ.get("LLM_RETRY_MAX_DELAY", 2)),
+        budget_ratio=float(os.environ.get("LLM_RETRY_BUDGET_RATIO", 0.1)),
+        hedge=os.environ.get("LLM_HEDGE", "0") == "1",
+        hedge_min_delay=float(os.environ.get("LLM_HEDGE_MIN_DELAY", 0.5)),
+        failure_threshold=int(os.environ.get("BREAKER_FAILURE_THRESHOLD", 5)),
+        open_seconds=float(os.environ.get("BREAKER_OPEN_SECONDS", 30)),
+    )
@@ -0,0 +1,150 @@
+"""Cache of parsed LLM replies for turns that are effectively identical.
+
+Scenario openers, IELTS Part 1 openers and "hello"/"hi" greetings at a given
+level produce the same prompt over and over. Entries are stored twice: under
+an exact key built from the raw inputs, and under a normalized key (case,
+whitespace and punctuation folded) so "Hello!" and "hello" share a reply.
+Values are already-parsed ``ConversationResponse`` dicts, so a hit skips
+both the Gemini call and the feedback parsing. Only the exact key carries
+the feedback: it is about the learner's exact wording, and "i want a pizza"
+must not hand its capitalisation corrections to "I want a pizza.". A
+normalized hit is just ``{"ai_message": ...}``.
+
+Both keys include the scenario's rendered prompt prefix, so editing a
+scenario (they are hot-reloaded) stops its old replies from being served.
+
+Only turns with a short history are cached (RESPONSE_CACHE_MAX_HISTORY);
+deeper conversations are practically unique and would just churn the LRU.
+``get`` and ``set`` are coroutines: with a shared tier they do SQLite I/O,
+which runs off the event loop.
+
+Configuration (environment variables):
+    RESPONSE_CACHE_ENABLED      "0" disables the cache (default "1")
+    RESPONSE_CACHE_SIZE         in-memory entries (default 2048)
+    RESPONSE_CACHE_TTL          seconds (default 21600)
+    RESPONSE_CACHE_MAX_HISTORY  max prior messages for a cacheable turn (default 4)
+    RESPONSE_CACHE_PATH         SQLite file shared between processes (default: the shared
+                                state when running several workers, otherwise off)
+"""
+import hashlib
+import json
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from cache import TTLCache
+from shared_state import SharedState, shared_state
+
+_non_word = re.compile(r"[^\w\s']+")
+_spaces = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Fold case, punctuation and whitespace: "  Hello!! " -> "hello"."""
+    return _spaces.sub(" ", _non_word.sub(" ", text.lower())).strip()
+
+
+def _digest(parts: Any) -> str:
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        maxsize: int = 2048,
+        ttl: float = 21600.0,
+        max_history: int = 4,
+        shared_path: Optional[str] = None,
+        enabled: bool = True,
+        shared: Optional[SharedState] = None,
+    ):
+        self.enabled = enabled
+        self.max_history = max_history
+        self._cache = TTLCache(
+            maxsize=maxsize,
+            ttl=ttl,
+            spill_path=shared_path,
+            name="responses",
+            tier=shared,
+            write_through=bool(shared_path or shared),
+        )
+        self.exact_hits = 0
+        self.normalized_hits = 0
+        self.misses = 0
+        self.skipped = 0
+
+    def keys_for(
+        self,
+        context: Tuple[Any, ...],
+        conversation_history: List[dict],
+        user_message: str,
+        prompt_prefix: str,
+    ) -> Optional[Tuple[str, str]]:
+        """(exact, normalized) keys for a turn, or None when the turn is not cacheable.
+
+        ``context`` identifies everything besides the history that shapes the
+        reply, e.g. ("scenario", "restaurant", "beginner"); ``prompt_prefix`` is
+        the system prompt the reply was generated from.
+        """
+        if not self.enabled or len(conversation_history) > self.max_history:
+            self.skipped += 1
+            return None
+        history = [(m.get("role"), m.get("content", "")) for m in conversation_history]
+        prefix = hashlib.sha256(prompt_prefix.encode("utf-8")).hexdigest()
+        exact = _digest(["exact", list(context), prefix, history, user_message])
+        normalized = _digest([
+            "norm",
+            [normalize_text(c) if isinstance(c, str) else c for c in context],
+            prefix,
+            [(role, normalize_text(str(content))) for role, content in history],
+            normalize_text(user_message),
+        ])
+        return exact, normalized
+
+    async def get(self, keys: Optional[Tuple[str, str]]) -> Optional[Dict[str, Any]]:
+        """The full response for an exact hit, only ``{"ai_message": ...}`` for a normalized one."""
+        if keys is None:
+            return None
+        exact, normalized = keys
+        value = await self._cache.get_async(exact)
+        if value is not None:
+            self.exact_hits += 1
+            return value
+        value = await self._cache.get_async(normalized)
+        if value is not None:
+            self.normalized_hits += 1
+            return value
+        self.misses += 1
+        return None
+
+    async def set(self, keys: Optional[Tuple[str, str]], response: Dict[str, Any]) -> None:
+        if keys is None:
+            return
+        await self._cache.run(self._set, keys, response)
+
+    def _set(self, keys: Tuple[str, str], response: Dict[str, Any]) -> None:
+        exact, normalized = keys
+        self._cache.set(exact, response)
+        self._cache.set(normalized, {"ai_message": response["ai_message"]})
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "exact_hits": self.exact_hits,
+            "normalized_hits": self.normalized_hits,
+            "misses": self.misses,
+            "skipped": self.skipped,
+            "size": len(self._cache),
+        }
+
+
+def cache_from_env() -> ResponseCache:
+    shared_path = os.environ.get("RESPONSE_CACHE_PATH") or None
+    return ResponseCache(
+        maxsize=int(os.environ.get("RESPONSE_CACHE_SIZE", 2048)),
+        ttl=float(os.environ.get("RESPONSE_CACHE_TTL", 21600)),
+        max_history=int(os.environ.get("RESPONSE_CACHE_MAX_HISTORY", 4)),
+        shared_path=shared_path,
+        enabled=os.environ.get("RESPONSE_CACHE_ENABLED", "1") != "0",
+        shared=None if shared_path else shared_state(),
+    )
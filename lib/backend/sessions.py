@@ -0,0 +1,99 @@
+"""Server-held conversation sessions.
+
+A session remembers what kind of conversation it is (a scenario or an IELTS
+part), the rendered system-prompt prefix for it and the message history, so
+clients only post the new user message each turn.
+
+With several worker processes the sessions live in the shared state (see
+shared_state.py) instead of process memory, so any worker can continue any
+session, and turns are appended with an atomic read-modify-write.
+
+Configuration (environment variables):
+    SESSION_MAX_ACTIVE   sessions kept in memory (default 1000)
+    SESSION_TTL          idle seconds before a session expires (default 3600)
+    SESSION_SPILL_PATH   SQLite file for sessions evicted from memory (default: off)
+"""
+import os
+import time
+import uuid
+from typing import List, Optional
+
+from cache import TTLCache
+from shared_state import SharedState, shared_state
+
+# Hard cap so a session cannot grow without bound; prompts only use the tail.
+MAX_STORED_MESSAGES = 200
+
+
+class SessionStore:
+    def __init__(
+        self,
+        max_active: int = 1000,
+        ttl: float = 3600.0,
+        spill_path: Optional[str] = None,
+        shared: Optional[SharedState] = None,
+    ):
+        self.ttl = ttl
+        self._cache = TTLCache(
+            maxsize=max_active,
+            ttl=ttl,
+            spill_path=spill_path,
+            name="sessions",
+            sliding=True,
+            tier=shared,
+            write_through=shared is not None,
+            local_copies=shared is None,
+        )
+
+    async def create(
+        self,
+        kind: str,
+        prompt_prefix: str,
+        scenario: Optional[str] = None,
+        ielts_part: Optional[int] = None,
+        topic_card: Optional[str] = None,
+        user_level: str = "beginner",
+    ) -> dict:
+        session = {
+            "session_id": uuid.uuid4().hex,
+            "kind": kind,
+            "scenario": scenario,
+            "ielts_part": ielts_part,
+            "topic_card": topic_card,
+            "user_level": user_level,
+            "prompt_prefix": prompt_prefix,
+            "history": [],
+            "created_at": time.time(),
+        }
+        await self._cache.run(self._cache.set, session["session_id"], session)
+        return session
+
+    async def get(self, session_id: str) -> Optional[dict]:
+        return await self._cache.get_async(session_id)
+
+    async def append_turn(self, session_id: str, user_message: str, ai_message: str) -> None:
+        def append(session: Optional[dict]) -> Optional[dict]:
+            if session is None:
+                return None
+            history: List[dict] = session["history"]
+            history.append({"role": "user", "content": user_message})
+            history.append({"role": "assistant", "content": ai_message})
+            del history[:-MAX_STORED_MESSAGES]
+            return session
+
+        await self._cache.run(self._cache.update, session_id, append)
+
+    async def delete(self, session_id: str) -> bool:
+        return await self._cache.run(self._cache.pop, session_id) is not None
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+
+def store_from_env() -> SessionStore:
+    return SessionStore(
+        max_active=int(os.environ.get("SESSION_MAX_ACTIVE", 1000)),
+        ttl=float(os.environ.get("SESSION_TTL", 3600)),
+        spill_path=os.environ.get("SESSION_SPILL_PATH") or None,
+        shared=shared_state(),
+    )
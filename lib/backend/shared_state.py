@@ -0,0 +1,252 @@
+"""Key/value state shared by every worker process.
+
+With several gunicorn workers, anything kept in a Python dict exists once per
+process: a session created on one worker is unknown to the next, and a
+split-mode feedback result lands on whichever worker ran it. State that has
+to be consistent across workers goes through ``SharedState``:
+
+* ``LocalState`` - in-process dict, for a single worker (and tests);
+* ``SQLiteState`` - one SQLite file in WAL mode, by default on ``/dev/shm``
+  so it is effectively shared memory. Connections are opened lazily per
+  process, so an instance created before gunicorn forks is safe to use in
+  the workers.
+
+Values must be JSON-serialisable. Each entry has a TTL, and ``update()`` is
+an atomic read-modify-write for state that several workers may change at
+once (session history, counters).
+
+SQLite calls block, and ``update()`` may wait for another worker's write
+lock, so code on the event loop goes through ``await state.run(fn, ...)``,
+which runs them on the store's own thread (``LocalState`` runs them inline).
+Per-request updates (rate-limit buckets, session lookups) also pass
+``busy_timeout=HOT_BUSY_TIMEOUT``: rather than queue behind a slow writer
+for seconds they get ``StateBusyError`` and fall back to something cheaper.
+
+Configuration (environment variables):
+    SHARED_STATE_PATH          SQLite file for shared state (default: /dev/shm/elo-english-<port>.sqlite3
+                               when WEB_CONCURRENCY > 1, otherwise state stays in-process)
+    SHARED_STATE_HOT_TIMEOUT   seconds a per-request update waits for the write lock (default 0.1)
+    WEB_CONCURRENCY            number of worker processes (set by gunicorn.conf.py)
+"""
+import asyncio
+import functools
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+_MISSING = object()
+
+HOT_BUSY_TIMEOUT = float(os.environ.get("SHARED_STATE_HOT_TIMEOUT", 0.1))
+
+
+class StateBusyError(Exception):
+    """Another process held the write lock for longer than the caller's busy timeout."""
+
+
+class SharedState:
+    """Namespaced key/value store with per-entry TTL."""
+
+    shared = False  # True when other processes see the same entries
+
+    def get(self, namespace: str, key: str, default: Any = None) -> Any:
+        raise NotImplementedError
+
+    def set(self, namespace: str, key: str, value: Any, ttl: float) -> None:
+        raise NotImplementedError
+
+    def delete(self, namespace: str, key: str) -> bool:
+        raise NotImplementedError
+
+    def update(self, namespace: str, key: str, fn: Callable[[Any], Any], ttl: float,
+               busy_timeout: Optional[float] = None) -> Any:
+        """Atomically replace the value with ``fn(current)``; ``current`` is None when absent.
+
+        Returns the new value. If ``fn`` returns None the entry is left unchanged.
+        ``busy_timeout`` caps the wait for a lock held elsewhere (StateBusyError).
+        """
+        raise NotImplementedError
+
+    async def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """``fn(*args, **kwargs)`` without blocking the event loop on the store's I/O."""
+        return fn(*args, **kwargs)
+
+    def clear(self, namespace: str) -> None:
+        raise NotImplementedError
+
+    def purge_expired(self) -> int:
+        return 0
+
+
+class LocalState(SharedState):
+    def __init__(self):
+        self._data: Dict[Tuple[str, str], Tuple[float, Any]] = {}
+        self._lock = threading.RLock()
+
+    def get(self, namespace: str, key: str, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get((namespace, key))
+            if item is None:
+                return default
+            if item[0] <= time.time():
+                del self._data[(namespace, key)]
+                return default
+            return item[1]
+
+    def set(self, namespace: str, key: str, value: Any, ttl: float) -> None:
+        with self._lock:
+            self._data[(namespace, key)] = (time.time() + ttl, value)
+
+    def delete(self, namespace: str, key: str) -> bool:
+        with self._lock:
+            item = self._data.pop((namespace, key), None)
+            return item is not None and item[0] > time.time()
+
+    def update(self, namespace: str, key: str, fn: Callable[[Any], Any], ttl: float,
+               busy_timeout: Optional[float] = None) -> Any:
+        with self._lock:
+            value = fn(self.get(namespace, key))
+            if value is not None:
+                self.set(namespace, key, value, ttl)
+            return value
+
+    def clear(self, namespace: str) -> None:
+        with self._lock:
+            for k in [k for k in self._data if k[0] == namespace]:
+                del self._data[k]
+
+    def purge_expired(self) -> int:
+        now = time.time()
+        with self._lock:
+            expired = [k for k, (expires_at, _) in self._data.items() if expires_at <= now]
+            for k in expired:
+                del self._data[k]
+        return len(expired)
+
+
+class SQLiteState(SharedState):
+    shared = True
+
+    def __init__(self, path: str, timeout: float = 5.0):
+        self.path = path
+        self.timeout = timeout
+        self._lock = threading.RLock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid = 0
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_pid = 0
+
+    def _db(self) -> sqlite3.Connection:
+        # A connection must not cross fork(): each process opens its own
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=self.timeout)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS shared_state (namespace TEXT NOT NULL, key TEXT NOT NULL,"
+                " value TEXT NOT NULL, expires_at REAL NOT NULL, PRIMARY KEY (namespace, key)) WITHOUT ROWID"
+            )
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def _read(self, db: sqlite3.Connection, namespace: str, key: str) -> Any:
+        row = db.execute(
+            "SELECT value, expires_at FROM shared_state WHERE namespace = ? AND key = ?", (namespace, key)
+        ).fetchone()
+        if row is None or row[1] <= time.time():
+            return _MISSING
+        return json.loads(row[0])
+
+    def _write(self, db: sqlite3.Connection, namespace: str, key: str, value: Any, ttl: float) -> None:
+        db.execute(
+            "INSERT OR REPLACE INTO shared_state (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (namespace, key, json.dumps(value), time.time() + ttl),
+        )
+
+    def get(self, namespace: str, key: str, default: Any = None) -> Any:
+        with self._lock:
+            value = self._read(self._db(), namespace, key)
+        return default if value is _MISSING else value
+
+    def set(self, namespace: str, key: str, value: Any, ttl: float) -> None:
+        with self._lock:
+            self._write(self._db(), namespace, key, value, ttl)
+
+    def delete(self, namespace: str, key: str) -> bool:
+        with self._lock:
+            db = self._db()
+            found = self._read(db, namespace, key) is not _MISSING
+            db.execute("DELETE FROM shared_state WHERE namespace = ? AND key = ?", (namespace, key))
+        return found
+
+    async def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        # Calls are serialised by self._lock anyway, so one thread per process is enough
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared-state")
+            self._executor_pid = os.getpid()
+        return await asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+
+    def _begin(self, db: sqlite3.Connection, busy_timeout: Optional[float]) -> None:
+        if busy_timeout is None:
+            db.execute("BEGIN IMMEDIATE")
+            return
+        db.execute(f"PRAGMA busy_timeout = {int(busy_timeout * 1000)}")
+        try:
+            db.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError as e:
+            raise StateBusyError(str(e)) from e
+        finally:
+            db.execute(f"PRAGMA busy_timeout = {int(self.timeout * 1000)}")
+
+    def update(self, namespace: str, key: str, fn: Callable[[Any], Any], ttl: float,
+               busy_timeout: Optional[float] = None) -> Any:
+        with self._lock:
+            db = self._db()
+            self._begin(db, busy_timeout)
+            try:
+                current = self._read(db, namespace, key)
+                value = fn(None if current is _MISSING else current)
+                if value is not None:
+                    self._write(db, namespace, key, value, ttl)
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return value
+
+    def clear(self, namespace: str) -> None:
+        with self._lock:
+            self._db().execute("DELETE FROM shared_state WHERE namespace = ?", (namespace,))
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            return self._db().execute("DELETE FROM shared_state WHERE expires_at <= ?", (time.time(),)).rowcount
+
+
+def worker_count() -> int:
+    try:
+        return max(1, int(os.environ.get("WEB_CONCURRENCY", 1)))
+    except ValueError:
+        return 1
+
+
+def default_shared_path() -> str:
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(directory, f"elo-english-{os.environ.get('PORT', '8000')}.sqlite3")
+
+
+_shared: Optional[SharedState] = None
+
+
+def shared_state() -> Optional[SharedState]:
+    """The cross-process store, or None when running a single worker without SHARED_STATE_PATH."""
+    global _shared
+    if _shared is None:
+        path = os.environ.get("SHARED_STATE_PATH") or (default_shared_path() if worker_count() > 1 else None)
+        if path:
+            _shared = SQLiteState(path)
+    return _shared
@@ -0,0 +1,108 @@
+"""Background feedback analyses for split-mode conversation turns.
+
+In split mode the in-character reply and the grammar/vocabulary feedback are
+two separate, concurrent model calls. The reply is returned as soon as it is
+ready; if the feedback call has not finished by then it keeps running here,
+addressed by a turn id, and the client fetches it later from
+``GET /feedback/{turn_id}``.
+
+With several worker processes the turn state is kept in the shared state
+(see shared_state.py): a turn is recorded as pending when it starts and
+overwritten with the result when it finishes, so the follow-up request may
+land on any worker.
+
+Configuration (environment variables):
+    SPLIT_FEEDBACK_GRACE  seconds to wait for feedback after the reply is ready (default 0.3)
+    FEEDBACK_TURN_TTL     seconds a finished feedback result is kept (default 600)
+"""
+import asyncio
+import os
+import uuid
+from typing import Any, Awaitable, Dict, Optional, Set, Tuple
+
+from cache import TTLCache
+from shared_state import SharedState, shared_state
+
+SPLIT_FEEDBACK_GRACE = float(os.environ.get("SPLIT_FEEDBACK_GRACE", 0.3))
+# How often a worker re-reads a turn that is running on another worker
+SHARED_POLL_INTERVAL = 0.1
+
+
+def _result_of(task: "asyncio.Task") -> Dict[str, Any]:
+    if task.cancelled():
+        return {"status": "failed"}
+    error = task.exception()
+    if error is not None:
+        print(f"Feedback analysis error: {type(error).__name__}: {error}")
+        return {"status": "failed"}
+    feedback = task.result()
+    if not feedback:
+        return {"status": "failed"}
+    return {"status": "ready", **feedback}
+
+
+class FeedbackTurns:
+    def __init__(self, ttl: float = 600.0, maxsize: int = 4096, shared: Optional[SharedState] = None):
+        self._results = TTLCache(
+            maxsize=maxsize,
+            ttl=ttl,
+            name="feedback_turns",
+            tier=shared,
+            write_through=shared is not None,
+            local_copies=shared is None,
+        )
+        self._shared = shared is not None
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._writes: Set[asyncio.Task] = set()
+
+    async def start(self, analysis: Awaitable[Optional[dict]]) -> Tuple[str, "asyncio.Task"]:
+        """Run ``analysis`` in the background and return its turn id and task."""
+        turn_id = uuid.uuid4().hex
+        if self._shared:
+            await self._results.run(self._results.set, turn_id, {"status": "pending"})
+        task = asyncio.ensure_future(analysis)
+        self._tasks[turn_id] = task
+        task.add_done_callback(lambda t: self._finish(turn_id, t))
+        return turn_id, task
+
+    def _finish(self, turn_id: str, task: "asyncio.Task") -> None:
+        write = asyncio.ensure_future(self._record(turn_id, _result_of(task)))
+        self._writes.add(write)
+        write.add_done_callback(self._writes.discard)
+
+    async def _record(self, turn_id: str, result: Dict[str, Any]) -> None:
+        try:
+            await self._results.run(self._results.set, turn_id, result)
+        finally:
+            # Until the result is stored, peek() answers from the finished task
+            self._tasks.pop(turn_id, None)
+
+    async def peek(self, turn_id: str) -> Optional[Dict[str, Any]]:
+        """Current state of a turn: ready/failed result, {"status": "pending"}, or None if unknown."""
+        task = self._tasks.get(turn_id)
+        if task is not None:
+            return _result_of(task) if task.done() else {"status": "pending"}
+        return await self._results.run(self._results.get, turn_id)
+
+    async def wait(self, turn_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """Like peek(), but give a pending analysis up to ``timeout`` seconds to finish."""
+        task = self._tasks.get(turn_id)
+        if task is not None and timeout > 0:
+            await asyncio.wait({task}, timeout=timeout)
+            return await self.peek(turn_id)
+
+        result = await self.peek(turn_id)
+        deadline = asyncio.get_running_loop().time() + timeout
+        # Running on another worker: poll the shared state until it finishes
+        while result is not None and result["status"] == "pending" and asyncio.get_running_loop().time() < deadline:
+            await asyncio.sleep(SHARED_POLL_INTERVAL)
+            result = await self.peek(turn_id)
+        return result
+
+    @property
+    def pending(self) -> int:
+        return len(self._tasks)
+
+
+def turns_from_env() -> FeedbackTurns:
+    return FeedbackTurns(ttl=float(os.environ.get("FEEDBACK_TURN_TTL", 600)), shared=shared_state())
@@ -0,0 +1,80 @@
+"""Timed startup phases.
+
+A cold start on a platform that spins idle instances down is paid by the
+request that woke the instance, so the time until the port is bound is
+split into phases and reported:
+
+    interpreter   process start until main.py begins importing (Python, site-packages)
+    imports       main.py's imports (FastAPI, pydantic, our modules)
+    init          module-level setup: stores, caches, registry, routes
+    lifespan      the lifespan startup hook, up to the moment the server binds the port
+
+Work that is not needed to answer the first request runs after that in the
+background and is timed as well (``provider_warmup``: importing and
+configuring the model SDK). It starts ``warmup_delay()`` seconds after the
+lifespan hook so it does not compete with the request that woke the
+instance; a model call that arrives sooner starts the import itself.
+
+The phases are printed once at startup, exported as the
+``startup_phase_seconds`` gauge and returned by ``/health``.
+
+This module must be main.py's first import (and imports nothing heavy
+itself): its import time is the start of the ``imports`` phase.
+
+Configuration (environment variables):
+    STARTUP_WARMUP_DELAY   seconds before the background model SDK import starts (default 0.3)
+"""
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+
+def process_age() -> Optional[float]:
+    """Seconds since this process started (Linux, clock-tick resolution), or None."""
+    try:
+        with open("/proc/self/stat") as f:
+            started = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return max(0.0, uptime - started / os.sysconf("SC_CLK_TCK"))
+
+
+def warmup_delay() -> float:
+    # Read on use: this module is imported before main.py loads .env
+    return float(os.environ.get("STARTUP_WARMUP_DELAY", 0.3))
+
+
+class StartupTimer:
+    def __init__(self):
+        self._last = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        age = process_age()
+        if age is not None:
+            self.record("interpreter", age)
+
+    def record(self, phase: str, seconds: float) -> None:
+        self.phases[phase] = round(seconds, 4)
+
+    def mark(self, phase: str) -> None:
+        """End ``phase`` now; it started where the previous mark ended."""
+        now = time.perf_counter()
+        self.record(phase, now - self._last)
+        self._last = now
+
+    @contextmanager
+    def timed(self, phase: str) -> Iterator[None]:
+        """Time a block that runs outside the sequential phases (e.g. a background warm-up)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(phase, time.perf_counter() - started)
+
+    def summary(self) -> str:
+        return ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in self.phases.items())
+
+
+timer = StartupTimer()
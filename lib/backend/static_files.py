@@ -0,0 +1,140 @@
+"""Serving ``/uploads`` so that browsers and a CDN do most of the work.
+
+* Content-addressed files (``avatars/<sha256>.<ext>`` and their
+  ``_<size>.webp`` variants, see avatars.py) never change under a name, so
+  they get a strong ETag taken from the name and
+  ``Cache-Control: public, max-age=31536000, immutable``. Older uploads
+  (UUID names) are cached for a day and revalidated by ETag/Last-Modified.
+* ``If-None-Match`` / ``If-Modified-Since`` are answered with 304 before the
+  file is opened.
+* Small files are kept in an in-memory LRU bounded by a byte budget, so a
+  leaderboard full of 64px avatars is served without touching the disk.
+  Entries are keyed by path, size and mtime.
+* Larger files and Range requests go to Starlette's ``FileResponse``, which
+  streams in chunks, handles ranges and uses ``http.response.pathsend``
+  (zero-copy) when the server offers it. Behind nginx,
+  ``UPLOADS_ACCEL_REDIRECT`` hands the body over to nginx's sendfile via
+  ``X-Accel-Redirect`` instead.
+
+Configuration (environment variables):
+    UPLOADS_CACHE_BYTES     memory budget for hot files (default 33554432, 0 disables)
+    UPLOADS_CACHE_MAX_FILE  largest file kept in memory in bytes (default 262144)
+    UPLOADS_ACCEL_REDIRECT  internal nginx location that maps to the uploads directory
+"""
+import os
+import re
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Receive, Scope, Send
+
+from metrics import REGISTRY
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "public, max-age=86400"
+_CONTENT_ADDRESSED = re.compile(r"^avatars/([0-9a-f]{64}(?:_\d+)?)\.(?:jpg|png|gif|webp)$")
+
+HOT_CACHE = REGISTRY.counter("uploads_hot_cache_total", "Upload responses by hot-cache result", ("result",))
+
+
+class HotFileCache:
+    """LRU of file contents bounded by total bytes; only touched from the event loop."""
+
+    def __init__(self, budget: int, max_file: int):
+        self.budget = budget
+        self.max_file = min(max_file, budget)
+        self.size = 0
+        self._data: "OrderedDict[Tuple[str, int, int], bytes]" = OrderedDict()
+
+    def fits(self, length: int) -> bool:
+        return self.budget > 0 and length <= self.max_file
+
+    def get(self, key: Tuple[str, int, int]) -> Optional[bytes]:
+        body = self._data.get(key)
+        if body is not None:
+            self._data.move_to_end(key)
+        return body
+
+    def put(self, key: Tuple[str, int, int], body: bytes) -> None:
+        if key in self._data or not self.fits(len(body)):
+            return
+        self._data[key] = body
+        self.size += len(body)
+        while self.size > self.budget:
+            _, old = self._data.popitem(last=False)
+            self.size -= len(old)
+
+    def stats(self) -> dict:
+        return {"entries": len(self._data), "bytes": self.size, "budget": self.budget}
+
+
+class CachedFileResponse(Response):
+    """A small file served from the hot cache; read off the event loop on a miss."""
+
+    def __init__(self, cache: HotFileCache, path: str, stat_result: os.stat_result, headers: dict, media_type: str):
+        super().__init__(status_code=200, headers=headers, media_type=media_type)
+        self.cache = cache
+        self.path = path
+        self.key = (path, stat_result.st_size, stat_result.st_mtime_ns)
+        self.headers["content-length"] = str(stat_result.st_size)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        body = b""
+        if scope["method"] != "HEAD":
+            body = self.cache.get(self.key)
+            if body is None:
+                HOT_CACHE.inc(result="miss")
+                body = await anyio.to_thread.run_sync(_read, self.path)
+                self.cache.put(self.key, body)
+            else:
+                HOT_CACHE.inc(result="hit")
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        await send({"type": "http.response.body", "body": body})
+
+
+def _read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class UploadFiles(StaticFiles):
+    def __init__(self, directory: str, cache: HotFileCache, accel_redirect: Optional[str] = None):
+        super().__init__(directory=directory)
+        self.hot_cache = cache
+        self.accel_redirect = accel_redirect.rstrip("/") if accel_redirect else None
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        request_headers = Headers(scope=scope)
+        relative = os.path.relpath(full_path, self.directory).replace(os.sep, "/")
+        headers = {"cache-control": REVALIDATE}
+        match = _CONTENT_ADDRESSED.match(relative)
+        if match:
+            headers = {"cache-control": IMMUTABLE, "etag": f'"{match.group(1)}"'}
+
+        # FileResponse only fills in headers here; the file is not opened until it is sent
+        response = FileResponse(full_path, status_code=status_code, stat_result=stat_result, headers=headers)
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+
+        if self.accel_redirect:
+            headers = dict(response.headers)
+            headers["x-accel-redirect"] = f"{self.accel_redirect}/{relative}"
+            headers.pop("content-length", None)
+            return Response(status_code=status_code, headers=headers)
+        if status_code == 200 and "range" not in request_headers and self.hot_cache.fits(stat_result.st_size):
+            headers = {k: v for k, v in response.headers.items() if k not in ("content-type", "content-length")}
+            return CachedFileResponse(self.hot_cache, str(full_path), stat_result, headers, response.media_type)
+        HOT_CACHE.inc(result="bypass")
+        return response
+
+
+def uploads_from_env(directory: str) -> UploadFiles:
+    cache = HotFileCache(
+        budget=int(os.environ.get("UPLOADS_CACHE_BYTES", 32 * 1024 * 1024)),
+        max_file=int(os.environ.get("UPLOADS_CACHE_MAX_FILE", 256 * 1024)),
+    )
+    return UploadFiles(directory, cache, accel_redirect=os.environ.get("UPLOADS_ACCEL_REDIRECT") or None)
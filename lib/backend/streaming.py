@@ -0,0 +1,147 @@
+"""Incremental parsing of streamed completions and Server-Sent Events helpers.
+
+Gemini replies to the conversation prompts with the in-character message
+followed by a ``<feedback>{...}</feedback>`` block. When the reply is streamed,
+the message text has to reach the client token by token while the feedback
+block is held back and delivered as one structured event. Tags may be split
+across chunks, so the parser never emits text that could still turn out to be
+the start of ``<feedback>``.
+"""
+import json
+from typing import AsyncIterator, List, Optional, Tuple
+
+from metrics import REGISTRY
+from structured_output import extract_json
+
+PARSE_FAILURES = REGISTRY.counter("feedback_parse_failures_total", "Feedback blocks that were not valid JSON")
+FEEDBACK_KEYS = ("general_feedback", "grammar_corrections", "vocabulary_suggestions")
+
+FEEDBACK_OPEN = "<feedback>"
+FEEDBACK_CLOSE = "</feedback>"
+
+
+def _partial_tag_length(text: str, tag: str) -> int:
+    """Length of the longest suffix of ``text`` that is a proper prefix of ``tag``."""
+    for size in range(min(len(text), len(tag) - 1), 0, -1):
+        if text.endswith(tag[:size]):
+            return size
+    return 0
+
+
+def _strings(value) -> List[str]:
+    if isinstance(value, str):
+        return [value] if value.strip() else []
+    if not isinstance(value, list):
+        return []
+    return [item if isinstance(item, str) else json.dumps(item, ensure_ascii=False) for item in value]
+
+
+def parse_feedback_json(raw: str) -> Optional[dict]:
+    """Turn the JSON inside <feedback> into ConversationResponse fields.
+
+    Fenced, trailing-comma and truncated JSON is repaired (see
+    structured_output); None only when none of the feedback fields survive.
+    """
+    extracted = extract_json(raw, kind="feedback")
+    fb_json = extracted.value if extracted is not None else None
+    if not isinstance(fb_json, dict) or not any(key in fb_json for key in FEEDBACK_KEYS):
+        PARSE_FAILURES.inc()
+        print(f"Feedback JSON unusable: {raw[:200]!r}")
+        return None
+    general = fb_json.get("general_feedback", "")
+    return {
+        "feedback": general if isinstance(general, str) else str(general),
+        "grammar_corrections": _strings(fb_json.get("grammar_corrections", [])),
+        "vocabulary_suggestions": _strings(fb_json.get("vocabulary_suggestions", [])),
+    }
+
+
+class FeedbackStreamParser:
+    """Splits streamed text into message deltas and a final feedback dict.
+
+    ``feed()`` returns ``(message_delta, feedback)`` where ``feedback`` is set
+    exactly once, when the closing tag arrives (or at ``close()`` for output
+    that was truncated inside the block). Leading and trailing whitespace of
+    the message is dropped so the streamed text matches the non-streamed
+    ``ai_message``.
+    """
+
+    def __init__(self):
+        self._pending = ""
+        self._feedback_raw = ""
+        self._in_feedback = False
+        self._finished = False
+        self.message = ""
+        self.feedback: Optional[dict] = None
+
+    def _emit(self, text: str) -> str:
+        if not self.message:
+            text = text.lstrip()
+        self.message += text
+        return text
+
+    def feed(self, chunk: str) -> Tuple[str, Optional[dict]]:
+        if self._finished:
+            return "", None
+
+        if self._in_feedback:
+            self._feedback_raw += chunk
+            return "", self._try_close_feedback()
+
+        self._pending += chunk
+        tag_at = self._pending.find(FEEDBACK_OPEN)
+        if tag_at != -1:
+            delta = self._emit(self._pending[:tag_at].rstrip())
+            self._feedback_raw = self._pending[tag_at + len(FEEDBACK_OPEN):]
+            self._pending = ""
+            self._in_feedback = True
+            return delta, self._try_close_feedback()
+
+        # Hold back anything that may be the start of the tag, plus trailing
+        # whitespace that would be stripped if the tag follows.
+        keep = _partial_tag_length(self._pending, FEEDBACK_OPEN)
+        safe = self._pending[:len(self._pending) - keep]
+        emit = safe.rstrip()
+        self._pending = self._pending[len(emit):]
+        return self._emit(emit), None
+
+    def _try_close_feedback(self) -> Optional[dict]:
+        end_at = self._feedback_raw.find(FEEDBACK_CLOSE)
+        if end_at == -1:
+            return None
+        self._finished = True
+        self.feedback = parse_feedback_json(self._feedback_raw[:end_at])
+        return self.feedback
+
+    def close(self) -> Tuple[str, Optional[dict]]:
+        """Flush whatever is still buffered once the stream has ended."""
+        if self._finished:
+            return "", None
+        self._finished = True
+        if self._in_feedback:
+            self.feedback = parse_feedback_json(self._feedback_raw)
+            return "", self.feedback
+        delta = self._emit(self._pending.rstrip())
+        self._pending = ""
+        return delta, None
+
+
+def sse_event(event: str, data: dict) -> str:
+    """Format one Server-Sent Event frame."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def sse_stream(events: AsyncIterator[Tuple[str, dict]]) -> AsyncIterator[str]:
+    """Format (event, data) pairs as SSE frames."""
+    async for event, data in events:
+        yield sse_event(event, data)
+
+
+def parse_completion(raw: str) -> dict:
+    """Split a complete (non-streamed) reply into ConversationResponse fields."""
+    parser = FeedbackStreamParser()
+    parser.feed(raw)
+    parser.close()
+    result = {"ai_message": parser.message, "feedback": None, "grammar_corrections": [], "vocabulary_suggestions": []}
+    result.update(parser.feedback or {})
+    return result
@@ -0,0 +1,136 @@
+"""Tolerant extraction of the JSON the model was asked for.
+
+Feedback blocks and IELTS evaluations are requested as JSON, and what comes
+back is usually, but not always, exactly that. Seen in practice:
+
+* code fences (```json ... ```) or a sentence before or after the JSON;
+* trailing commas before ``}`` or ``]``;
+* output cut off by the token limit halfway through a string or object.
+
+``extract_json`` starts at the first ``{`` or ``[`` and lets the C decoder
+try the text as it is. Only if that fails does it make a single pass that
+tracks strings and brackets, drops trailing commas and, at a cut-off,
+closes the open string and brackets (or backs up to the last complete
+value when the cut fell inside a key or a literal). Every call is counted
+per kind and outcome (``ok``, ``repaired``, ``truncated``, ``failed``), so
+how often the model misbehaves is visible on /metrics.
+
+Where the provider supports it, callers also pass a JSON schema with the
+request (see ``llm.generate_text``), which makes most repairs unnecessary.
+"""
+import json
+from typing import Any, List, NamedTuple, Optional, Tuple
+
+from metrics import REGISTRY
+
+EXTRACTIONS = REGISTRY.counter(
+    "structured_output_total", "JSON extracted from model output by kind and outcome", ("kind", "outcome")
+)
+
+OK, REPAIRED, TRUNCATED, FAILED = "ok", "repaired", "truncated", "failed"
+
+_decoder = json.JSONDecoder()
+_CLOSERS = {"{": "}", "[": "]"}
+
+
+class Extracted(NamedTuple):
+    value: Any
+    outcome: str  # OK, REPAIRED or TRUNCATED
+
+
+def _repair(text: str, start: int) -> Tuple[Optional[str], bool]:
+    """One pass over ``text[start:]``; returns (JSON text, truncated) or (None, False)."""
+    out: List[str] = []
+    stack: List[str] = []
+    in_string = escaped = False
+    key_position = False  # inside an object, before the key's colon
+    # Where the text could be cut and closed and still be valid: (len(out), closers)
+    safe = (0, "")
+
+    for ch in text[start:]:
+        if in_string:
+            out.append(ch)
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in _CLOSERS:
+            stack.append(_CLOSERS[ch])
+            key_position = ch == "{"
+            out.append(ch)
+            safe = (len(out), "".join(reversed(stack)))
+            continue
+        elif ch in "}]":
+            if not stack or stack[-1] != ch:
+                return None, False
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+            stack.pop()
+            out.append(ch)
+            if not stack:
+                return "".join(out), False
+            key_position = False
+            continue
+        elif ch == ",":
+            safe = (len(out), "".join(reversed(stack)))
+            key_position = stack[-1] == "}"
+        elif ch == ":":
+            key_position = False
+        out.append(ch)
+
+    if not out:
+        return None, False
+    # Cut off: close what is open, or fall back to the last complete value
+    if in_string and not key_position:
+        if escaped:
+            out.pop()
+        candidate = "".join(out) + '"' + "".join(reversed(stack))
+        try:
+            _decoder.decode(candidate)
+            return candidate, True
+        except ValueError:
+            pass
+    elif not in_string:
+        candidate = "".join(out).rstrip().rstrip(",").rstrip()
+        if not candidate.endswith(":"):
+            candidate += "".join(reversed(stack))
+            try:
+                _decoder.decode(candidate)
+                return candidate, True
+            except ValueError:
+                pass
+    size, closers = safe
+    if size == 0:
+        return None, False
+    return "".join(out[:size]).rstrip().rstrip(",") + closers, True
+
+
+def extract_json(text: str, kind: str = "json") -> Optional[Extracted]:
+    """The first JSON object or array in ``text``; None when nothing usable is there."""
+    # Usually the first bracket; the other one covers prose like "[Note] {...}"
+    for start in sorted(i for i in (text.find("{"), text.find("[")) if i != -1):
+        try:
+            value, _ = _decoder.raw_decode(text, start)
+            EXTRACTIONS.inc(kind=kind, outcome=OK)
+            return Extracted(value, OK)
+        except ValueError:
+            pass
+        repaired, truncated = _repair(text, start)
+        if repaired is None:
+            continue
+        try:
+            value = _decoder.decode(repaired)
+        except ValueError:
+            continue
+        outcome = TRUNCATED if truncated else REPAIRED
+        EXTRACTIONS.inc(kind=kind, outcome=outcome)
+        return Extracted(value, outcome)
+    EXTRACTIONS.inc(kind=kind, outcome=FAILED)
+    return None
@@ -0,0 +1,302 @@
+"""Speech-to-text engines behind /speech-to-text.
+
+Handlers only talk to a ``SpeechEngine``; two ship with the backend:
+
+* ``VoskEngine`` - offline CPU recognition with a Vosk (Kaldi) model.
+  Uploaded recordings are recognised in a process pool whose workers load
+  the model once, in their initializer, and keep it for every later job.
+  Live streams (the WebSocket endpoint) need a recognizer that keeps state
+  between chunks, so they run in threads against one model loaded lazily in
+  the web process; Vosk releases the GIL while decoding.
+* ``DisabledEngine`` - the previous behaviour: a "please type" message with
+  confidence 0.0. Used when no engine is configured or it cannot load.
+
+Every engine answers in the same shape::
+
+    {"text": str, "confidence": float, "words": [{"word", "start", "end", "confidence"}]}
+
+Input is 16-bit mono PCM WAV at 8-48 kHz, or any format ffmpeg can read
+when ffmpeg is on PATH (it is converted to 16 kHz mono PCM first).
+Uploads are read from the request stream with a running byte cap (see
+multipart_stream.py), so an oversized recording is refused while it
+arrives, not after it has been received in full.
+
+Configuration (environment variables):
+    STT_ENGINE        "vosk" or "none" (default "none")
+    VOSK_MODEL_PATH   directory of an unpacked Vosk model (e.g. vosk-model-small-en-us-0.15)
+    STT_WORKERS       processes recognising uploaded recordings (default 1)
+    STT_MAX_BYTES     largest accepted upload in bytes (default 10485760)
+"""
+import asyncio
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+import wave
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from metrics import REGISTRY
+
+SAMPLE_RATE = 16000
+# Rates passed to the recognizer: telephone-band to studio audio
+MIN_SAMPLE_RATE, MAX_SAMPLE_RATE = 8000, 48000
+# 0.25 s of 16-bit mono audio per AcceptWaveform call
+_FEED_BYTES = SAMPLE_RATE // 4 * 2
+
+REQUESTS = REGISTRY.counter("stt_requests_total", "Speech-to-text requests by engine and outcome", ("engine", "outcome"))
+INFERENCE = REGISTRY.histogram("stt_inference_seconds", "Time spent recognising one uploaded recording", ("engine",))
+
+DISABLED_TEXT = "Speech-to-text feature temporarily disabled. Please type your message."
+
+
+class AudioFormatError(Exception):
+    """The upload is not audio we can decode."""
+
+
+def empty_transcript(text: str = "") -> Dict[str, Any]:
+    return {"text": text, "confidence": 0.0, "words": []}
+
+
+def merge_results(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Turn Vosk result objects (one per utterance) into the API's transcript shape."""
+    words = [
+        {"word": w["word"], "start": w["start"], "end": w["end"], "confidence": round(w.get("conf", 1.0), 3)}
+        for result in results
+        for w in result.get("result", [])
+    ]
+    text = " ".join(r["text"] for r in results if r.get("text"))
+    confidence = sum(w["confidence"] for w in words) / len(words) if words else 0.0
+    return {"text": text, "confidence": round(confidence, 3), "words": words}
+
+
+async def decode_audio(data: bytes) -> Tuple[bytes, int]:
+    """Return (16-bit mono PCM, sample rate) for an uploaded recording."""
+    try:
+        with wave.open(io.BytesIO(data)) as wav:
+            rate = wav.getframerate()
+            if wav.getnchannels() == 1 and wav.getsampwidth() == 2 and MIN_SAMPLE_RATE <= rate <= MAX_SAMPLE_RATE:
+                return wav.readframes(wav.getnframes()), rate
+    except (wave.Error, EOFError):
+        pass
+    # Anything else, other sample rates included, is converted by ffmpeg when it is there
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        raise AudioFormatError(
+            f"Only 16-bit mono WAV at {MIN_SAMPLE_RATE}-{MAX_SAMPLE_RATE} Hz is supported on this server"
+        )
+    proc = await asyncio.create_subprocess_exec(
+        ffmpeg, "-nostdin", "-loglevel", "error", "-i", "pipe:0", "-ac", "1", "-ar", str(SAMPLE_RATE),
+        "-f", "s16le", "pipe:1",
+        stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+    )
+    pcm, err = await proc.communicate(data)
+    if proc.returncode != 0 or not pcm:
+        raise AudioFormatError(err.decode("utf-8", "replace").strip() or "Could not decode audio")
+    return pcm, SAMPLE_RATE
+
+
+class SpeechStream:
+    """Incremental recognition of one live recording."""
+
+    async def feed(self, pcm: bytes) -> Optional[str]:
+        """Add audio; returns the current partial transcript when it changed."""
+        return None
+
+    async def finish(self) -> Dict[str, Any]:
+        return empty_transcript(DISABLED_TEXT)
+
+
+class SpeechEngine:
+    name = "none"
+    available = False
+
+    def start(self) -> None:
+        """Load models / warm pools (called from the lifespan handler)."""
+
+    async def transcribe(self, pcm: bytes, sample_rate: int) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def stream(self, sample_rate: int = SAMPLE_RATE) -> SpeechStream:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {"engine": self.name, "available": self.available}
+
+
+class DisabledEngine(SpeechEngine):
+    async def transcribe(self, pcm: bytes, sample_rate: int) -> Dict[str, Any]:
+        return empty_transcript(DISABLED_TEXT)
+
+    def stream(self, sample_rate: int = SAMPLE_RATE) -> SpeechStream:
+        return SpeechStream()
+
+
+# -- Vosk ------------------------------------------------------------------------
+# Module-level so the pool's worker processes can reach them after spawn.
+
+_worker_model = None
+
+
+def _load_worker_model(model_path: str) -> None:
+    global _worker_model
+    from vosk import Model, SetLogLevel
+
+    SetLogLevel(-1)
+    _worker_model = Model(model_path)
+
+
+def _recognize(pcm: bytes, sample_rate: int) -> Dict[str, Any]:
+    from vosk import KaldiRecognizer
+
+    recognizer = KaldiRecognizer(_worker_model, sample_rate)
+    recognizer.SetWords(True)
+    results = []
+    for i in range(0, len(pcm), _FEED_BYTES):
+        if recognizer.AcceptWaveform(pcm[i:i + _FEED_BYTES]):
+            results.append(json.loads(recognizer.Result()))
+    results.append(json.loads(recognizer.FinalResult()))
+    return merge_results(results)
+
+
+def _warm() -> bool:
+    return _worker_model is not None
+
+
+class VoskStream(SpeechStream):
+    def __init__(self, engine: "VoskEngine", sample_rate: int):
+        self._engine = engine
+        self._sample_rate = sample_rate
+        self._recognizer = None
+        self._results: List[Dict[str, Any]] = []
+        self._partial = ""
+
+    def _feed(self, pcm: bytes) -> Optional[str]:
+        if self._recognizer is None:
+            from vosk import KaldiRecognizer
+
+            self._recognizer = KaldiRecognizer(self._engine.local_model(), self._sample_rate)
+            self._recognizer.SetWords(True)
+        if self._recognizer.AcceptWaveform(pcm):
+            self._results.append(json.loads(self._recognizer.Result()))
+            partial = ""
+        else:
+            partial = json.loads(self._recognizer.PartialResult()).get("partial", "")
+        text = " ".join([r["text"] for r in self._results if r.get("text")] + ([partial] if partial else []))
+        if text == self._partial:
+            return None
+        self._partial = text
+        return text
+
+    def _finish(self) -> Dict[str, Any]:
+        if self._recognizer is not None:
+            self._results.append(json.loads(self._recognizer.FinalResult()))
+        return merge_results(self._results)
+
+    async def feed(self, pcm: bytes) -> Optional[str]:
+        return await asyncio.get_running_loop().run_in_executor(self._engine.stream_pool, self._feed, pcm)
+
+    async def finish(self) -> Dict[str, Any]:
+        return await asyncio.get_running_loop().run_in_executor(self._engine.stream_pool, self._finish)
+
+
+class VoskEngine(SpeechEngine):
+    name = "vosk"
+    available = True
+
+    def __init__(self, model_path: str, workers: int = 1, stream_threads: int = 4):
+        self.model_path = model_path
+        self.workers = max(1, workers)
+        self.stream_threads = max(1, stream_threads)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._stream_pool: Optional[ThreadPoolExecutor] = None
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._pid = 0
+
+    def _check_pid(self) -> None:
+        # Pools and the in-process model do not survive fork(): each worker builds its own
+        if self._pid != os.getpid():
+            self._pool = self._stream_pool = self._model = None
+            self._pid = os.getpid()
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        self._check_pid()
+        if self._pool is None:
+            # spawn, not fork: the web process already runs an event loop and threads
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_load_worker_model,
+                initargs=(self.model_path,),
+            )
+        return self._pool
+
+    @property
+    def stream_pool(self) -> ThreadPoolExecutor:
+        self._check_pid()
+        if self._stream_pool is None:
+            self._stream_pool = ThreadPoolExecutor(max_workers=self.stream_threads, thread_name_prefix="stt")
+        return self._stream_pool
+
+    def local_model(self):
+        """The model used by live streams, loaded once per web process (from a stream thread)."""
+        self._check_pid()
+        with self._model_lock:
+            if self._model is None:
+                from vosk import Model, SetLogLevel
+
+                SetLogLevel(-1)
+                self._model = Model(self.model_path)
+        return self._model
+
+    def start(self) -> None:
+        # Load the model in every pool process now rather than on the first request
+        for _ in range(self.workers):
+            self.pool.submit(_warm)
+
+    async def transcribe(self, pcm: bytes, sample_rate: int) -> Dict[str, Any]:
+        started = time.perf_counter()
+        result = await asyncio.get_running_loop().run_in_executor(self.pool, _recognize, pcm, sample_rate)
+        INFERENCE.observe(time.perf_counter() - started, engine=self.name)
+        return result
+
+    def stream(self, sample_rate: int = SAMPLE_RATE) -> SpeechStream:
+        return VoskStream(self, sample_rate)
+
+    def close(self) -> None:
+        if self._pid == os.getpid():
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+            if self._stream_pool is not None:
+                self._stream_pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = self._stream_pool = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {**super().stats(), "model": os.path.basename(self.model_path.rstrip("/")), "workers": self.workers}
+
+
+def engine_from_env() -> SpeechEngine:
+    if os.environ.get("STT_ENGINE", "none").lower() != "vosk":
+        return DisabledEngine()
+    model_path = os.environ.get("VOSK_MODEL_PATH", "")
+    try:
+        import vosk  # noqa: F401
+    except ImportError:
+        print("⚠️  STT_ENGINE=vosk but the vosk package is not installed; speech-to-text disabled")
+        return DisabledEngine()
+    if not os.path.isdir(model_path):
+        print(f"⚠️  VOSK_MODEL_PATH {model_path!r} is not a directory; speech-to-text disabled")
+        return DisabledEngine()
+    return VoskEngine(model_path, workers=int(os.environ.get("STT_WORKERS", 1)))
+
+
+def max_upload_bytes() -> int:
+    return int(os.environ.get("STT_MAX_BYTES", 10 * 1024 * 1024))
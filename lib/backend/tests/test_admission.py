@@ -0,0 +1,226 @@
+import asyncio
+import ipaddress
+
+import pytest
+
+import admission
+from admission import (
+    PRIORITY, STANDARD, Client, FairQueue, QueueFullError, RateLimitedError, TokenBucket, client_address, client_for,
+)
+
+
+# -- X-Forwarded-For -------------------------------------------------------------------------
+
+
+@pytest.fixture
+def trust(monkeypatch):
+    def set_trusted(*networks):
+        monkeypatch.setattr(admission, "TRUSTED_PROXIES", [ipaddress.ip_network(n) for n in networks])
+
+    return set_trusted
+
+
+def test_forwarded_for_from_an_untrusted_peer_is_ignored(trust):
+    trust("10.0.0.0/8")
+    assert client_address("203.0.113.7", "198.51.100.1") == "203.0.113.7"
+    assert client_address("203.0.113.7", None) == "203.0.113.7"
+
+
+def test_no_trusted_proxies_by_default(monkeypatch):
+    monkeypatch.setattr(admission, "TRUSTED_PROXIES", admission._trusted_proxies(""))
+    assert client_address("10.0.0.5", "198.51.100.1") == "10.0.0.5"
+
+
+def test_trusted_proxy_yields_the_nearest_untrusted_hop(trust):
+    trust("10.0.0.0/8")
+    # The client spoofs the first entry; our proxies appended the real address after it
+    assert client_address("10.0.0.5", "1.2.3.4, 198.51.100.1, 10.0.0.9") == "198.51.100.1"
+
+
+def test_only_trusted_hops_falls_back_to_the_first(trust):
+    trust("10.0.0.0/8")
+    assert client_address("10.0.0.5", "10.1.1.1, 10.0.0.9") == "10.1.1.1"
+
+
+def test_unparseable_hops_are_not_trusted(trust):
+    trust("10.0.0.0/8")
+    assert client_address("10.0.0.5", "10.0.0.8, not-an-ip") == "not-an-ip"
+
+
+def test_wildcard_trusts_every_peer(monkeypatch):
+    monkeypatch.setattr(admission, "TRUSTED_PROXIES", admission._trusted_proxies("*"))
+    assert client_address("203.0.113.7", "198.51.100.1") == "198.51.100.1"
+
+
+# -- lanes -------------------------------------------------------------------------------------
+
+
+@pytest.fixture
+def premium_keys(monkeypatch):
+    monkeypatch.setattr(admission, "PREMIUM_API_KEYS", {"premium-key"})
+
+
+def test_premium_key_gets_the_priority_lane(premium_keys):
+    client = client_for("premium-key", None, "203.0.113.7")
+    assert client.lane == PRIORITY and client.premium
+    assert "premium-key" not in client.key  # keys are hashed, not exported in metrics or state
+
+
+@pytest.mark.parametrize("api_key, user_id", [("other-key", None), (None, "user-1"), (None, None), ("", None)])
+def test_anything_else_stays_in_the_standard_lane(premium_keys, api_key, user_id):
+    client = client_for(api_key, user_id, "203.0.113.7")
+    assert client.lane == STANDARD and not client.premium
+
+
+def test_clients_are_keyed_by_key_then_user_then_address():
+    assert client_for("k", "u", "1.2.3.4").key.startswith("key:")
+    assert client_for(None, "u", "1.2.3.4").key == "user:u"
+    assert client_for(None, None, "1.2.3.4").key == "ip:1.2.3.4"
+
+
+# -- fair queue ----------------------------------------------------------------------------------
+
+
+def grant_order(queue: FairQueue, waiters):
+    """Hold every slot, queue ``waiters`` (clients) and release one slot at a time; clients in grant order."""
+
+    async def scenario():
+        for _ in range(queue.capacity):
+            await queue.acquire(Client("holder"), 1)
+        order = []
+
+        async def wait(client):
+            await queue.acquire(client, 5)
+            order.append(client)
+
+        tasks = [asyncio.ensure_future(wait(client)) for client in waiters]
+        await asyncio.sleep(0)
+        for _ in waiters:
+            queue.release()
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        return order
+
+    return asyncio.run(scenario())
+
+
+def test_standard_lane_is_not_starved():
+    queue = FairQueue(1, {PRIORITY: 3.0, STANDARD: 1.0})
+    waiters = [Client(f"p{i}", PRIORITY) for i in range(12)] + [Client(f"s{i}", STANDARD) for i in range(4)]
+    order = grant_order(queue, waiters)
+    lanes = [client.lane for client in order]
+    # Weights 3:1: one standard grant in every four while both lanes wait
+    assert [lanes[i:i + 4].count(STANDARD) for i in range(0, 16, 4)] == [1, 1, 1, 1]
+    assert queue.granted == {PRIORITY: 12, STANDARD: 1 + 4}  # the slot holder is standard too
+
+
+def test_clients_take_turns_inside_a_lane():
+    queue = FairQueue(1, {PRIORITY: 3.0, STANDARD: 1.0})
+    waiters = [Client("chatty")] * 4 + [Client("quiet")]
+    order = grant_order(queue, waiters)
+    assert [client.key for client in order][:2] == ["chatty", "quiet"]
+
+
+def test_full_queue_sheds_new_requests():
+    queue = FairQueue(1, {PRIORITY: 3.0, STANDARD: 1.0}, max_depth=1)
+
+    async def scenario():
+        await queue.acquire(Client("holder"), 1)
+        waiting = asyncio.ensure_future(queue.acquire(Client("a"), 5))
+        await asyncio.sleep(0)
+        with pytest.raises(QueueFullError):
+            await queue.acquire(Client("b"), 5)
+        queue.release()
+        await waiting
+
+    asyncio.run(scenario())
+    assert queue.shed[STANDARD] == 1
+
+
+def test_timed_out_waiter_leaves_the_queue():
+    queue = FairQueue(1, {PRIORITY: 3.0, STANDARD: 1.0})
+
+    async def scenario():
+        await queue.acquire(Client("holder"), 1)
+        with pytest.raises(asyncio.TimeoutError):
+            await queue.acquire(Client("late"), 0.01)
+        queue.release()
+
+    asyncio.run(scenario())
+    assert queue.depth == 0 and queue.in_use == 0
+
+
+# -- token bucket ----------------------------------------------------------------------------------
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(admission.time, "time", clock)
+    return clock
+
+
+def take(bucket: TokenBucket, client: Client, times: int = 1) -> int:
+    """How many of ``times`` requests were let through."""
+
+    async def scenario():
+        allowed = 0
+        for _ in range(times):
+            try:
+                await bucket.take(client)
+                allowed += 1
+            except RateLimitedError:
+                pass
+        return allowed
+
+    return asyncio.run(scenario())
+
+
+def test_bucket_allows_the_burst_then_limits(clock):
+    bucket = TokenBucket(per_minute=60, burst=5, premium_per_minute=120)
+    client = Client("ip:1.2.3.4")
+    assert take(bucket, client, 8) == 5
+    assert bucket.limited == 3
+
+
+def test_bucket_refills_at_the_configured_rate(clock):
+    bucket = TokenBucket(per_minute=60, burst=5, premium_per_minute=120)
+    client = Client("ip:1.2.3.4")
+    take(bucket, client, 5)
+    clock.now += 2.5  # one token per second
+    assert take(bucket, client, 5) == 2
+    clock.now += 3600  # never more than the burst
+    assert take(bucket, client, 10) == 5
+
+
+def test_retry_after_is_the_time_to_the_next_token(clock):
+    bucket = TokenBucket(per_minute=30, burst=1, premium_per_minute=120)
+    client = Client("ip:1.2.3.4")
+    take(bucket, client)
+    clock.now += 0.5
+    with pytest.raises(RateLimitedError) as error:
+        asyncio.run(bucket.take(client))
+    assert error.value.retry_after == pytest.approx(1.5)
+
+
+def test_buckets_are_per_client_and_premium_has_its_own_rate(clock):
+    bucket = TokenBucket(per_minute=60, burst=2, premium_per_minute=600)
+    assert take(bucket, Client("a"), 3) == 2
+    assert take(bucket, Client("b"), 3) == 2
+    premium = Client("p", PRIORITY, premium=True)
+    take(bucket, premium, 2)
+    clock.now += 0.25  # 10 tokens a second
+    assert take(bucket, premium, 3) == 2
+
+
+def test_zero_rate_turns_the_limit_off(clock):
+    bucket = TokenBucket(per_minute=0, burst=1, premium_per_minute=0)
+    assert take(bucket, Client("a"), 50) == 50
@@ -0,0 +1,87 @@
+import asyncio
+import io
+import os
+
+import pytest
+from PIL import Image
+
+from avatars import AvatarError, AvatarStore
+
+BOUNDARY = "avatarBoundary42"
+CONTENT_TYPE = f"multipart/form-data; boundary={BOUNDARY}"
+
+
+def image(fmt: str, color=(200, 30, 90)) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (40, 30), color).save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def multipart(data: bytes, name: str = "file") -> bytes:
+    return (
+        f"--{BOUNDARY}\r\n"
+        f'Content-Disposition: form-data; name="{name}"; filename="avatar"\r\n'
+        "Content-Type: application/octet-stream\r\n\r\n"
+    ).encode() + data + f"\r\n--{BOUNDARY}--\r\n".encode()
+
+
+async def chunked(body: bytes, size: int):
+    for i in range(0, len(body), size):
+        yield body[i:i + size]
+
+
+@pytest.fixture
+def store(tmp_path):
+    return AvatarStore(str(tmp_path), max_bytes=64 * 1024, sizes=(16,))
+
+
+def save(store: AvatarStore, body: bytes, chunk: int):
+    return asyncio.run(store.save(chunked(body, chunk), CONTENT_TYPE))
+
+
+@pytest.mark.parametrize("chunk", [1, 5, 4096])
+@pytest.mark.parametrize("fmt, ext", [("PNG", "png"), ("WEBP", "webp"), ("GIF", "gif"), ("JPEG", "jpg")])
+def test_images_are_recognised_whatever_the_chunking(store, chunk, fmt, ext):
+    data = image(fmt)
+    stored = save(store, multipart(data), chunk)
+    assert stored.original.endswith(f".{ext}")
+    assert sorted(stored.variants) == [16]
+    with open(os.path.join(store.directory, stored.original), "rb") as f:
+        assert f.read() == data
+
+
+@pytest.mark.parametrize("chunk", [1, 5])
+def test_non_images_are_rejected(store, chunk):
+    with pytest.raises(AvatarError) as error:
+        save(store, multipart(b"%PDF-1.7 not an image at all"), chunk)
+    assert error.value.status_code == 400
+    assert os.listdir(store.directory) == []
+
+
+@pytest.mark.parametrize("data", [b"\x89PN", b"GIF8"])
+def test_files_shorter_than_a_signature_are_rejected(store, data):
+    with pytest.raises(AvatarError) as error:
+        save(store, multipart(data), 1)
+    assert error.value.status_code == 400
+
+
+def test_empty_and_missing_files(store):
+    with pytest.raises(AvatarError, match="Empty file"):
+        save(store, multipart(b""), 5)
+    with pytest.raises(AvatarError, match="No file uploaded"):
+        save(store, multipart(image("PNG"), name="other"), 5)
+
+
+def test_oversized_file_is_refused(store):
+    with pytest.raises(AvatarError) as error:
+        save(store, multipart(image("PNG") + b"\0" * (64 * 1024)), 4096)
+    assert error.value.status_code == 413
+    assert os.listdir(store.directory) == []
+
+
+def test_same_image_again_is_deduplicated(store):
+    data = image("PNG")
+    first = save(store, multipart(data), 5)
+    again = save(store, multipart(data), 1)
+    assert not first.deduplicated and again.deduplicated
+    assert again.original == first.original and again.variants == first.variants
@@ -0,0 +1,108 @@
+import asyncio
+import threading
+
+import pytest
+
+from cache import TTLCache
+from response_cache import ResponseCache
+from sessions import SessionStore
+from shared_state import SQLiteState
+
+
+class RecordingState(SQLiteState):
+    """SQLite tier that records which thread every store call ran on."""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.threads = []
+
+    def _record(self):
+        self.threads.append(threading.current_thread())
+
+    def get(self, *args, **kwargs):
+        self._record()
+        return super().get(*args, **kwargs)
+
+    def set(self, *args, **kwargs):
+        self._record()
+        return super().set(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        self._record()
+        return super().delete(*args, **kwargs)
+
+    def update(self, *args, **kwargs):
+        self._record()
+        return super().update(*args, **kwargs)
+
+    def on_loop_thread(self):
+        return [t for t in self.threads if t is threading.main_thread()]
+
+
+@pytest.fixture
+def state(tmp_path):
+    return RecordingState(str(tmp_path / "shared.sqlite3"))
+
+
+def test_response_cache_does_tier_io_off_the_event_loop(state):
+    worker_a = ResponseCache(shared=state)
+    worker_b = ResponseCache(shared=state)
+    keys = worker_a.keys_for(("scenario", "restaurant", "beginner"), [], "Hello!", "prefix")
+
+    async def scenario():
+        await worker_a.set(keys, {"ai_message": "Hi there", "feedback": "Good"})
+        return await worker_b.get(keys)  # another worker: only the shared tier has it
+
+    assert asyncio.run(scenario()) == {"ai_message": "Hi there", "feedback": "Good"}
+    assert state.threads and not state.on_loop_thread()
+
+
+def test_memory_hits_stay_on_the_event_loop(state):
+    cache = TTLCache(tier=state, write_through=True, name="responses")
+
+    async def scenario():
+        await cache.run(cache.set, "k", "v")
+        state.threads.clear()
+        return await cache.get_async("k")
+
+    assert asyncio.run(scenario()) == "v"
+    assert state.threads == []
+
+
+def test_spilled_entries_are_promoted_off_the_event_loop(state):
+    cache = TTLCache(maxsize=1, tier=state, name="spill")
+
+    async def scenario():
+        await cache.run(cache.set, "old", 1)
+        await cache.run(cache.set, "new", 2)  # evicts "old" into the tier
+        return await cache.get_async("old")
+
+    assert asyncio.run(scenario()) == 1
+    assert cache.spilled == 2  # "old", then "new" when "old" was promoted back
+    assert state.threads and not state.on_loop_thread()
+
+
+def test_shared_sessions_do_tier_io_off_the_event_loop(state):
+    store = SessionStore(shared=state)
+
+    async def scenario():
+        session = await store.create(kind="scenario", prompt_prefix="prefix", scenario="restaurant")
+        await store.append_turn(session["session_id"], "Hello", "Hi!")
+        loaded = await store.get(session["session_id"])
+        deleted = await store.delete(session["session_id"])
+        return loaded, deleted, await store.get(session["session_id"])
+
+    loaded, deleted, after = asyncio.run(scenario())
+    assert [m["content"] for m in loaded["history"]] == ["Hello", "Hi!"]
+    assert deleted and after is None
+    assert state.threads and not state.on_loop_thread()
+
+
+def test_in_process_sessions_need_no_tier():
+    store = SessionStore()
+
+    async def scenario():
+        session = await store.create(kind="ielts", prompt_prefix="prefix", ielts_part=1)
+        return await store.delete(session["session_id"]), await store.delete(session["session_id"])
+
+    assert asyncio.run(scenario()) == (True, False)
@@ -0,0 +1,141 @@
+import asyncio
+
+import pytest
+
+import llm
+from coalescing import SingleFlight, prompt_key
+from providers import ModelProvider
+from resilience import ResilientCaller
+
+
+class CountingProvider(ModelProvider):
+    def __init__(self, delay: float = 0.05):
+        self.delay = delay
+        self.calls = []
+
+    async def generate(self, prompt, model=None, json_schema=None):
+        self.calls.append(prompt)
+        await asyncio.sleep(self.delay)
+        return f"reply to {prompt}"
+
+
+@pytest.fixture
+def provider(monkeypatch):
+    saved = llm.limiter, llm._provider, llm.resilience
+    provider = CountingProvider()
+    llm.configure(new_limiter=llm.ConcurrencyLimiter(8), provider=provider, caller=ResilientCaller())
+    monkeypatch.setattr(llm, "COALESCE", True)
+    monkeypatch.setattr(llm, "inflight", SingleFlight())
+    yield provider
+    llm.limiter, llm._provider, llm.resilience = saved
+
+
+def test_identical_concurrent_prompts_make_one_provider_call(provider):
+    async def scenario():
+        return await asyncio.gather(
+            llm.generate_text("Hello there", "conversation"),
+            llm.generate_text("Hello   there", "conversation"),  # whitespace is folded into the same key
+            llm.generate_text("Hello there", "conversation"),
+            llm.generate_text("Something else", "conversation"),
+        )
+
+    replies = asyncio.run(scenario())
+    assert replies[:3] == ["reply to Hello there"] * 3
+    assert sorted(provider.calls) == ["Hello there", "Something else"]
+    assert llm.inflight.stats() == {"in_flight": 0, "calls": 2, "coalesced": 2}
+
+
+def test_later_identical_prompt_makes_a_new_call(provider):
+    async def scenario():
+        await llm.generate_text("Hi", "conversation")
+        await llm.generate_text("Hi", "conversation")
+
+    asyncio.run(scenario())
+    assert provider.calls == ["Hi", "Hi"]  # only overlapping calls are shared; caching is not this layer's job
+
+
+def test_key_separates_endpoints_and_schemas():
+    assert prompt_key("conversation", None, prompt="a  b") == prompt_key("conversation", None, prompt="a b")
+    assert prompt_key("conversation", None, prompt="a") != prompt_key("feedback", None, prompt="a")
+    assert prompt_key("x", {"type": "object"}, prompt="a") != prompt_key("x", None, prompt="a")
+
+
+class Gate:
+    """A call that finishes when ``open`` is set, counting starts and cancellations."""
+
+    def __init__(self):
+        self.open = asyncio.Event()
+        self.started = 0
+        self.cancelled = 0
+
+    async def __call__(self):
+        self.started += 1
+        try:
+            await self.open.wait()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return "result"
+
+
+def test_cancelling_one_waiter_leaves_the_others_their_result():
+    async def scenario():
+        flight, gate = SingleFlight(), Gate()
+        starter = asyncio.ensure_future(flight.do("k", gate))
+        joiner = asyncio.ensure_future(flight.do("k", gate))
+        await asyncio.sleep(0)
+        starter.cancel()  # the caller that started the call disconnects
+        await asyncio.sleep(0)
+        gate.open.set()
+        with pytest.raises(asyncio.CancelledError):
+            await starter
+        return await joiner, gate
+
+    (result, shared), gate = asyncio.run(scenario())
+    assert result == "result" and shared
+    assert gate.started == 1 and gate.cancelled == 0
+
+
+def test_call_is_cancelled_when_every_waiter_is_gone():
+    async def scenario():
+        flight, gate = SingleFlight(), Gate()
+        waiters = [asyncio.ensure_future(flight.do("k", gate)) for _ in range(2)]
+        await asyncio.sleep(0)
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await asyncio.sleep(0)
+        return gate, flight.in_flight
+
+    gate, in_flight = asyncio.run(scenario())
+    assert gate.cancelled == 1 and in_flight == 0
+
+
+def test_caller_arriving_right_after_the_last_waiter_left_starts_a_new_call():
+    async def scenario():
+        flight, first_gate, second_gate = SingleFlight(), Gate(), Gate()
+        leaving = asyncio.ensure_future(flight.do("k", first_gate))
+        await asyncio.sleep(0)
+        leaving.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leaving
+        # The shared task has been cancelled but has not run its done-callback yet
+        second_gate.open.set()
+        return await flight.do("k", second_gate), first_gate, second_gate
+
+    (result, shared), first_gate, second_gate = asyncio.run(scenario())
+    assert result == "result" and not shared
+    assert first_gate.started == 1 and second_gate.started == 1
+
+
+def test_errors_reach_every_waiter():
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream said no")
+
+    async def scenario():
+        flight = SingleFlight()
+        return await asyncio.gather(*(flight.do("k", failing) for _ in range(3)), return_exceptions=True)
+
+    errors = asyncio.run(scenario())
+    assert [type(e) for e in errors] == [ValueError] * 3
@@ -0,0 +1,167 @@
+import asyncio
+
+from evaluation_jobs import DONE, FAILED, QUEUED, EvaluationJobs, job_id_for
+from llm import LLMBusyError
+
+PROVISIONAL = {"band_score": 5.0}
+
+
+class Grader:
+    """Fake ``grade`` callable: records every batch and answers through ``answer(payload)``."""
+
+    def __init__(self, answer=None, busy: int = 0, fail_batches: bool = False):
+        self.answer = answer or (lambda payload: {"band_score": 7.0, "payload": payload})
+        self.busy = busy  # calls that raise LLMBusyError before grading works
+        self.fail_batches = fail_batches
+        self.batches = []
+
+    async def __call__(self, payloads):
+        self.batches.append(list(payloads))
+        if self.busy:
+            self.busy -= 1
+            raise LLMBusyError("ielts_evaluate", 1.0, retry_after=0.01)
+        if self.fail_batches and len(payloads) > 1:
+            raise RuntimeError("unparseable batch reply")
+        return [self.answer(payload) for payload in payloads]
+
+
+def run_jobs(grader, scenario, **settings):
+    settings = {"workers": 1, "batch_size": 4, "batch_wait": 0.01, **settings}
+
+    async def main():
+        jobs = EvaluationJobs(grader, **settings)
+        jobs.start()
+        try:
+            return await scenario(jobs)
+        finally:
+            jobs.stop()
+
+    return asyncio.run(main())
+
+
+def test_identical_transcripts_share_one_job():
+    grader = Grader()
+
+    async def scenario(jobs):
+        first = await jobs.submit(["a"], PROVISIONAL)
+        again = await jobs.submit(["a"], PROVISIONAL)
+        done = await jobs.wait(first["job_id"], 5)
+        after = await jobs.submit(["a"], PROVISIONAL)  # finished: served from the store
+        return first, again, done, after, jobs.stats()
+
+    first, again, done, after, stats = run_jobs(grader, scenario)
+    assert first["job_id"] == again["job_id"] == job_id_for(["a"])
+    assert first["status"] == QUEUED and first["provisional"] == PROVISIONAL
+    assert done["status"] == DONE and done["result"]["payload"] == ["a"]
+    assert after["status"] == DONE
+    assert grader.batches == [[["a"]]]
+    assert stats["submitted"] == 1 and stats["deduplicated"] == 2
+
+
+def test_final_submission_stores_the_provisional_score():
+    grader = Grader()
+
+    async def scenario(jobs):
+        return await jobs.submit([], PROVISIONAL, final=True)
+
+    job = run_jobs(grader, scenario)
+    assert job["status"] == DONE and job["result"] == PROVISIONAL
+    assert grader.batches == []
+
+
+def test_concurrent_jobs_are_graded_in_one_batch():
+    grader = Grader()
+
+    async def scenario(jobs):
+        submitted = [await jobs.submit([name], PROVISIONAL) for name in "abc"]
+        return [await jobs.wait(job["job_id"], 5) for job in submitted]
+
+    results = run_jobs(grader, scenario)
+    assert [job["status"] for job in results] == [DONE] * 3
+    assert grader.batches == [[["a"], ["b"], ["c"]]]
+
+
+def test_failed_batch_is_regraded_one_by_one():
+    grader = Grader(fail_batches=True)
+
+    async def scenario(jobs):
+        submitted = [await jobs.submit([name], PROVISIONAL) for name in "ab"]
+        return [await jobs.wait(job["job_id"], 5) for job in submitted], jobs.stats()
+
+    results, stats = run_jobs(grader, scenario)
+    assert [job["status"] for job in results] == [DONE, DONE]
+    assert grader.batches == [[["a"], ["b"]], [["a"]], [["b"]]]
+    assert stats["batches"] == 3 and stats["completed"] == 2
+
+
+def test_unusable_result_in_a_batch_is_regraded_alone_then_fails():
+    grader = Grader(answer=lambda payload: None if payload == ["bad"] else {"band_score": 6.0})
+
+    async def scenario(jobs):
+        good = await jobs.submit(["good"], PROVISIONAL)
+        bad = await jobs.submit(["bad"], PROVISIONAL)
+        return await jobs.wait(good["job_id"], 5), await jobs.wait(bad["job_id"], 5)
+
+    good, bad = run_jobs(grader, scenario)
+    assert good["status"] == DONE
+    assert bad["status"] == FAILED and bad["result"] is None and bad["provisional"] == PROVISIONAL
+    assert grader.batches == [[["good"], ["bad"]], [["bad"]]]
+
+
+def test_failed_job_can_be_submitted_again():
+    outcomes = iter([None, {"band_score": 6.5}])
+    grader = Grader(answer=lambda payload: next(outcomes))
+
+    async def scenario(jobs):
+        first = await jobs.submit(["a"], PROVISIONAL)
+        failed = await jobs.wait(first["job_id"], 5)
+        retried = await jobs.submit(["a"], PROVISIONAL)
+        return failed, retried, await jobs.wait(retried["job_id"], 5), jobs.stats()
+
+    failed, retried, done, stats = run_jobs(grader, scenario)
+    assert failed["status"] == FAILED
+    assert retried["status"] == QUEUED
+    assert done["status"] == DONE and done["result"] == {"band_score": 6.5}
+    assert stats["submitted"] == 2 and stats["deduplicated"] == 0
+
+
+def test_busy_model_puts_the_batch_back_in_the_queue():
+    grader = Grader(busy=2)
+
+    async def scenario(jobs):
+        submitted = [await jobs.submit([name], PROVISIONAL) for name in "ab"]
+        while len(grader.batches) < 1:
+            await asyncio.sleep(0.001)
+        requeued = await jobs.get(submitted[0]["job_id"])
+        return requeued, [await jobs.wait(job["job_id"], 5) for job in submitted], jobs.stats()
+
+    requeued, results, stats = run_jobs(grader, scenario)
+    assert requeued["status"] == QUEUED
+    assert [job["status"] for job in results] == [DONE, DONE]
+    # Two busy attempts, then one batch that grades both; nothing was failed or graded twice
+    assert grader.batches == [[["a"], ["b"]]] * 3
+    assert stats["completed"] == 2 and stats["failed"] == 0
+
+
+def test_busy_retry_drops_jobs_that_expired_meanwhile():
+    jobs_ref = {}
+
+    class ExpiringGrader(Grader):
+        async def __call__(self, payloads):
+            if self.busy:
+                jobs_ref["jobs"]._jobs.pop(job_id_for(["a"]))  # the record's TTL ran out while it waited
+            return await super().__call__(payloads)
+
+    grader = ExpiringGrader(busy=1)
+
+    async def scenario(jobs):
+        jobs_ref["jobs"] = jobs
+        job = await jobs.submit(["a"], PROVISIONAL)
+        while not grader.batches:
+            await asyncio.sleep(0.001)
+        await asyncio.sleep(0.05)
+        return await jobs.get(job["job_id"]), jobs.stats()
+
+    record, stats = run_jobs(grader, scenario)
+    assert record is None
+    assert len(grader.batches) == 1 and stats["queued"] == 0
@@ -0,0 +1,70 @@
+import pytest
+
+from ielts_features import message_features, provisional_bands, transcript_features
+
+
+@pytest.mark.parametrize("text", [
+    "I was born in Ankara and I was happy there.",
+    "If she were older, she would travel more.",
+    "It was a long day, and we were tired.",
+    "He doesn't like coffee, but she has a cup every morning.",
+    "I have an umbrella and a university degree.",
+    "They were at home because it was raining.",
+])
+def test_correct_sentences_are_not_flagged(text):
+    assert message_features(text)["grammar_flags"] == 0
+
+
+@pytest.mark.parametrize("text, flags", [
+    ("He don't like it.", 1),
+    ("She have a car and it are red.", 2),
+    ("They was late and you is early.", 2),
+    ("I has a dog.", 1),
+    ("I likes to swim.", 1),
+    ("I ate a apple.", 1),
+    ("I didn't liked the the film.", 2),
+    ("yesterday i went home.", 0),  # all lowercase, as speech-to-text writes it: not checked
+    ("Yesterday i went home.", 1),
+])
+def test_agreement_and_article_errors_are_flagged(text, flags):
+    assert message_features(text)["grammar_flags"] == flags
+
+
+def test_message_features_counts():
+    features = message_features("I live in Izmir. However, I work in Istanbul because it pays more!")
+    assert features["words"] == 13
+    assert features["sentence_lengths"] == [4, 9]
+    assert sorted(features["connectives"]) == ["because", "however"]
+
+
+def test_transcript_features_needs_words():
+    assert transcript_features([]) is None
+    assert transcript_features(["   ", ""]) is None
+
+
+ANSWERS = [
+    "I was born in Izmir, which is a big city by the sea, and I was happy there as a child.",
+    "I usually spend my weekends with my family because we enjoy cooking together on Sundays.",
+    "However, if my sister were here, she would probably say that I talk about food too much.",
+]
+WRONG = [
+    "I were born in Izmir and he don't like the sea, they was happy there as a child yes.",
+    "I usually spend my weekends with my family, she have a car and it are red on Sundays.",
+    "However, my sister are here, she don't say that they is talk about a food too much.",
+]
+
+
+def test_grammar_errors_lower_the_provisional_grammar_band():
+    correct = transcript_features(ANSWERS)
+    wrong = transcript_features(WRONG)
+    assert correct["grammar_flags_per_100"] == 0
+    assert wrong["grammar_flags_per_100"] > 6
+    assert provisional_bands(correct)["grammar_score"] > provisional_bands(wrong)["grammar_score"]
+
+
+def test_provisional_bands_are_half_bands_in_range():
+    bands = provisional_bands(transcript_features(ANSWERS))
+    for name in ("band_score", "fluency_score", "vocabulary_score", "grammar_score", "coherence_score"):
+        assert 3.0 <= bands[name] <= 9.0
+        assert bands[name] * 2 == int(bands[name] * 2)
+    assert bands["feedback"].startswith("Provisional score")
@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+import llm
+from providers import ModelProvider
+from resilience import CLOSED, HALF_OPEN, ResilientCaller
+
+
+class HangingStream(ModelProvider):
+    """Streams one chunk, then waits until cancelled."""
+
+    async def generate(self, prompt, model=None, json_schema=None):
+        return "reply"
+
+    async def stream(self, prompt, model=None):
+        yield "Hello"
+        await asyncio.sleep(60)
+
+
+@pytest.fixture
+def configured():
+    saved = llm.limiter, llm._provider, llm.resilience
+    caller = ResilientCaller(failure_threshold=1, open_seconds=0)
+    llm.configure(new_limiter=llm.ConcurrencyLimiter(4), provider=HangingStream(), caller=caller)
+    yield caller
+    llm.limiter, llm._provider, llm.resilience = saved
+
+
+async def _consume(stream):
+    async for _ in stream:
+        pass
+
+
+def test_cancelled_probe_stream_releases_the_breaker(configured):
+    breaker = configured.breaker("default")
+    breaker.record_failure()  # open; with no cool-down the next call is the half-open probe
+
+    async def scenario():
+        consumer = asyncio.ensure_future(_consume(llm.stream_text("hi", "conversation")))
+        await asyncio.sleep(0.01)
+        assert breaker.state == HALF_OPEN and breaker.probe_in_flight
+        consumer.cancel()  # a client disconnect mid-stream
+        with pytest.raises(asyncio.CancelledError):
+            await consumer
+        assert not breaker.probe_in_flight
+        return await llm.generate_text("hello", "conversation")
+
+    assert asyncio.run(scenario()) == "reply"
+    assert breaker.state == CLOSED
+
+
+def test_closed_probe_stream_releases_the_breaker(configured):
+    breaker = configured.breaker("default")
+    breaker.record_failure()
+
+    async def scenario():
+        stream = llm.stream_text("hi", "conversation")
+        assert await stream.__anext__() == "Hello"
+        await stream.aclose()
+        return await llm.generate_text("hello", "conversation")
+
+    assert asyncio.run(scenario()) == "reply"
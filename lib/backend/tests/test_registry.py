@@ -0,0 +1,116 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+from registry import DEFAULT_FALLBACK_REPLIES, RegistryError, ScenarioRegistry
+
+
+def scenario(scenario_id: str, **extra) -> dict:
+    return {
+        "id": scenario_id,
+        "title": scenario_id.title(),
+        "description": "",
+        "difficulty": "easy",
+        "estimated_time": "5 min",
+        "system_prompt": f"You work at the {scenario_id}.",
+        **extra,
+    }
+
+
+def write(path, content) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content if isinstance(content, str) else json.dumps(content))
+    # Same-second rewrites of an equally long file must still change the signature
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+@pytest.fixture
+def directory(tmp_path):
+    write(str(tmp_path / "cafe.json"), scenario("cafe"))
+    write(str(tmp_path / "ielts" / "part1.json"), {"part": 1, "system_prompt": "Part one."})
+    write(str(tmp_path / "ielts" / "part2.json"), {"part": 2, "system_prompt": "Talk about {topic_card}, please."})
+    return tmp_path
+
+
+def test_snapshot_indexes_and_prerenders(directory):
+    registry = ScenarioRegistry(str(directory))
+    cafe = registry.get("cafe")
+    assert [info["id"] for info in registry.list_infos()] == ["cafe"]
+    assert "system_prompt" not in registry.list_infos()[0]
+    assert "You work at the cafe." in registry.conversation_prefix(cafe, "beginner")
+    assert "a pirate" in registry.conversation_prefix(cafe, "a pirate")  # free-form level
+    assert registry.ielts_prefix(2, "your town") == "Talk about your town, please."
+    assert registry.ielts_prefix(3, None) == "Part one."
+    assert registry.fallback_reply("cafe") in DEFAULT_FALLBACK_REPLIES
+
+
+def test_invalid_directory_fails_at_startup(tmp_path):
+    write(str(tmp_path / "cafe.json"), {"id": "cafe"})
+    with pytest.raises(RegistryError, match="missing fields"):
+        ScenarioRegistry(str(tmp_path))
+
+
+def test_unchanged_directory_is_not_rebuilt(directory):
+    registry = ScenarioRegistry(str(directory))
+    assert not registry.reload_if_changed()
+    assert registry.reloads == 0
+
+
+def test_good_edit_is_picked_up(directory):
+    registry = ScenarioRegistry(str(directory))
+    write(str(directory / "bank.json"), scenario("bank", fallback_replies=["One moment, please."]))
+    assert registry.reload_if_changed()
+    assert registry.get("bank") is not None and registry.fallback_reply("bank") == "One moment, please."
+
+
+@pytest.mark.parametrize("name, content", [
+    ("cafe.yaml", "id: cafe\ntitle: [unclosed\n"),  # yaml.YAMLError
+    ("cafe.json", '{"id": "cafe", '),  # json.JSONDecodeError
+    ("cafe.json", {**scenario("cafe"), "id": ["cafe"]}),  # TypeError: a list as the id
+    ("ielts/part1.json", {"part": [1], "system_prompt": "Part one."}),  # TypeError in int()
+    ("ielts/part1.json", {"part": "one", "system_prompt": "Part one."}),  # ValueError
+    ("cafe.json", scenario("cafe", fallback_replies="Sorry?")),  # RegistryError
+])
+def test_bad_edit_keeps_the_old_registry_until_a_good_one(directory, name, content):
+    registry = ScenarioRegistry(str(directory))
+    if name == "cafe.yaml":
+        os.remove(directory / "cafe.json")
+    write(str(directory / name), content)
+
+    assert not registry.reload_if_changed()
+    assert registry.reload_errors == 1
+    assert registry.get("cafe")["system_prompt"] == "You work at the cafe."
+    assert registry.ielts_prefix(1, None) == "Part one."
+
+    write(str(directory / name), scenario("cafe", system_prompt="You run the cafe.") if name.startswith("cafe")
+          else {"part": 1, "system_prompt": "Part one, revised."})
+    if name == "cafe.yaml":
+        os.rename(directory / name, directory / "cafe.json")
+    assert registry.reload_if_changed()
+    assert registry.reload_errors == 1 and registry.reloads == 1
+    assert registry.get("cafe") is not None
+
+
+def test_watcher_survives_a_bad_edit(directory):
+    registry = ScenarioRegistry(str(directory))
+
+    async def scenario_edits():
+        watcher = asyncio.ensure_future(registry.watch(0.001))
+        try:
+            async with asyncio.timeout(5):
+                write(str(directory / "cafe.json"), {**scenario("cafe"), "id": ["cafe"]})
+                while not registry.reload_errors and not watcher.done():
+                    await asyncio.sleep(0.001)
+                write(str(directory / "cafe.json"), scenario("cafe", title="Coffee shop"))
+                while not registry.reloads and not watcher.done():
+                    await asyncio.sleep(0.001)
+            return watcher.done()
+        finally:
+            watcher.cancel()
+
+    assert not asyncio.run(scenario_edits())
+    assert registry.list_infos()[0]["title"] == "Coffee shop"
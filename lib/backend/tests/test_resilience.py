@@ -0,0 +1,225 @@
+import asyncio
+
+import pytest
+
+from providers import ProviderError
+from resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError, DeadlineExceeded, ResilientCaller
+
+
+def caller(**settings) -> ResilientCaller:
+    settings = {"base_delay": 0.0, "max_delay": 0.0, **settings}
+    return ResilientCaller(**settings)
+
+
+class Attempts:
+    """An attempt callable that plays ``outcomes`` in order: exceptions are raised, strings returned."""
+
+    def __init__(self, *outcomes, delay: float = 0.0):
+        self.outcomes = list(outcomes)
+        self.delay = delay
+        self.calls = 0
+        self.cancelled = 0
+
+    async def __call__(self) -> str:
+        outcome = self.outcomes[min(self.calls, len(self.outcomes) - 1)]
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+
+def fill_latency(c: ResilientCaller, seconds: float) -> None:
+    for _ in range(20):
+        c.latency.add(seconds)
+
+
+# -- circuit breaker -----------------------------------------------------------------------
+
+
+def test_breaker_opens_after_threshold_and_short_circuits():
+    breaker = CircuitBreaker("m", failure_threshold=2, open_seconds=30)
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    breaker.record_failure()
+    assert breaker.state == OPEN and breaker.is_open()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    assert breaker.short_circuited == 1
+
+
+def test_breaker_lets_one_probe_through_after_cool_down():
+    breaker = CircuitBreaker("m", failure_threshold=1, open_seconds=0)
+    breaker.record_failure()
+    breaker.before_call()  # the probe
+    assert breaker.state == HALF_OPEN and breaker.probe_in_flight
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()  # a second caller while the probe runs
+    breaker.record_success()
+    assert breaker.state == CLOSED and not breaker.probe_in_flight
+    breaker.before_call()
+
+
+def test_failed_probe_reopens_the_breaker():
+    breaker = CircuitBreaker("m", failure_threshold=3, open_seconds=0)
+    for _ in range(3):
+        breaker.record_failure()
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == OPEN and breaker.times_opened == 2
+
+
+def test_cancelled_probe_call_releases_the_breaker():
+    c = caller(failure_threshold=1, open_seconds=0)
+    c.breaker("m").record_failure()
+
+    async def scenario():
+        task = asyncio.ensure_future(c.call("m", Attempts("late", delay=10)))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return await c.call("m", Attempts("ok"))
+
+    assert asyncio.run(scenario()) == "ok"
+    assert c.breaker("m").state == CLOSED
+
+
+# -- retries and budget ----------------------------------------------------------------------
+
+
+def test_transient_errors_are_retried():
+    attempt = Attempts(ProviderError("503"), ProviderError("503"), "ok")
+    assert asyncio.run(caller(max_retries=2).call("m", attempt)) == "ok"
+    assert attempt.calls == 3
+
+
+def test_permanent_errors_are_not_retried():
+    c = caller(max_retries=2)
+    attempt = Attempts(ProviderError("bad request", transient=False))
+    with pytest.raises(ProviderError):
+        asyncio.run(c.call("m", attempt))
+    assert attempt.calls == 1
+    assert c.counters["not_retried"] == 1 and c.counters["retries"] == 0
+
+
+def test_retries_stop_when_the_budget_is_exhausted():
+    c = caller(max_retries=5)
+    c.budget.tokens = 1.0
+    attempt = Attempts(ProviderError("503"))
+    with pytest.raises(ProviderError):
+        asyncio.run(c.call("m", attempt))
+    assert attempt.calls == 2  # the first attempt and the one retry the budget paid for
+    assert c.budget.exhausted == 1
+
+
+def test_successes_refill_the_budget():
+    c = caller(budget_ratio=0.5)
+    c.budget.tokens = 0.0
+    asyncio.run(c.call("m", Attempts("ok")))
+    asyncio.run(c.call("m", Attempts("ok")))
+    assert c.budget.tokens == 1.0
+
+
+# -- deadline ------------------------------------------------------------------------------
+
+
+def test_deadline_covers_the_whole_call():
+    c = caller(deadline=0.05, failure_threshold=1)
+    attempt = Attempts("late", delay=1)
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(c.call("m", attempt))
+    assert attempt.cancelled == 1
+    assert c.counters["deadline_exceeded"] == 1
+    assert c.breaker("m").state == OPEN
+
+
+# -- hedging -------------------------------------------------------------------------------
+
+
+class Slots:
+    """``reserve`` stand-in with a fixed number of free slots."""
+
+    def __init__(self, free: int):
+        self.free = free
+
+    async def __call__(self):
+        if self.free == 0:
+            return None
+        self.free -= 1
+
+        def release():
+            self.free += 1
+
+        return release
+
+
+def test_hedge_wins_when_the_primary_is_slow():
+    c = caller(hedge=True, hedge_min_delay=0.01)
+    fill_latency(c, 0.01)
+    outcomes = iter(["primary", "hedge"])
+    delays = iter([1.0, 0.0])
+
+    async def attempt():
+        outcome, delay = next(outcomes), next(delays)
+        await asyncio.sleep(delay)
+        return outcome
+
+    slots = Slots(1)
+    assert asyncio.run(c.call("m", attempt, reserve=slots)) == "hedge"
+    assert c.counters["hedges"] == 1 and c.counters["hedge_wins"] == 1
+    assert slots.free == 1
+
+
+def test_primary_wins_and_the_hedge_is_cancelled():
+    c = caller(hedge=True, hedge_min_delay=0.01)
+    fill_latency(c, 0.01)
+    started = []
+
+    async def attempt():
+        name = "primary" if not started else "hedge"
+        started.append(name)
+        await asyncio.sleep(0.05 if name == "primary" else 1.0)
+        return name
+
+    async def scenario():
+        slots = Slots(1)
+        result = await c.call("m", attempt, reserve=slots)
+        await asyncio.sleep(0)  # let the cancelled hedge run its done-callback
+        return result, slots.free
+
+    result, free = asyncio.run(scenario())
+    assert result == "primary" and len(started) == 2
+    assert c.counters["hedges"] == 1 and c.counters["hedge_wins"] == 0
+    assert free == 1
+
+
+def test_hedge_is_skipped_without_a_free_slot():
+    c = caller(hedge=True, hedge_min_delay=0.01)
+    fill_latency(c, 0.01)
+    attempt = Attempts("primary", delay=0.05)
+    assert asyncio.run(c.call("m", attempt, reserve=Slots(0))) == "primary"
+    assert attempt.calls == 1
+    assert c.counters["hedges_skipped"] == 1 and c.counters["hedges"] == 0
+
+
+def test_cancelling_during_the_hedge_delay_cancels_the_primary():
+    c = caller(hedge=True, hedge_min_delay=5)
+    fill_latency(c, 0.01)
+    attempt = Attempts("late", delay=10)
+
+    async def scenario():
+        task = asyncio.ensure_future(c.call("m", attempt, reserve=Slots(1)))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await asyncio.sleep(0)
+        return attempt.cancelled  # checked before asyncio.run cancels whatever is left
+
+    assert asyncio.run(scenario()) == 1
+    assert attempt.calls == 1
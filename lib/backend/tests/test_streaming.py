@@ -0,0 +1,106 @@
+import pytest
+
+from streaming import PARSE_FAILURES, FeedbackStreamParser, parse_completion
+
+FEEDBACK = '{"general_feedback": "Nice!", "grammar_corrections": ["a -> an"], "vocabulary_suggestions": []}'
+REPLY = f"Sure, a table for two.\n<feedback>{FEEDBACK}</feedback>"
+
+
+def run(chunks):
+    """Feed ``chunks`` and close; (concatenated deltas, feedback values returned, parser)."""
+    parser = FeedbackStreamParser()
+    text, feedbacks = "", []
+    for chunk in chunks:
+        delta, feedback = parser.feed(chunk)
+        text += delta
+        if feedback is not None:
+            feedbacks.append(feedback)
+    delta, feedback = parser.close()
+    text += delta
+    if feedback is not None:
+        feedbacks.append(feedback)
+    return text, feedbacks, parser
+
+
+def split_every(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 9, len(REPLY)])
+def test_tags_split_across_chunks(size):
+    text, feedbacks, parser = run(split_every(REPLY, size))
+    assert text == "Sure, a table for two."
+    assert parser.message == text
+    assert feedbacks == [{"feedback": "Nice!", "grammar_corrections": ["a -> an"], "vocabulary_suggestions": []}]
+
+
+@pytest.mark.parametrize("cut", range(1, len("<feedback>")))
+def test_open_tag_split_at_every_position(cut):
+    text, feedbacks, _ = run(["Hello there ", "<feedback>"[:cut], "<feedback>"[cut:] + FEEDBACK + "</feedback>"])
+    assert text == "Hello there"
+    assert len(feedbacks) == 1
+
+
+def test_partial_tag_is_held_back_until_resolved():
+    parser = FeedbackStreamParser()
+    assert parser.feed("Hi <feed") == ("Hi", None)
+    # Not the tag after all: the held-back text is released
+    assert parser.feed("ing time") == (" <feeding time", None)
+    assert parser.close() == ("", None)
+    assert parser.message == "Hi <feeding time"
+
+
+def test_surrounding_whitespace_is_dropped():
+    text, _, _ = run(["\n  ", "Hello", "  \n", f"<feedback>{FEEDBACK}</feedback>\n"])
+    assert text == "Hello"
+
+
+def test_text_after_feedback_is_ignored():
+    parser = FeedbackStreamParser()
+    parser.feed(REPLY)
+    assert parser.feed(" trailing words") == ("", None)
+    assert parser.close() == ("", None)
+
+
+def test_reply_without_feedback():
+    text, feedbacks, parser = run(["Just a ", "message.  "])
+    assert text == "Just a message."
+    assert feedbacks == [] and parser.feedback is None
+
+
+def test_fenced_feedback_with_trailing_comma():
+    raw = 'Okay.<feedback>```json\n{"general_feedback": "Good", "grammar_corrections": ["x",],}\n```</feedback>'
+    _, feedbacks, _ = run(split_every(raw, 4))
+    assert feedbacks == [{"feedback": "Good", "grammar_corrections": ["x"], "vocabulary_suggestions": []}]
+
+
+def test_truncated_feedback_is_parsed_at_close():
+    before = PARSE_FAILURES.value()
+    text, feedbacks, _ = run(["Okay.", '<feedback>{"general_feedback": "Good wo'])
+    assert text == "Okay."
+    assert feedbacks == [{"feedback": "Good wo", "grammar_corrections": [], "vocabulary_suggestions": []}]
+    assert PARSE_FAILURES.value() == before
+
+
+@pytest.mark.parametrize("body", ["not json at all", '{"unrelated": 1}', ""])
+def test_unusable_feedback_counts_a_parse_failure(body):
+    before = PARSE_FAILURES.value()
+    text, feedbacks, parser = run([f"Okay.<feedback>{body}</feedback>"])
+    assert text == "Okay."
+    assert feedbacks == [] and parser.feedback is None
+    assert PARSE_FAILURES.value() == before + 1
+
+
+def test_non_string_items_are_serialised():
+    raw = '<feedback>{"general_feedback": "", "grammar_corrections": [{"from": "a", "to": "an"}]}</feedback>'
+    _, feedbacks, _ = run([raw])
+    assert feedbacks[0]["grammar_corrections"] == ['{"from": "a", "to": "an"}']
+
+
+def test_parse_completion_matches_streamed_result():
+    assert parse_completion(REPLY) == {
+        "ai_message": "Sure, a table for two.",
+        "feedback": "Nice!",
+        "grammar_corrections": ["a -> an"],
+        "vocabulary_suggestions": [],
+    }
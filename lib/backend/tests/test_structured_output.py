@@ -0,0 +1,97 @@
+import pytest
+
+from structured_output import EXTRACTIONS, FAILED, OK, REPAIRED, TRUNCATED, extract_json
+
+
+@pytest.fixture
+def counted():
+    """Asserts how ``extract_json`` calls in the test moved ``structured_output_total``."""
+    kind = "test"
+    before = {outcome: EXTRACTIONS.value(kind=kind, outcome=outcome) for outcome in (OK, REPAIRED, TRUNCATED, FAILED)}
+
+    def check(**expected):
+        deltas = {outcome: EXTRACTIONS.value(kind=kind, outcome=outcome) - before[outcome] for outcome in before}
+        assert deltas == {outcome: expected.get(outcome, 0) for outcome in before}
+
+    check.kind = kind
+    return check
+
+
+def test_plain_object(counted):
+    extracted = extract_json('{"band_score": 6.5, "feedback": "ok"}', kind=counted.kind)
+    assert extracted.value == {"band_score": 6.5, "feedback": "ok"}
+    assert extracted.outcome == OK
+    counted(ok=1)
+
+
+@pytest.mark.parametrize("text", [
+    '```json\n{"a": 1, "b": [1, 2]}\n```',
+    'Here is the evaluation:\n```\n{"a": 1, "b": [1, 2]}\n```\nGood luck!',
+    '[Note] {"a": 1, "b": [1, 2]}',
+])
+def test_fences_and_surrounding_prose(counted, text):
+    extracted = extract_json(text, kind=counted.kind)
+    assert extracted.value == {"a": 1, "b": [1, 2]}
+    assert extracted.outcome == OK
+    counted(ok=1)
+
+
+def test_top_level_array(counted):
+    assert extract_json('Scores: [{"a": 1}, {"a": 2}]', kind=counted.kind).value == [{"a": 1}, {"a": 2}]
+    counted(ok=1)
+
+
+@pytest.mark.parametrize("text, value", [
+    ('{"a": 1,}', {"a": 1}),
+    ('{"a": [1, 2, ], "b": {"c": 3 ,} , }', {"a": [1, 2], "b": {"c": 3}}),
+    ('```json\n{"list": ["x",\n  ],\n}\n```', {"list": ["x"]}),
+])
+def test_trailing_commas(counted, text, value):
+    extracted = extract_json(text, kind=counted.kind)
+    assert extracted.value == value
+    assert extracted.outcome == REPAIRED
+    counted(repaired=1)
+
+
+def test_commas_and_brackets_inside_strings_are_kept(counted):
+    extracted = extract_json('{"text": "a, } ] \\" b,", "n": 1,}', kind=counted.kind)
+    assert extracted.value == {"text": 'a, } ] " b,', "n": 1}
+    counted(repaired=1)
+
+
+@pytest.mark.parametrize("text, value", [
+    # Cut inside a string value: the string and object are closed
+    ('{"feedback": "Good fluency and', {"feedback": "Good fluency and"}),
+    # Cut after an escape character: the dangling backslash is dropped
+    ('{"feedback": "say \\', {"feedback": "say "}),
+    # Cut between values, nested
+    ('{"scores": {"fluency": 6, "lexical": 7,', {"scores": {"fluency": 6, "lexical": 7}}),
+    ('{"items": ["a", "b"', {"items": ["a", "b"]}),
+    # Cut inside a key or after the colon: back to the last complete value
+    ('{"a": 1, "feedb', {"a": 1}),
+    ('{"a": 1, "b":', {"a": 1}),
+    # Cut inside a literal
+    ('{"a": 1, "b": tr', {"a": 1}),
+    ('{"a": [1, 2, 3', {"a": [1, 2, 3]}),
+    # Cut right after the opening bracket
+    ("{", {}),
+])
+def test_truncated_output(counted, text, value):
+    extracted = extract_json(text, kind=counted.kind)
+    assert extracted.value == value
+    assert extracted.outcome == TRUNCATED
+    counted(truncated=1)
+
+
+@pytest.mark.parametrize("text", ["", "no json here", '{"a" 1}', "{]", '{"a": 1]'])
+def test_unusable_output(counted, text):
+    assert extract_json(text, kind=counted.kind) is None
+    counted(failed=1)
+
+
+def test_outcomes_are_counted_per_kind(counted):
+    other = "test-other"
+    before = EXTRACTIONS.value(kind=other, outcome=OK)
+    extract_json("{}", kind=other)
+    assert EXTRACTIONS.value(kind=other, outcome=OK) == before + 1
+    counted()
@@ -0,0 +1,97 @@
+import asyncio
+import io
+import wave
+
+import pytest
+
+import stt
+from multipart_stream import ENVELOPE_BYTES, FileField, MultipartError, check_length
+
+BOUNDARY = "xXbOuNdArYxX"
+CONTENT_TYPE = f"multipart/form-data; boundary={BOUNDARY}"
+
+
+def multipart(name: str, data: bytes) -> bytes:
+    return (
+        f"--{BOUNDARY}\r\n"
+        f'Content-Disposition: form-data; name="note"\r\n\r\nhello\r\n'
+        f"--{BOUNDARY}\r\n"
+        f'Content-Disposition: form-data; name="{name}"; filename="clip.wav"\r\n'
+        "Content-Type: audio/wav\r\n\r\n"
+    ).encode() + data + f"\r\n--{BOUNDARY}--\r\n".encode()
+
+
+class Body:
+    """``request.stream()`` stand-in that counts how much of the body was read."""
+
+    def __init__(self, body: bytes, chunk: int):
+        self.chunks = [body[i:i + chunk] for i in range(0, len(body), chunk)]
+        self.read = 0
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            self.read += len(chunk)
+            yield chunk
+
+
+def read_field(body: Body, name: bytes = b"audio", max_body: int = 1 << 20):
+    async def collect():
+        field = FileField(CONTENT_TYPE, name, max_body)
+        return b"".join([data async for data in field.chunks(body)]), field.found
+
+    return asyncio.run(collect())
+
+
+@pytest.mark.parametrize("chunk", [1, 7, 64, 1 << 20])
+def test_file_field_is_extracted_from_any_chunking(chunk):
+    payload = bytes(range(256)) * 20
+    assert read_field(Body(multipart("audio", payload), chunk)) == (payload, True)
+
+
+def test_other_fields_are_skipped():
+    assert read_field(Body(multipart("file", b"data"), 16)) == (b"", False)
+
+
+def test_oversized_body_is_refused_while_streaming():
+    body = Body(multipart("audio", b"\0" * 100_000), 4096)
+    with pytest.raises(MultipartError) as error:
+        read_field(body, max_body=10_000)
+    assert error.value.too_large
+    assert body.read < 10_000 + 4096  # stopped at the cap, not after the whole body
+
+
+def test_declared_length_over_the_cap_is_refused_up_front():
+    check_length("1000", 1000)
+    check_length(None, 1000)
+    with pytest.raises(MultipartError) as error:
+        check_length(str(1000 + 1), 1000)
+    assert error.value.too_large
+
+
+def test_non_multipart_body_is_rejected():
+    with pytest.raises(MultipartError) as error:
+        FileField("application/json", b"audio", ENVELOPE_BYTES)
+    assert not error.value.too_large
+
+
+def wav(rate: int, frames: int = 1600) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as out:
+        out.setnchannels(1)
+        out.setsampwidth(2)
+        out.setframerate(rate)
+        out.writeframes(b"\0\0" * frames)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("rate", [8000, 16000, 44100, 48000])
+def test_wav_in_range_is_passed_through(rate):
+    pcm, sample_rate = asyncio.run(stt.decode_audio(wav(rate)))
+    assert sample_rate == rate and len(pcm) == 3200
+
+
+@pytest.mark.parametrize("rate", [4000, 96000])
+def test_wav_out_of_range_is_not_passed_to_the_recognizer(rate, monkeypatch):
+    monkeypatch.setattr(stt.shutil, "which", lambda name: None)  # no ffmpeg to resample with
+    with pytest.raises(stt.AudioFormatError):
+        asyncio.run(stt.decode_audio(wav(rate)))